@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+compare_results.py
+2つのベンチマーク結果（run_benchmark.py のJSON）を段階ごとに比較
+
+    python3 benchmarks/compare_results.py benchmarks/results/before.json benchmarks/results/after.json
+"""
+
+import argparse
+import json
+
+
+def load_stages(path: str) -> tuple[dict, dict[str, dict]]:
+    with open(path) as f:
+        report = json.load(f)
+    return report, {stage["stage"]: stage for stage in report["stages"]}
+
+
+def fmt(value: float | None, spec: str) -> str:
+    return "-" if value is None else format(value, spec)
+
+
+def ratio(before: float | None, after: float | None) -> str:
+    if not before or after is None:
+        return "-"
+    return f"{after / before:.2f}x"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ベンチマーク結果を比較')
+    parser.add_argument('before', help='基準の結果（JSON）')
+    parser.add_argument('after', help='比較する結果（JSON）')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='この倍率以上遅くなった段階を REGRESSION として表示')
+    args = parser.parse_args()
+
+    before, before_stages = load_stages(args.before)
+    after, after_stages = load_stages(args.after)
+
+    print(f"before: {before.get('git_revision')} ({before['created_at']})")
+    print(f"after:  {after.get('git_revision')} ({after['created_at']})")
+    if before["parameters"] != after["parameters"]:
+        print(f"注意: パラメータが異なります\n  before: {before['parameters']}\n  after:  {after['parameters']}")
+    print()
+    print(f"{'stage':<36} {'before(s)':>9} {'after(s)':>9} {'time':>7} {'rss(MB)':>15}")
+
+    regressions = 0
+    for name in list(before_stages) + [s for s in after_stages if s not in before_stages]:
+        b = before_stages.get(name, {})
+        a = after_stages.get(name, {})
+        mark = ""
+        if b.get("seconds") and a.get("seconds") and a["seconds"] / b["seconds"] >= args.threshold:
+            mark = "  REGRESSION"
+            regressions += 1
+        print(f"{name:<36} {fmt(b.get('seconds'), '.3f'):>9} {fmt(a.get('seconds'), '.3f'):>9} "
+              f"{ratio(b.get('seconds'), a.get('seconds')):>7} "
+              f"{fmt(b.get('peak_rss_mb'), '.1f'):>7}→{fmt(a.get('peak_rss_mb'), '.1f'):<7}{mark}")
+
+    print(f"\nDB: {before.get('database_size_mb')} MB → {after.get('database_size_mb')} MB")
+    if regressions:
+        print(f"{regressions} 段階が {args.threshold}倍以上遅くなりました")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+generate_library.py
+ベンチマーク用の合成Musicライブラリを生成
+
+N曲・Mスナップショット分のMusic Library XML（plist）と
+music-library-exporter-swift形式のCSVを data/snapshots と同じ構成で書き出す:
+    {out}/YYYY-MM-DD/music-library.xml
+    {out}/YYYY-MM-DD/music-library.csv
+
+スナップショットごとに churn の割合のトラックが再生され（人気曲ほど再生されやすい）、
+growth 曲ずつライブラリに追加される。seed が同じなら同じデータになる。
+"""
+
+import argparse
+import csv
+import random
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+
+FORMATS = ("xml", "csv", "both")
+
+# Play Date（整数）はMac時間（1904-01-01からの秒数）
+MAC_EPOCH = datetime(1904, 1, 1)
+
+GENRES = [
+    "Pop", "J-Pop", "Rock", "Alternative", "Dance", "Electronic", "Hip-Hop/Rap", "R&B/Soul",
+    "Jazz", "Classical", "Soundtrack", "Anime", "Singer/Songwriter", "Country", "Reggae",
+    "Blues", "Metal", "Folk", "World", "Idol",
+]
+
+KINDS = ["AAC オーディオファイル", "購入した AAC オーディオファイル", "Apple Music AAC オーディオファイル"]
+
+CSV_COLUMNS = [
+    "snapshot_date", "persistent_id", "title", "artist", "album_artist", "album", "genre", "kind",
+    "total_time", "disc_number", "disc_count", "track_number", "track_count", "year", "date_added",
+    "play_count", "last_played_date", "skip_count", "skip_date", "rating", "loved", "location",
+]
+
+XML_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE plist PUBLIC "-//Apple Computer//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">
+<plist version="1.0">
+<dict>
+\t<key>Major Version</key><integer>1</integer>
+\t<key>Minor Version</key><integer>1</integer>
+\t<key>Date</key><date>{date}</date>
+\t<key>Application Version</key><string>1.5.1.24</string>
+\t<key>Features</key><integer>5</integer>
+\t<key>Show Content Ratings</key><true/>
+\t<key>Music Folder</key><string>file:///Users/user/Music/Music/Media.localized/</string>
+\t<key>Library Persistent ID</key><string>{library_id}</string>
+\t<key>Tracks</key>
+\t<dict>
+"""
+
+
+class SyntheticLibrary:
+    """合成ライブラリの状態（トラックの属性と累積の再生数）"""
+
+    def __init__(self, tracks: int, seed: int, start: date):
+        self.rng = random.Random(seed)
+        self.library_id = f"{self.rng.getrandbits(64):016X}"
+        self.tracks: list[dict] = []
+        self.artists = max(tracks // 25, 1)
+        self.next_track_id = 1000
+        self.next_album = 0
+        self.album: dict | None = None
+        self.add_tracks(tracks, datetime.combine(start, datetime.min.time()))
+
+    def _new_album(self, added_at: datetime):
+        """アルバム単位でトラックを追加していく（アーティスト・ジャンル・年を共有）"""
+        rng = self.rng
+        artist = int(rng.paretovariate(1.2)) % self.artists
+        self.next_album += 1
+        # 一部は日本語の名前にして、マルチバイト文字の処理も計測に含める
+        if artist % 3 == 0:
+            artist_name = f"アーティスト {artist:04d}"
+            album_name = f"アルバム {self.next_album:05d}"
+        else:
+            artist_name = f"Artist {artist:04d}"
+            album_name = f"Album {self.next_album:05d}"
+        self.album = {
+            "artist": artist_name,
+            "album": album_name,
+            "genre": GENRES[artist % len(GENRES)],
+            "year": rng.randint(1970, 2025),
+            "track_count": rng.randint(1, 16),
+            "next_track": 1,
+            "added_at": added_at - timedelta(days=rng.randint(0, 3650), seconds=rng.randint(0, 86399)),
+        }
+
+    def add_tracks(self, count: int, added_at: datetime):
+        """count曲を追加"""
+        rng = self.rng
+        for _ in range(count):
+            if self.album is None or self.album["next_track"] > self.album["track_count"]:
+                self._new_album(added_at)
+            album = self.album
+            track_number = album["next_track"]
+            album["next_track"] += 1
+            # 一部の曲はフィーチャリングなどでアルバムアーティストと異なる
+            featured = rng.random() < 0.1
+            self.tracks.append({
+                "track_id": self.next_track_id,
+                "persistent_id": f"{rng.getrandbits(64):016X}",
+                "name": f"Track {self.next_track_id} {rng.choice(['Love', 'Night', 'Blue', '夢', '光', '未来'])}",
+                "artist": f"{album['artist']} feat. Guest {rng.randint(1, 50)}" if featured else album["artist"],
+                "album_artist": album["artist"] if featured or rng.random() < 0.5 else None,
+                "album": album["album"],
+                "genre": album["genre"],
+                "kind": rng.choice(KINDS),
+                "total_time": rng.randint(90_000, 420_000),
+                "disc_number": 1,
+                "disc_count": 1,
+                "track_number": track_number,
+                "track_count": album["track_count"],
+                "year": album["year"],
+                "date_added": album["added_at"],
+                "play_count": 0,
+                "play_date_utc": None,
+                "skip_count": 0,
+                "skip_date": None,
+                "rating": rng.choice([None, None, None, 20, 40, 60, 80, 100]),
+                "loved": rng.random() < 0.05,
+                # 再生されやすさ（少数の曲に再生が集中するパレート分布）
+                "weight": rng.paretovariate(1.2),
+            })
+            self.next_track_id += 1
+
+    def seed_history(self, max_plays: int):
+        """最初のスナップショットまでの累積再生数を与える"""
+        rng = self.rng
+        for track in self.tracks:
+            plays = int(min(max_plays, 5 * track["weight"]) * rng.random())
+            if plays:
+                track["play_count"] = plays
+                track["play_date_utc"] = track["date_added"] + timedelta(days=rng.randint(0, 300))
+            if rng.random() < 0.2:
+                track["skip_count"] = rng.randint(1, 10)
+                track["skip_date"] = track["date_added"] + timedelta(days=rng.randint(0, 300))
+
+    def play(self, churn: float, snapshot_at: datetime):
+        """churnの割合のトラックを再生する（人気曲ほど選ばれやすい）"""
+        rng = self.rng
+        played = rng.choices(self.tracks, weights=[t["weight"] for t in self.tracks],
+                             k=int(len(self.tracks) * churn))
+        for track in played:
+            track["play_count"] += rng.randint(1, 3)
+            track["play_date_utc"] = snapshot_at - timedelta(seconds=rng.randint(60, 86_000))
+            if rng.random() < 0.05:
+                track["skip_count"] += 1
+                track["skip_date"] = track["play_date_utc"]
+
+
+def _plist_date(value: datetime) -> str:
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def write_xml(path: Path, library: SyntheticLibrary, snapshot_at: datetime):
+    """Music Library XMLを書き出す（Tracksのあとに全曲のプレイリストを付ける）"""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(XML_HEADER.format(date=_plist_date(snapshot_at), library_id=library.library_id))
+        for t in library.tracks:
+            fields = [
+                ("Track ID", "integer", t["track_id"]),
+                ("Name", "string", escape(t["name"])),
+                ("Artist", "string", escape(t["artist"])),
+                ("Album Artist", "string", escape(t["album_artist"]) if t["album_artist"] else None),
+                ("Album", "string", escape(t["album"])),
+                ("Genre", "string", escape(t["genre"])),
+                ("Kind", "string", t["kind"]),
+                ("Total Time", "integer", t["total_time"]),
+                ("Disc Number", "integer", t["disc_number"]),
+                ("Disc Count", "integer", t["disc_count"]),
+                ("Track Number", "integer", t["track_number"]),
+                ("Track Count", "integer", t["track_count"]),
+                ("Year", "integer", t["year"]),
+                ("Date Added", "date", _plist_date(t["date_added"])),
+                ("Play Count", "integer", t["play_count"] or None),
+                ("Play Date", "integer",
+                 int((t["play_date_utc"] - MAC_EPOCH).total_seconds()) if t["play_date_utc"] else None),
+                ("Play Date UTC", "date", _plist_date(t["play_date_utc"]) if t["play_date_utc"] else None),
+                ("Skip Count", "integer", t["skip_count"] or None),
+                ("Skip Date", "date", _plist_date(t["skip_date"]) if t["skip_date"] else None),
+                ("Rating", "integer", t["rating"]),
+                ("Persistent ID", "string", t["persistent_id"]),
+                ("Track Type", "string", "File"),
+                ("Location", "string", f"file:///Users/user/Music/Music/Media.localized/Music/{t['track_id']}.m4a"),
+            ]
+            f.write(f"\t\t<key>{t['track_id']}</key>\n\t\t<dict>\n")
+            for key, kind, value in fields:
+                if value is not None:
+                    f.write(f"\t\t\t<key>{key}</key><{kind}>{value}</{kind}>\n")
+            if t["loved"]:
+                f.write("\t\t\t<key>Loved</key><true/>\n")
+            f.write("\t\t</dict>\n")
+        f.write("\t</dict>\n\t<key>Playlists</key>\n\t<array>\n\t\t<dict>\n")
+        f.write("\t\t\t<key>Name</key><string>ライブラリ</string>\n")
+        f.write("\t\t\t<key>Master</key><true/>\n\t\t\t<key>Playlist Items</key>\n\t\t\t<array>\n")
+        for t in library.tracks:
+            f.write(f"\t\t\t\t<dict>\n\t\t\t\t\t<key>Track ID</key><integer>{t['track_id']}</integer>\n\t\t\t\t</dict>\n")
+        f.write("\t\t\t</array>\n\t\t</dict>\n\t</array>\n</dict>\n</plist>\n")
+
+
+def write_csv(path: Path, library: SyntheticLibrary, snapshot_at: datetime):
+    """music-library-exporter-swift形式のCSVを書き出す"""
+    snapshot_date = _plist_date(snapshot_at)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_COLUMNS)
+        for t in library.tracks:
+            writer.writerow([
+                snapshot_date, t["persistent_id"], t["name"], t["artist"], t["album_artist"] or "",
+                t["album"], t["genre"], t["kind"], t["total_time"], t["disc_number"], t["disc_count"],
+                t["track_number"], t["track_count"], t["year"], _plist_date(t["date_added"]),
+                t["play_count"],
+                _plist_date(t["play_date_utc"]) if t["play_date_utc"] else "",
+                t["skip_count"],
+                _plist_date(t["skip_date"]) if t["skip_date"] else "",
+                t["rating"] or "",
+                "true" if t["loved"] else "false",
+                f"file:///Users/user/Music/Music/Media.localized/Music/{t['track_id']}.m4a",
+            ])
+
+
+def generate(out_dir: str, tracks: int, snapshots: int, churn: float = 0.02, growth: int = 0,
+             fmt: str = "xml", start: date = date(2024, 1, 1), interval_days: int = 1,
+             seed: int = 42) -> list[Path]:
+    """合成ライブラリのスナップショットを書き出し、スナップショットのディレクトリ一覧を返す"""
+    library = SyntheticLibrary(tracks, seed, start)
+    library.seed_history(max_plays=200)
+
+    written = []
+    for i in range(snapshots):
+        snapshot_at = datetime.combine(start + timedelta(days=i * interval_days), datetime.min.time()) \
+            + timedelta(hours=12)
+        if i > 0:
+            library.add_tracks(growth, snapshot_at)
+            library.play(churn, snapshot_at)
+
+        snapshot_dir = Path(out_dir) / snapshot_at.date().isoformat()
+        snapshot_dir.mkdir(parents=True, exist_ok=True)
+        if fmt in ("xml", "both"):
+            write_xml(snapshot_dir / "music-library.xml", library, snapshot_at)
+        if fmt in ("csv", "both"):
+            write_csv(snapshot_dir / "music-library.csv", library, snapshot_at)
+        written.append(snapshot_dir)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ベンチマーク用の合成Musicライブラリを生成')
+    parser.add_argument('out_dir', help='出力先ディレクトリ')
+    parser.add_argument('--tracks', type=int, default=10_000, help='最初のスナップショットの曲数')
+    parser.add_argument('--snapshots', type=int, default=30, help='スナップショット数')
+    parser.add_argument('--churn', type=float, default=0.02,
+                        help='スナップショットごとに再生されるトラックの割合')
+    parser.add_argument('--growth', type=int, default=0, help='スナップショットごとに追加される曲数')
+    parser.add_argument('--format', choices=FORMATS, default='xml', help='出力形式')
+    parser.add_argument('--start', type=date.fromisoformat, default=date(2024, 1, 1),
+                        help='最初のスナップショットの日付（YYYY-MM-DD）')
+    parser.add_argument('--interval-days', type=int, default=1, help='スナップショットの間隔（日）')
+    parser.add_argument('--seed', type=int, default=42, help='乱数のシード')
+    args = parser.parse_args()
+
+    written = generate(args.out_dir, args.tracks, args.snapshots, args.churn, args.growth,
+                       args.format, args.start, args.interval_days, args.seed)
+    print(f"Generated {len(written)} snapshots in {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+run_benchmark.py
+パイプライン全体のベンチマーク
+
+合成ライブラリ（generate_library.py）を作業ディレクトリに生成し、次の段階を計測する:
+    parse     各スナップショットのパース
+    load      load_to_duckdb（--storage lake のときは load_to_lake）
+    dbt:*     dbt run をレイヤーごとに（bronze → silver → gold → platinum）
+    query:*   platinum_* ビューの SELECT *
+
+各段階は子プロセスで実行し、経過時間・ピークRSS（os.wait4 の ru_maxrss）・rows/s を
+JSONに保存する。結果は compare_results.py でコミット間の比較ができる。
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+from pathlib import Path
+
+import duckdb
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+PROJECT_DIR = BENCHMARK_DIR.parent
+SCRIPTS_DIR = PROJECT_DIR / "scripts"
+RESULTS_DIR = BENCHMARK_DIR / "results"
+
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+import load_csv_snapshot  # noqa: E402
+import load_xml_snapshot  # noqa: E402
+from generate_library import generate  # noqa: E402
+
+# dbtプロジェクトとして作業ディレクトリにコピーするもの
+DBT_PROJECT_FILES = ["dbt_project.yml", "profiles.yml", "models", "macros", "tests"]
+
+# レイヤーとそのモデル名の接頭辞
+LAYERS = {
+    "bronze": ("bronze_",),
+    "silver": ("silver_",),
+    "gold": ("dim_", "fact_"),
+    "platinum": ("platinum_",),
+}
+
+DB_FILE = "music_replay.duckdb"
+LAKE_DIR = "data/lake"
+
+
+# --- 子プロセスで実行する計測 ------------------------------------------------
+
+def snapshot_files(data_dir: str, fmt: str) -> list[Path]:
+    """スナップショットのファイル一覧（日付順）"""
+    return sorted(Path(data_dir).glob(f"*/music-library.{fmt}"))
+
+
+def parse_file(path: Path, fmt: str):
+    """1ファイルをパースし、(snapshot_date, tracks, 行数) を返す"""
+    if fmt == "csv":
+        snapshot_date, tracks = load_csv_snapshot.parse_csv_library(str(path))
+        return snapshot_date, tracks, len(tracks)
+    snapshot_date, tracks = load_xml_snapshot.parse_music_library(str(path))
+    return snapshot_date, tracks, tracks.num_rows
+
+
+def worker_parse(args) -> dict:
+    """全スナップショットをパースする"""
+    rows = 0
+    started = time.perf_counter()
+    for path in snapshot_files(args.data, args.format):
+        _, _, count = parse_file(path, args.format)
+        rows += count
+    return {"seconds": time.perf_counter() - started, "rows": rows}
+
+
+def worker_load(args) -> dict:
+    """全スナップショットをロードする（計測はロード部分だけ）"""
+    loader = load_csv_snapshot if args.format == "csv" else load_xml_snapshot
+    rows = 0
+    seconds = 0.0
+    for path in snapshot_files(args.data, args.format):
+        snapshot_date, tracks, count = parse_file(path, args.format)
+        started = time.perf_counter()
+        with redirect_stdout(open(os.devnull, "w")):
+            if args.storage == "lake":
+                loader.load_to_lake(args.lake, snapshot_date, str(path), tracks)
+            else:
+                loader.load_to_duckdb(args.db, snapshot_date, str(path), tracks, args.storage)
+        seconds += time.perf_counter() - started
+        rows += count
+    return {"seconds": seconds, "rows": rows}
+
+
+def worker_query(args) -> dict:
+    """1つのplatinumビューを repeat 回実行し、中央値を返す"""
+    con = duckdb.connect(args.db, read_only=True)
+    timings = []
+    rows = 0
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        rows = len(con.execute(f"SELECT * FROM {args.relation}").fetchall())
+        timings.append(time.perf_counter() - started)
+    con.close()
+    timings.sort()
+    return {"seconds": timings[len(timings) // 2], "rows": rows}
+
+
+WORKERS = {"parse": worker_parse, "load": worker_load, "query": worker_query}
+
+
+# --- 親プロセス ----------------------------------------------------------------
+
+def max_rss_mb(rusage) -> float:
+    """ru_maxrss をMBに変換（Linuxはキロバイト、macOSはバイト）"""
+    scale = 1 if sys.platform == "darwin" else 1024
+    return rusage.ru_maxrss * scale / 1e6
+
+
+def run_measured(command: list[str], cwd: Path, log_path: Path | None = None) -> tuple[str, float, float]:
+    """子プロセスを実行し、(標準出力, 経過時間, ピークRSS[MB]) を返す"""
+    log = open(log_path, "a") if log_path else None
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=cwd, stdout=log or subprocess.PIPE, text=True)
+    output = "" if log else process.stdout.read()
+    # wait4 でこの子プロセス自身のリソース使用量を取得する
+    _, status, rusage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if log:
+        log.close()
+    if process.returncode != 0:
+        where = f"（ログ: {log_path}）" if log_path else ""
+        raise RuntimeError(f"{' '.join(command)} が失敗しました{where}")
+    return output, elapsed, max_rss_mb(rusage)
+
+
+def run_worker(name: str, workdir: Path, options: list[str]) -> tuple[dict, float]:
+    """このスクリプトを --worker で起動し、計測結果とピークRSSを返す"""
+    command = [sys.executable, str(Path(__file__).resolve()), "--worker", name] + options
+    output, _, rss = run_measured(command, workdir)
+    return json.loads(output.strip().splitlines()[-1]), rss
+
+
+def stage_result(stage: str, seconds: float, rows: int, rss_mb: float) -> dict:
+    result = {
+        "stage": stage,
+        "seconds": round(seconds, 4),
+        "rows": rows,
+        "rows_per_second": round(rows / seconds, 1) if seconds > 0 else None,
+        "peak_rss_mb": round(rss_mb, 1),
+    }
+    print(f"{stage:<36} {result['seconds']:>9.3f}s {rows:>12,} rows "
+          f"{result['rows_per_second'] or 0:>14,.0f} rows/s {result['peak_rss_mb']:>8.1f} MB")
+    return result
+
+
+def layer_rows(db_path: Path, layer: str) -> int:
+    """レイヤーのテーブル・ビューの行数の合計"""
+    con = duckdb.connect(str(db_path), read_only=True)
+    relations = [row[0] for row in con.execute("""
+        SELECT table_name FROM information_schema.tables
+        WHERE table_schema = 'main'
+    """).fetchall() if row[0].startswith(LAYERS[layer])]
+    rows = sum(con.execute(f"SELECT COUNT(*) FROM {r}").fetchone()[0] for r in relations)
+    con.close()
+    return rows
+
+
+def model_timings(workdir: Path) -> dict[str, float]:
+    """直前の dbt run のモデルごとの実行時間（target/run_results.json）"""
+    run_results = json.loads((workdir / "target" / "run_results.json").read_text())
+    return {
+        result["unique_id"].split(".")[-1]: round(result["execution_time"], 4)
+        for result in run_results["results"]
+    }
+
+
+def git_revision() -> str | None:
+    """計測したコミット（未コミットの変更があれば -dirty を付ける）"""
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_DIR,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=PROJECT_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{revision}-dirty" if dirty else revision
+
+
+def run_benchmark(args) -> dict:
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="music-replay-bench-")).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    data_dir = Path(args.data).resolve() if args.data else workdir / "snapshots"
+    db_path = workdir / DB_FILE
+    lake_dir = workdir / LAKE_DIR
+    dbt_log = workdir / "dbt.log"
+    if db_path.exists():
+        db_path.unlink()
+    shutil.rmtree(lake_dir, ignore_errors=True)
+
+    # dbtプロジェクトを作業ディレクトリにコピー（target/ や logs/ をリポジトリに残さない）
+    for name in DBT_PROJECT_FILES:
+        source = PROJECT_DIR / name
+        target = workdir / name
+        if source.is_dir():
+            shutil.rmtree(target, ignore_errors=True)
+            shutil.copytree(source, target)
+        elif source.exists():
+            shutil.copy2(source, target)
+
+    print(f"作業ディレクトリ: {workdir}")
+    if not args.data:
+        started = time.perf_counter()
+        generate(str(data_dir), args.tracks, args.snapshots, args.churn, args.growth,
+                 args.format, seed=args.seed)
+        print(f"合成ライブラリを生成しました（{time.perf_counter() - started:.1f}s）\n")
+
+    stages = []
+    common = ["--data", str(data_dir), "--format", args.format]
+
+    result, rss = run_worker("parse", workdir, common)
+    stages.append(stage_result("parse", result["seconds"], result["rows"], rss))
+
+    result, rss = run_worker("load", workdir, common + [
+        "--db", str(db_path), "--storage", args.storage, "--lake", str(lake_dir)])
+    stages.append(stage_result("load", result["seconds"], result["rows"], rss))
+
+    dbt_vars = json.dumps({"raw_storage": args.storage, "raw_lake_path": str(lake_dir)})
+    for layer in LAYERS:
+        _, elapsed, rss = run_measured(
+            [args.dbt, "run", "--profiles-dir", ".", "--vars", dbt_vars, "--select", f"path:models/{layer}"],
+            workdir, dbt_log)
+        stage = stage_result(f"dbt:{layer}", elapsed, layer_rows(db_path, layer), rss)
+        stage["models"] = model_timings(workdir)
+        stages.append(stage)
+
+    con = duckdb.connect(str(db_path), read_only=True)
+    relations = [row[0] for row in con.execute("""
+        SELECT table_name FROM information_schema.tables
+        WHERE table_schema = 'main' AND table_name LIKE 'platinum\\_%' ESCAPE '\\'
+        ORDER BY table_name
+    """).fetchall()]
+    con.close()
+    for relation in relations:
+        result, rss = run_worker("query", workdir, [
+            "--db", str(db_path), "--relation", relation, "--repeat", str(args.repeat)])
+        stages.append(stage_result(f"query:{relation}", result["seconds"], result["rows"], rss))
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "parameters": {
+            "tracks": args.tracks,
+            "snapshots": args.snapshots,
+            "churn": args.churn,
+            "growth": args.growth,
+            "format": args.format,
+            "storage": args.storage,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "data": str(data_dir) if args.data else None,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "duckdb": duckdb.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "database_size_mb": round(db_path.stat().st_size / 1e6, 1),
+        "stages": stages,
+    }
+
+    if not args.keep and not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='合成ライブラリでパイプライン全体を計測')
+    parser.add_argument('--tracks', type=int, default=10_000, help='曲数')
+    parser.add_argument('--snapshots', type=int, default=30, help='スナップショット数')
+    parser.add_argument('--churn', type=float, default=0.02,
+                        help='スナップショットごとに再生されるトラックの割合')
+    parser.add_argument('--growth', type=int, default=0, help='スナップショットごとに追加される曲数')
+    parser.add_argument('--format', choices=['xml', 'csv'], default='xml', help='入力形式')
+    parser.add_argument('--storage', choices=['full', 'compact', 'lake'], default='full',
+                        help='ロード先の形式（scripts/*.py の --storage）')
+    parser.add_argument('--seed', type=int, default=42, help='乱数のシード')
+    parser.add_argument('--repeat', type=int, default=5, help='platinumクエリの繰り返し回数（中央値を記録）')
+    parser.add_argument('--data', help='生成せずに既存のスナップショットディレクトリを使う')
+    parser.add_argument('--workdir', help='作業ディレクトリ（省略時は一時ディレクトリ）')
+    parser.add_argument('--keep', action='store_true', help='一時ディレクトリを削除しない')
+    parser.add_argument('--dbt', default='dbt', help='dbtコマンド')
+    parser.add_argument('--output', help='結果のJSONファイル（省略時は benchmarks/results/）')
+    # 子プロセス用
+    parser.add_argument('--worker', choices=list(WORKERS), help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    parser.add_argument('--lake', help=argparse.SUPPRESS)
+    parser.add_argument('--relation', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(WORKERS[args.worker](args)))
+        return
+
+    report = run_benchmark(args)
+
+    output = Path(args.output) if args.output else RESULTS_DIR / (
+        f"{datetime.now():%Y%m%d-%H%M%S}-{report['git_revision'] or 'unknown'}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n")
+    print(f"\nDB: {report['database_size_mb']} MB")
+    print(f"結果: {output}")
+
+
+if __name__ == "__main__":
+    main()
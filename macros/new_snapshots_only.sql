@@ -0,0 +1,74 @@
+{#
+    incrementalモデルで処理対象のスナップショットを絞り込む条件
+
+    ライブラリ（library_id）ごとに、既存テーブルでのそのライブラリの最新スナップショット日以降
+    （最新日を含む）だけを対象にする。既存テーブルにまだないライブラリは全期間が対象。
+    最新日を含めるのは、同じ日付のスナップショットを再ロードした場合に追従するため。
+    unique_key=['library_id', 'snapshot_date'] の delete+insert と組み合わせて使う。
+    最新日より古いスナップショットを後から追加した場合は --full-refresh が必要。
+
+    dbt var の library_ids（例: --vars '{library_ids: [alice]}'）を指定すると、
+    incremental実行ではそのライブラリだけを処理し、他のライブラリの行は読み直さない。
+
+    最新日はコンパイル時に取得して定数で埋め込む。サブクエリのままだと
+    Parquetレイクのパーティションやゾーンマップによる読み飛ばしが効かないため。
+    this_column は既存テーブル側の日付列（キーマップでは first_snapshot_date）。
+    library_column は絞り込む側のライブラリIDの列。
+
+    watermark には、同じスナップショットをこのモデルの後に処理するモデル名を指定する
+    （キーマップでは silver_tracks）。キーマップは新しい値がなければ行が増えないため、
+    first_snapshot_date の最大では「最後に新しい値が現れた日」までしか進まない。
+    watermark のモデルの snapshot_date の最大（前回の実行で処理済みの日）の方が新しければそちらを使う。
+#}
+{% macro new_snapshots_only(column='snapshot_date', this_column='snapshot_date', library_column='library_id',
+                            watermark=none) -%}
+    {%- if is_incremental() -%}
+        {%- set selected = var('library_ids', none) -%}
+        {%- if selected is string -%}
+            {%- set selected = [selected] -%}
+        {%- elif selected is not none -%}
+            {%- set selected = selected | map('string') | list -%}
+        {%- endif -%}
+        {%- set conditions = [] -%}
+        {%- set known = [] -%}
+        {%- if execute -%}
+            {%- set processed = 'SELECT library_id, ' ~ this_column ~ ' AS processed_date FROM ' ~ this -%}
+            {%- if watermark is not none -%}
+                {%- set watermark_relation = adapter.get_relation(
+                    database=this.database, schema=this.schema, identifier=watermark) -%}
+                {%- if watermark_relation is not none -%}
+                    {%- set processed = processed ~ ' UNION ALL SELECT library_id, snapshot_date FROM '
+                        ~ watermark_relation ~ ' WHERE library_id IN (SELECT library_id FROM ' ~ this ~ ')' -%}
+                {%- endif -%}
+            {%- endif -%}
+            {%- set rows = run_query(
+                'SELECT library_id, MAX(processed_date) FROM (' ~ processed ~ ') GROUP BY library_id ORDER BY library_id'
+            ).rows -%}
+            {%- for row in rows -%}
+                {%- set library = "'" ~ (row[0] | replace("'", "''")) ~ "'" -%}
+                {%- do known.append(library) -%}
+                {%- if selected is none or row[0] in selected -%}
+                    {%- do conditions.append(
+                        '(' ~ library_column ~ ' = ' ~ library ~ ' AND ' ~ column ~ " >= DATE '" ~ row[1] ~ "')"
+                    ) -%}
+                {%- endif -%}
+            {%- endfor -%}
+        {%- endif -%}
+        {#- 既存テーブルにまだないライブラリ -#}
+        {%- set new_libraries = [] -%}
+        {%- if selected is not none -%}
+            {%- set quoted = [] -%}
+            {%- for library_id in selected -%}
+                {%- do quoted.append("'" ~ (library_id | replace("'", "''")) ~ "'") -%}
+            {%- endfor -%}
+            {%- do new_libraries.append(library_column ~ ' IN (' ~ (quoted | join(', ') or 'NULL') ~ ')') -%}
+        {%- endif -%}
+        {%- if known -%}
+            {%- do new_libraries.append(library_column ~ ' NOT IN (' ~ known | join(', ') ~ ')') -%}
+        {%- endif -%}
+        {%- do conditions.append('(' ~ (new_libraries | join(' AND ') or 'TRUE') ~ ')') -%}
+        ({{ conditions | join(' OR ') }})
+    {%- else -%}
+        TRUE
+    {%- endif -%}
+{%- endmacro %}
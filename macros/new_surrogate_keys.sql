@@ -0,0 +1,39 @@
+{#
+    キーマップ（名前 → 整数のサロゲートキー）に追加する行を返す
+
+    values_cte（value_columns と snapshot_date を持つ）の値のうち、
+    キーマップ（{{ this }}）にまだない値にだけ既存の最大キーの続きから番号を振る。
+    キーは1からの連番のINTEGERで、文字列よりも結合・集計が速く、列も小さく圧縮される。
+    value_columns に library_id を含めてライブラリごとの値にキーを振る（キー自体は全ライブラリで一意）。
+    一度振ったキーは変わらないため、silver以降のincrementalモデルに保存したキーとも一致し続ける。
+    --full-refresh では値の順に振り直す（下流も合わせて再作成すること）。
+    incremental_strategy='append' のincrementalモデルで使う。
+#}
+{% macro new_surrogate_keys(key_column, value_columns, values_cte) -%}
+    SELECT
+        CAST(
+            {% if is_incremental() -%}
+            (SELECT COALESCE(MAX({{ key_column }}), 0) FROM {{ this }})
+            {%- else -%}
+            0
+            {%- endif %} + ROW_NUMBER() OVER (
+                ORDER BY {{ value_columns | join(', ') }}
+            ) AS INTEGER
+        ) AS {{ key_column }},
+        v.*
+    FROM (
+        SELECT
+            {{ value_columns | join(',\n            ') }},
+            -- 値が最初に現れたスナップショット日（次回の読み込み範囲の目安）
+            MIN(snapshot_date) AS first_snapshot_date
+        FROM {{ values_cte }}
+        GROUP BY {{ value_columns | join(', ') }}
+    ) AS v
+    {%- if is_incremental() %}
+    ANTI JOIN {{ this }} AS k
+        ON
+        {%- for column in value_columns %}
+        {% if not loop.first %}AND {% endif %}k.{{ column }} IS NOT DISTINCT FROM v.{{ column }}
+        {%- endfor %}
+    {%- endif %}
+{%- endmacro %}
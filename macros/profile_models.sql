@@ -0,0 +1,46 @@
+{#
+    モデルごとのクエリプロファイル（DuckDBのJSONプロファイル）を保存する
+
+    dbt var の profile_models を true にすると（例: --vars '{profile_models: true}'）、
+    各モデルのクエリを enable_profiling = 'json' で実行し、演算子ごとの時間・行数と
+    クエリ全体のメモリを target/model_profile.<invocation_id>.<モデル名>.json に書き出す。
+    scripts/load_model_profiles.py が run_results.json と合わせて model_profile テーブルに取り込む。
+
+    DuckDBはクエリごとにプロファイルのファイルを上書きするため、dbtが続けて実行する
+    メタデータの問い合わせや delete+insert に上書きされないよう、
+    table / incremental はモデルのSQLを実行する CREATE TABLE AS だけを囲む。
+    view は作成しても計算しないので、作成後にビューの全行を読むクエリを計測する。
+    DuckDBは出力先のディレクトリを作らないので、dbt実行中に必ずある target/ に書く。
+#}
+{% macro model_profile_path() -%}
+    target/model_profile.{{ invocation_id }}.{{ model.name }}.json
+{%- endmacro %}
+
+{% macro profiling_enabled() -%}
+    {{ return(var('profile_models', false) and model is defined and model.resource_type == 'model') }}
+{%- endmacro %}
+
+{% macro profile_statement(sql) -%}
+    PRAGMA enable_profiling = 'json';
+    SET profiling_output = '{{ model_profile_path() }}';
+    {{ sql }}
+    ;
+    PRAGMA disable_profiling
+{%- endmacro %}
+
+{# table / incremental: モデルのSQLを実行する CREATE TABLE AS をプロファイルで囲む #}
+{% macro duckdb__create_table_as(temporary, relation, compiled_code, language='sql') -%}
+    {%- set create_sql = dbt.duckdb__create_table_as(temporary, relation, compiled_code, language) -%}
+    {%- if language == 'sql' and profiling_enabled() -%}
+        {{ profile_statement(create_sql) }}
+    {%- else -%}
+        {{ create_sql }}
+    {%- endif -%}
+{%- endmacro %}
+
+{# view: post-hook でビューの全行を読むクエリを計測する #}
+{% macro profile_view() -%}
+    {%- if profiling_enabled() and config.get('materialized') == 'view' -%}
+        {{ profile_statement('SELECT * FROM ' ~ this) }}
+    {%- endif -%}
+{%- endmacro %}
@@ -0,0 +1,12 @@
+{#
+    スナップショットごとの全件を持つrawデータのソース
+    raw_storage が lake のときはParquetレイク、それ以外は raw_itunes_library テーブル
+    （compact形式は変化行のみのため、各モデルで別に扱う）
+#}
+{% macro raw_itunes_library() -%}
+    {%- if var('raw_storage') == 'lake' -%}
+        {{ source('itunes', 'raw_itunes_library_lake') }}
+    {%- else -%}
+        {{ source('itunes', 'raw_itunes_library') }}
+    {%- endif -%}
+{%- endmacro %}
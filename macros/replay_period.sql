@@ -0,0 +1,273 @@
+{#
+    期間別Replayのクエリ
+
+    期間の再生数は、ライブラリごとに dim_period で求めた2つのスナップショットの間
+    （start_snapshot_date < snapshot_date <= end_snapshot_date）の差分だけを集計する。
+    fact_play_count_snapshot はライブラリ・snapshot_date 順に格納しているため、
+    ライブラリと日付が定数で渡ればゾーンマップで範囲外の行グループを読み飛ばせる。
+    結果はどれもライブラリごと（library_id 列付き）で、ランキングはライブラリ内の順位。
+
+    同じSQLを2か所で使う
+      - platinum_period_* モデル: dbt var（replay_period_type / replay_period_start）の期間を
+        全ライブラリについて1回で集計する
+      - DuckDBのテーブルマクロ（on-run-endで作成）: 任意のライブラリ・期間をノートブック等から問い合わせる
+#}
+
+{#
+    1ライブラリの期間（start_snapshot_date < snapshot_date <= end_snapshot_date）の条件
+    start_snapshot_date が NULL なら最初のスナップショットから
+#}
+{% macro period_snapshot_filter(library_id, start_snapshot_date, end_snapshot_date) -%}
+    (library_id = {{ library_id }}
+        AND snapshot_date > COALESCE({{ start_snapshot_date }}, DATE '0001-01-01')
+        AND snapshot_date <= {{ end_snapshot_date }})
+{%- endmacro %}
+
+
+{% macro period_track_plays(fact_relation, track_relation, period_filter) %}
+    WITH
+    period_deltas AS (
+        SELECT
+            library_id,
+            track_key,
+            SUM(
+                CASE
+                    WHEN play_count_delta > 0 THEN play_count_delta
+                    ELSE 0
+                END
+            ) AS play_count,
+            SUM(
+                CASE
+                    WHEN play_count_delta > 0 THEN play_count_delta * duration_min
+                    ELSE 0
+                END
+            ) AS listening_minutes
+        FROM {{ fact_relation }}
+        WHERE play_count_delta IS NOT NULL
+            AND ({{ period_filter }})
+        GROUP BY
+            library_id,
+            track_key
+    )
+
+    -- トラックの属性は materialize 済みの fact_track_plays から引く
+    SELECT
+        p.library_id,
+        p.track_key,
+        t.artist_key,
+        t.album_key,
+        t.title,
+        t.artist_name,
+        t.album_artist_name,
+        t.album_name,
+        t.genre,
+        t.duration_min,
+        p.play_count,
+        p.listening_minutes
+    FROM period_deltas AS p
+    LEFT JOIN {{ track_relation }} AS t
+        ON p.track_key = t.track_key
+{% endmacro %}
+
+
+{% macro period_summary(track_plays_sql) %}
+    WITH
+    track_plays AS (
+        {{ track_plays_sql }}
+    )
+
+    SELECT
+        library_id,
+        SUM(listening_minutes) AS total_listening_minutes,
+        ROUND(SUM(listening_minutes) / 60.0, 1) AS total_listening_hours,
+        SUM(play_count) AS total_plays,
+        COUNT(DISTINCT CASE WHEN play_count > 0 THEN track_key END) AS unique_tracks_played,
+        COUNT(DISTINCT CASE WHEN play_count > 0 THEN artist_key END) AS unique_artists_played,
+        COUNT(DISTINCT CASE WHEN play_count > 0 THEN album_name END) AS unique_albums_played
+    FROM track_plays
+    GROUP BY library_id
+    ORDER BY library_id
+{% endmacro %}
+
+
+{% macro period_top_songs(track_plays_sql) %}
+    WITH
+    track_plays AS (
+        {{ track_plays_sql }}
+    )
+
+    SELECT
+        library_id,
+        title,
+        artist_name,
+        album_name,
+        duration_min,
+        play_count,
+        ROUND(play_count * duration_min, 0) AS listening_minutes,
+        RANK() OVER (PARTITION BY library_id ORDER BY play_count DESC) AS rank
+    FROM track_plays
+    WHERE play_count > 0
+    ORDER BY library_id, rank
+{% endmacro %}
+
+
+{% macro period_top_artists(track_plays_sql) %}
+    WITH
+    track_plays AS (
+        {{ track_plays_sql }}
+    ),
+
+    artist_plays AS (
+        SELECT
+            library_id,
+            artist_key,
+            ANY_VALUE(artist_name) AS artist_name,
+            SUM(play_count) AS play_count,
+            SUM(listening_minutes) AS listening_minutes,
+            -- 期間に再生したトラック数（compact形式でも再生があれば変化行があるため保存形式で変わらない）
+            COUNT(*) FILTER (WHERE play_count > 0) AS unique_tracks_played
+        FROM track_plays
+        WHERE artist_key IS NOT NULL
+        GROUP BY library_id, artist_key
+    )
+
+    SELECT
+        library_id,
+        artist_name,
+        play_count,
+        ROUND(listening_minutes, 0) AS listening_minutes,
+        unique_tracks_played,
+        RANK() OVER (PARTITION BY library_id ORDER BY play_count DESC) AS rank
+    FROM artist_plays
+    WHERE play_count > 0
+    ORDER BY library_id, rank
+{% endmacro %}
+
+
+{% macro period_top_albums(track_plays_sql) %}
+    WITH
+    track_plays AS (
+        {{ track_plays_sql }}
+    ),
+
+    album_plays AS (
+        SELECT
+            library_id,
+            album_key,
+            ANY_VALUE(album_name) AS album_name,
+            ANY_VALUE(COALESCE(album_artist_name, artist_name)) AS artist_name,
+            SUM(play_count) AS play_count,
+            SUM(listening_minutes) AS listening_minutes,
+            -- 期間に再生したトラック数（compact形式でも再生があれば変化行があるため保存形式で変わらない）
+            COUNT(*) FILTER (WHERE play_count > 0) AS unique_tracks_played
+        FROM track_plays
+        WHERE album_key IS NOT NULL
+        GROUP BY library_id, album_key
+    )
+
+    SELECT
+        library_id,
+        album_name,
+        artist_name,
+        play_count,
+        ROUND(listening_minutes, 0) AS listening_minutes,
+        unique_tracks_played,
+        RANK() OVER (PARTITION BY library_id ORDER BY play_count DESC) AS rank
+    FROM album_plays
+    WHERE play_count > 0
+    ORDER BY library_id, rank
+{% endmacro %}
+
+
+{#
+    dbt varで指定した期間の行を、ライブラリごとに dim_period から引く
+    replay_period_start を省略すると、ライブラリごとに最新スナップショットを含む期間になる
+    戻り値
+      period_type: 期間の単位
+      filter:      fact_play_count_snapshot の行を全ライブラリの期間に絞る条件（日付は定数）
+      periods:     ライブラリごとの期間（library_id, period_start, period_end）を返すSQL
+#}
+{% macro replay_period_brackets() %}
+    {%- set period_type = var('replay_period_type') -%}
+    {%- set period_start = var('replay_period_start') -%}
+    {%- if period_type not in ['year', 'month', 'week'] -%}
+        {{ exceptions.raise_compiler_error("replay_period_type は year / month / week のいずれかを指定してください: " ~ period_type) }}
+    {%- endif -%}
+
+    {%- set bracket_query -%}
+        SELECT
+            library_id,
+            period_start,
+            period_end,
+            start_snapshot_date,
+            end_snapshot_date
+        FROM {{ ref('dim_period') }}
+        WHERE period_type = '{{ period_type }}'
+            AND end_snapshot_date IS NOT NULL
+        {%- if period_start %}
+            AND period_start = CAST(date_trunc('{{ period_type }}', DATE '{{ period_start }}') AS DATE)
+        {%- else %}
+        QUALIFY ROW_NUMBER() OVER (
+            PARTITION BY library_id
+            ORDER BY end_snapshot_date DESC, period_start DESC
+        ) = 1
+        {%- endif %}
+        ORDER BY library_id
+    {%- endset -%}
+
+    {%- set filters = [] -%}
+    {%- set periods = [] -%}
+    {%- if execute -%}
+        {%- for row in run_query(bracket_query).rows -%}
+            {%- set library_id = "'" ~ (row['library_id'] | replace("'", "''")) ~ "'" -%}
+            {%- set start_snapshot_date = "DATE '" ~ row['start_snapshot_date'] ~ "'" if row['start_snapshot_date'] is not none else 'NULL' -%}
+            {%- do filters.append(period_snapshot_filter(library_id, start_snapshot_date, "DATE '" ~ row['end_snapshot_date'] ~ "'")) -%}
+            {%- do periods.append("(" ~ library_id ~ ", DATE '" ~ row['period_start'] ~ "', DATE '" ~ row['period_end'] ~ "')") -%}
+        {%- endfor -%}
+    {%- endif -%}
+
+    {%- set bracket = {
+        'period_type': period_type,
+        'filter': filters | join('\n            OR ') if filters else 'FALSE',
+        'periods': 'SELECT * FROM (VALUES ' ~ periods | join(', ') ~ ') AS t(library_id, period_start, period_end)'
+            if periods else 'SELECT NULL::VARCHAR AS library_id, NULL::DATE AS period_start, NULL::DATE AS period_end WHERE FALSE',
+    } -%}
+    {{ return(bracket) }}
+{% endmacro %}
+
+
+{#
+    任意の期間を問い合わせるためのDuckDBテーブルマクロを作成（on-run-endで実行）
+    引数はライブラリIDとスナップショット日の組（dim_period の start_snapshot_date / end_snapshot_date）
+        SELECT * FROM replay_top_songs('default', DATE '2024-12-31', DATE '2025-01-31') LIMIT 20;
+    scripts/replay_query.py は期間から dim_period を引いてこれらを呼ぶ
+#}
+{% macro create_replay_macros() %}
+    {%- set relations = {} -%}
+    {%- for name in ['fact_play_count_snapshot', 'fact_track_plays', 'dim_period'] -%}
+        {%- set relation = adapter.get_relation(database=target.database, schema=target.schema, identifier=name) -%}
+        {%- if relation is none -%}
+            {{ log("Replay用マクロの作成をスキップしました（" ~ name ~ " が未作成）", info=True) }}
+            {{ return('') }}
+        {%- endif -%}
+        {%- do relations.update({name: relation.include(database=False)}) -%}
+    {%- endfor -%}
+
+    {%- set track_plays_sql = period_track_plays(
+        relations['fact_play_count_snapshot'],
+        relations['fact_track_plays'],
+        period_snapshot_filter('library', 'start_snapshot_date', 'end_snapshot_date')
+    ) -%}
+
+    {%- set reports = {
+        'replay_track_plays': track_plays_sql,
+        'replay_summary': period_summary(track_plays_sql),
+        'replay_top_songs': period_top_songs(track_plays_sql),
+        'replay_top_artists': period_top_artists(track_plays_sql),
+        'replay_top_albums': period_top_albums(track_plays_sql),
+    } -%}
+    {%- for name, sql in reports.items() %}
+        CREATE OR REPLACE MACRO {{ target.schema }}.{{ name }}(library, start_snapshot_date, end_snapshot_date) AS TABLE
+        {{ sql }};
+    {%- endfor %}
+{% endmacro %}
@@ -1,6 +1,53 @@
-{{ config(materialized='table') }}
+{{
+    config(
+        materialized='incremental',
+        incremental_strategy='delete+insert',
+        unique_key=['library_id', 'snapshot_date']
+    )
+}}
 
+{% if var('raw_storage') == 'compact' %}
+
+-- compact形式: 変化行だけを、変化が観測されたスナップショットの行として扱う
+-- 変化のないスナップショットの行は持たない（状態の復元は bronze_itunes_library_state）
 SELECT
+    c.library_id,
+    c.valid_from AS snapshot_date,
+    l.snapshot_path,
+    c.track_id,
+    c.name,
+    c.artist,
+    c.album_artist,
+    c.album,
+    c.genre,
+    c.kind,
+    c.total_time,
+    c.disc_number,
+    c.disc_count,
+    c.track_number,
+    c.track_count,
+    c.year,
+    c.date_added,
+    c.play_count,
+    c.play_date,
+    c.play_date_utc,
+    c.skip_count,
+    c.skip_date,
+    c.rating,
+    c.loved,
+    c.persistent_id,
+    c.location,
+    c.prev_snapshot_date
+FROM {{ source('itunes', 'raw_itunes_library_changes') }} AS c
+INNER JOIN {{ source('itunes', 'raw_snapshot_log') }} AS l
+    ON c.library_id = l.library_id
+    AND c.valid_from = l.snapshot_date
+WHERE {{ new_snapshots_only('c.valid_from', library_column='c.library_id') }}
+
+{% else %}
+
+SELECT
+    library_id,
     snapshot_date,
     snapshot_path,
     track_id,
@@ -25,5 +72,10 @@ SELECT
     rating,
     loved,
     persistent_id,
-    location
-FROM {{ source('itunes', 'raw_itunes_library') }}
+    location,
+    -- full形式では前回スナップショット日は fact_play_count_snapshot でLAGから求める
+    NULL::DATE AS prev_snapshot_date
+FROM {{ raw_itunes_library() }}
+WHERE {{ new_snapshots_only() }}
+
+{% endif %}
@@ -0,0 +1,45 @@
+{{ config(materialized='view') }}
+
+-- 各ライブラリ・スナップショット時点のライブラリ全体の状態
+-- compact形式では変化行の有効期間から復元する。full形式では raw_itunes_library そのもの
+
+{% if var('raw_storage') == 'compact' %}
+
+SELECT
+    l.library_id,
+    l.snapshot_date,
+    l.snapshot_path,
+    c.track_id,
+    c.name,
+    c.artist,
+    c.album_artist,
+    c.album,
+    c.genre,
+    c.kind,
+    c.total_time,
+    c.disc_number,
+    c.disc_count,
+    c.track_number,
+    c.track_count,
+    c.year,
+    c.date_added,
+    c.play_count,
+    c.play_date,
+    c.play_date_utc,
+    c.skip_count,
+    c.skip_date,
+    c.rating,
+    c.loved,
+    c.persistent_id,
+    c.location
+FROM {{ source('itunes', 'raw_snapshot_log') }} AS l
+INNER JOIN {{ source('itunes', 'raw_itunes_library_changes') }} AS c
+    ON c.library_id = l.library_id
+    AND c.valid_from <= l.snapshot_date
+    AND (c.valid_to IS NULL OR l.snapshot_date < c.valid_to)
+
+{% else %}
+
+SELECT * FROM {{ raw_itunes_library() }}
+
+{% endif %}
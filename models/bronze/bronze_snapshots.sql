@@ -0,0 +1,28 @@
+{{ config(materialized='table') }}
+
+-- ライブラリごとのロード済みスナップショットの一覧
+-- compact形式では変化のないスナップショットが bronze_itunes_library に現れないため、
+-- スナップショット日の一覧はこちらを使う
+
+{% if var('raw_storage') == 'compact' %}
+
+SELECT
+    library_id,
+    snapshot_date,
+    snapshot_path,
+    track_count
+FROM {{ source('itunes', 'raw_snapshot_log') }}
+
+{% else %}
+
+SELECT
+    library_id,
+    snapshot_date,
+    ANY_VALUE(snapshot_path) AS snapshot_path,
+    COUNT(*) AS track_count
+FROM {{ raw_itunes_library() }}
+GROUP BY
+    library_id,
+    snapshot_date
+
+{% endif %}
@@ -4,10 +4,11 @@ WITH
 -- Import CTE
 tracks AS (
     SELECT
+        library_id,
         album_name,
         album_artist_name,
         release_year,
-        track_persistent_id,
+        track_key,
         duration_min
     FROM {{ ref('dim_track') }}
     WHERE album_name IS NOT NULL
@@ -16,13 +17,15 @@ tracks AS (
 -- Functional CTE
 album_summary AS (
     SELECT
+        library_id,
         album_name,
         album_artist_name,
         MIN(release_year) AS release_year,
-        COUNT(DISTINCT track_persistent_id) AS track_count,
+        COUNT(DISTINCT track_key) AS track_count,
         SUM(duration_min) AS total_duration_min
     FROM tracks
     GROUP BY
+        library_id,
         album_name,
         album_artist_name
 ),
@@ -4,23 +4,29 @@ WITH
 -- Import CTE
 tracks AS (
     SELECT
+        library_id,
+        artist_key,
         artist_name,
-        track_persistent_id,
+        track_key,
         album_name,
         duration_min
     FROM {{ ref('dim_track') }}
-    WHERE artist_name IS NOT NULL
+    WHERE artist_key IS NOT NULL
 ),
 
 -- Functional CTE
 artist_summary AS (
     SELECT
-        artist_name,
-        COUNT(DISTINCT track_persistent_id) AS track_count,
+        library_id,
+        artist_key,
+        ANY_VALUE(artist_name) AS artist_name,
+        COUNT(DISTINCT track_key) AS track_count,
         COUNT(DISTINCT album_name) AS album_count,
         SUM(duration_min) AS total_duration_min
     FROM tracks
-    GROUP BY artist_name
+    GROUP BY
+        library_id,
+        artist_key
 ),
 
 final AS (
@@ -0,0 +1,84 @@
+{{ config(materialized='table') }}
+
+-- ライブラリごとの、年・月・週ごとの期間と、その期間を挟むスナップショットの対応表
+-- 期間の再生数は start_snapshot_date < snapshot_date <= end_snapshot_date の差分の合計
+-- （＝スナップショット日が期間内にある差分）で求める
+--   start_snapshot_date: 期間開始より前の最後のスナップショット（基準）
+--   end_snapshot_date:   期間内の最後のスナップショット
+
+WITH
+-- Import CTE
+snapshots AS (
+    SELECT
+        library_id,
+        snapshot_date
+    FROM {{ ref('bronze_snapshots') }}
+),
+
+-- Functional CTEs
+bounds AS (
+    SELECT
+        library_id,
+        MIN(snapshot_date) AS first_snapshot_date,
+        MAX(snapshot_date) AS last_snapshot_date
+    FROM snapshots
+    GROUP BY library_id
+),
+
+period_types AS (
+    SELECT *
+    FROM (
+        VALUES
+            ('year', INTERVAL 1 YEAR),
+            ('month', INTERVAL 1 MONTH),
+            ('week', INTERVAL 7 DAY)
+    ) AS t(period_type, period_length)
+),
+
+periods AS (
+    SELECT
+        library_id,
+        period_type,
+        CAST(period_start AS DATE) AS period_start,
+        CAST(period_start + period_length AS DATE) AS period_end
+    FROM (
+        SELECT
+            b.library_id,
+            p.period_type,
+            p.period_length,
+            UNNEST(generate_series(
+                CAST(date_trunc(p.period_type, b.first_snapshot_date) AS TIMESTAMP),
+                CAST(b.last_snapshot_date AS TIMESTAMP),
+                p.period_length
+            )) AS period_start
+        FROM period_types AS p
+        CROSS JOIN bounds AS b
+    )
+),
+
+brackets AS (
+    SELECT
+        p.library_id,
+        p.period_type,
+        p.period_start,
+        p.period_end,
+        start_snapshot.snapshot_date AS start_snapshot_date,
+        end_snapshot.snapshot_date AS end_snapshot_date
+    FROM periods AS p
+    ASOF LEFT JOIN snapshots AS start_snapshot
+        ON p.library_id = start_snapshot.library_id
+        AND p.period_start > start_snapshot.snapshot_date
+    ASOF LEFT JOIN snapshots AS end_snapshot
+        ON p.library_id = end_snapshot.library_id
+        AND p.period_end > end_snapshot.snapshot_date
+),
+
+final AS (
+    SELECT * FROM brackets
+)
+
+SELECT * FROM final
+ORDER BY
+    library_id,
+    period_type,
+    period_start
@@ -4,6 +4,8 @@ WITH
 -- Import CTE
 silver_tracks AS (
     SELECT
+        track_key,
+        library_id,
         track_persistent_id,
         itunes_track_id,
         title,
@@ -11,6 +13,9 @@ silver_tracks AS (
         album_artist_name,
         album_name,
         genre,
+        artist_key,
+        album_key,
+        genre_key,
         release_year,
         file_type,
         duration_ms,
@@ -30,6 +35,8 @@ silver_tracks AS (
 -- Functional CTE
 ranked_tracks AS (
     SELECT
+        track_key,
+        library_id,
         track_persistent_id,
         itunes_track_id,
         title,
@@ -37,6 +44,9 @@ ranked_tracks AS (
         album_artist_name,
         album_name,
         genre,
+        artist_key,
+        album_key,
+        genre_key,
         release_year,
         file_type,
         duration_ms,
@@ -50,7 +60,7 @@ ranked_tracks AS (
         is_loved,
         added_at,
         ROW_NUMBER() OVER (
-            PARTITION BY track_persistent_id
+            PARTITION BY track_key
             ORDER BY snapshot_date DESC
         ) AS rn
     FROM silver_tracks
@@ -58,6 +68,8 @@ ranked_tracks AS (
 
 latest_tracks AS (
     SELECT
+        track_key,
+        library_id,
         track_persistent_id,
         itunes_track_id,
         title,
@@ -65,6 +77,9 @@ latest_tracks AS (
         album_artist_name,
         album_name,
         genre,
+        artist_key,
+        album_key,
+        genre_key,
         release_year,
         file_type,
         duration_ms,
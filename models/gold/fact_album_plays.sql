@@ -0,0 +1,40 @@
+{{ config(materialized='table') }}
+
+-- アルバム単位の再生数ロールアップ（fact_track_plays から集計）
+-- 集計は album_key（アルバム名, アルバムアーティスト）で行い、名前はキーに対応する値を付ける
+
+WITH
+-- Import CTE
+track_plays AS (
+    SELECT
+        library_id,
+        album_key,
+        album_name,
+        COALESCE(album_artist_name, artist_name) AS artist_name,
+        play_count,
+        listening_minutes
+    FROM {{ ref('fact_track_plays') }}
+    WHERE album_key IS NOT NULL
+),
+
+-- Functional CTE
+album_plays AS (
+    SELECT
+        library_id,
+        album_key,
+        ANY_VALUE(album_name) AS album_name,
+        ANY_VALUE(artist_name) AS artist_name,
+        SUM(play_count) AS play_count,
+        SUM(listening_minutes) AS listening_minutes,
+        COUNT(*) AS unique_tracks
+    FROM track_plays
+    GROUP BY
+        library_id,
+        album_key
+),
+
+final AS (
+    SELECT * FROM album_plays
+)
+
+SELECT * FROM final
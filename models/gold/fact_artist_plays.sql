@@ -0,0 +1,38 @@
+{{ config(materialized='table') }}
+
+-- アーティスト単位の再生数ロールアップ（fact_track_plays から集計）
+-- 集計は artist_key（整数）で行い、名前はキーに対応する値を付ける
+
+WITH
+-- Import CTE
+track_plays AS (
+    SELECT
+        library_id,
+        artist_key,
+        artist_name,
+        play_count,
+        listening_minutes
+    FROM {{ ref('fact_track_plays') }}
+    WHERE artist_key IS NOT NULL
+),
+
+-- Functional CTE
+artist_plays AS (
+    SELECT
+        library_id,
+        artist_key,
+        ANY_VALUE(artist_name) AS artist_name,
+        SUM(play_count) AS play_count,
+        SUM(listening_minutes) AS listening_minutes,
+        COUNT(*) AS unique_tracks
+    FROM track_plays
+    GROUP BY
+        library_id,
+        artist_key
+),
+
+final AS (
+    SELECT * FROM artist_plays
+)
+
+SELECT * FROM final
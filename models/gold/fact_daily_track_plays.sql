@@ -0,0 +1,110 @@
+{{
+    config(
+        materialized='incremental',
+        incremental_strategy='delete+insert',
+        unique_key=['library_id', 'snapshot_date']
+    )
+}}
+
+-- ライブラリ・トラック・日単位の推定再生数
+-- fact_play_count_snapshot の差分（前回スナップショットの翌日〜今回のスナップショット日）を日ごとに配分する
+--   - 最終再生日（UTCの日付）が区間内にあれば、その日に1回を割り当て、
+--     残りを区間の最初の日から最終再生日までに均等に配分する（最終再生日より後には再生がないため）
+--   - 最終再生日が区間外・不明なら、区間全体に均等に配分する
+-- 配分は整数で、各区間の合計は play_count_delta と一致する
+-- 行は配分元のスナップショット（snapshot_date）ごとに delete+insert で置き換わる
+
+WITH
+-- Import CTE
+fact_snapshots AS (
+    SELECT
+        library_id,
+        track_key,
+        snapshot_date,
+        prev_snapshot_date,
+        play_count_delta,
+        last_played_at_utc,
+        duration_min
+    FROM {{ ref('fact_play_count_snapshot') }}
+    WHERE play_count_delta > 0
+        AND {{ new_snapshots_only() }}
+),
+
+-- Functional CTEs
+intervals AS (
+    SELECT
+        library_id,
+        track_key,
+        snapshot_date,
+        prev_snapshot_date + 1 AS start_date,
+        play_count_delta,
+        duration_min,
+        CASE
+            WHEN last_played_at_utc::DATE BETWEEN prev_snapshot_date + 1 AND snapshot_date
+                THEN last_played_at_utc::DATE
+        END AS anchor_date
+    FROM fact_snapshots
+),
+
+spread_ranges AS (
+    SELECT
+        library_id,
+        track_key,
+        snapshot_date,
+        start_date,
+        anchor_date,
+        duration_min,
+        -- 均等に配分する再生数と日数
+        play_count_delta - CASE WHEN anchor_date IS NULL THEN 0 ELSE 1 END AS spread_plays,
+        COALESCE(anchor_date, snapshot_date) AS spread_end_date,
+        date_diff('day', start_date, COALESCE(anchor_date, snapshot_date)) + 1 AS spread_days
+    FROM intervals
+),
+
+days AS (
+    SELECT
+        library_id,
+        track_key,
+        snapshot_date,
+        start_date,
+        anchor_date,
+        duration_min,
+        spread_plays,
+        spread_days,
+        UNNEST(generate_series(start_date, spread_end_date, INTERVAL 1 DAY))::DATE AS play_date
+    FROM spread_ranges
+),
+
+daily_plays AS (
+    SELECT
+        library_id,
+        track_key,
+        play_date,
+        snapshot_date,
+        duration_min,
+        -- i日目に floor((i+1)*r/n) - floor(i*r/n) 回を割り当てる（合計がちょうど r になる）
+        (date_diff('day', start_date, play_date) + 1) * spread_plays // spread_days
+            - date_diff('day', start_date, play_date) * spread_plays // spread_days
+            + CASE WHEN play_date = anchor_date THEN 1 ELSE 0 END AS play_count
+    FROM days
+),
+
+final AS (
+    SELECT
+        library_id,
+        track_key,
+        play_date,
+        snapshot_date,
+        play_count,
+        -- スナップショット時点の曲の長さで計算した再生時間
+        play_count * duration_min AS listening_minutes
+    FROM daily_plays
+    WHERE play_count > 0
+)
+
+-- ライブラリ・再生日順に格納し、日付の範囲で絞るクエリが
+-- ゾーンマップで行グループを読み飛ばせるようにする
+SELECT * FROM final
+ORDER BY
+    library_id,
+    play_date
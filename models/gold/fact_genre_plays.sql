@@ -0,0 +1,38 @@
+{{ config(materialized='table') }}
+
+-- ジャンル単位の再生数ロールアップ（fact_track_plays から集計）
+-- 集計は genre_key（整数）で行い、名前はキーに対応する値を付ける
+
+WITH
+-- Import CTE
+track_plays AS (
+    SELECT
+        library_id,
+        genre_key,
+        genre,
+        play_count,
+        listening_minutes
+    FROM {{ ref('fact_track_plays') }}
+    WHERE genre_key IS NOT NULL
+),
+
+-- Functional CTE
+genre_plays AS (
+    SELECT
+        library_id,
+        genre_key,
+        ANY_VALUE(genre) AS genre,
+        SUM(play_count) AS play_count,
+        SUM(listening_minutes) AS listening_minutes,
+        COUNT(*) AS unique_tracks
+    FROM track_plays
+    GROUP BY
+        library_id,
+        genre_key
+),
+
+final AS (
+    SELECT * FROM genre_plays
+)
+
+SELECT * FROM final
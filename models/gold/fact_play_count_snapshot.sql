@@ -1,49 +1,123 @@
-{{ config(materialized='table') }}
+{{
+    config(
+        materialized='incremental',
+        incremental_strategy='delete+insert',
+        unique_key=['library_id', 'snapshot_date']
+    )
+}}
 
 WITH
 -- Import CTE
 silver_tracks AS (
     SELECT
+        library_id,
+        track_key,
         track_persistent_id,
         snapshot_date,
         play_count,
         skip_count,
         last_played_at_utc,
-        duration_min
+        duration_min,
+        prev_snapshot_date AS observed_prev_snapshot_date,
+        FALSE AS is_seed
     FROM {{ ref('silver_tracks') }}
+    WHERE {{ new_snapshots_only() }}
+),
+
+{% if is_incremental() %}
+-- 今回処理するライブラリの、既存の各トラックの最新行（そのライブラリの最新スナップショットより前）
+-- 新しい行のLAGはここから引き継ぐ。処理しないライブラリの行は読まない
+previous_snapshots AS (
+    SELECT
+        f.library_id,
+        f.track_key,
+        f.track_persistent_id,
+        f.snapshot_date,
+        f.play_count,
+        f.skip_count,
+        f.last_played_at_utc,
+        f.duration_min,
+        NULL::DATE AS observed_prev_snapshot_date,
+        TRUE AS is_seed
+    FROM {{ this }} AS f
+    SEMI JOIN (SELECT DISTINCT library_id FROM silver_tracks) AS l
+        ON f.library_id = l.library_id
+    WHERE f.snapshot_date < (
+        SELECT MAX(m.snapshot_date)
+        FROM {{ this }} AS m
+        WHERE m.library_id = f.library_id
+    )
+    QUALIFY ROW_NUMBER() OVER (
+        PARTITION BY f.track_key
+        ORDER BY f.snapshot_date DESC
+    ) = 1
 ),
+{% endif %}
 
 -- Functional CTE
+snapshots AS (
+    SELECT * FROM silver_tracks
+    {% if is_incremental() %}
+    UNION ALL
+    SELECT * FROM previous_snapshots
+    {% endif %}
+),
+
 play_count_with_delta AS (
     SELECT
+        library_id,
+        track_key,
         track_persistent_id,
         snapshot_date,
         play_count,
         skip_count,
         last_played_at_utc,
         duration_min,
+        is_seed,
 
         -- 前回スナップショットからの差分
         play_count - LAG(play_count) OVER (
-            PARTITION BY track_persistent_id
+            PARTITION BY track_key
             ORDER BY snapshot_date
         ) AS play_count_delta,
 
         skip_count - LAG(skip_count) OVER (
-            PARTITION BY track_persistent_id
+            PARTITION BY track_key
             ORDER BY snapshot_date
         ) AS skip_count_delta,
 
         -- 前回スナップショット日
-        LAG(snapshot_date) OVER (
-            PARTITION BY track_persistent_id
-            ORDER BY snapshot_date
+        -- compact形式では変化のないスナップショットの行がないため、ロード時に記録した日付を使う
+        COALESCE(
+            observed_prev_snapshot_date,
+            LAG(snapshot_date) OVER (
+                PARTITION BY track_key
+                ORDER BY snapshot_date
+            )
         ) AS prev_snapshot_date
-    FROM silver_tracks
+    FROM snapshots
 ),
 
 final AS (
-    SELECT * FROM play_count_with_delta
+    SELECT
+        library_id,
+        track_key,
+        track_persistent_id,
+        snapshot_date,
+        play_count,
+        skip_count,
+        last_played_at_utc,
+        duration_min,
+        play_count_delta,
+        skip_count_delta,
+        prev_snapshot_date
+    FROM play_count_with_delta
+    WHERE NOT is_seed
 )
 
+-- ライブラリ・snapshot_date 順に格納し、ライブラリと期間で絞るクエリが
+-- ゾーンマップで行グループを読み飛ばせるようにする
 SELECT * FROM final
+ORDER BY
+    library_id,
+    snapshot_date
@@ -0,0 +1,159 @@
+{{ config(materialized='table') }}
+
+-- ライブラリ・トラック単位の再生数ロールアップ（全ライブラリを1回で集計する）
+-- fact_play_count_snapshot のスキャン、dim_track の重複排除、差分の集計を
+-- dbt run ごとに1回だけ行い、platinum層とアーティスト・アルバム・ジャンル別の
+-- ロールアップはこのテーブルから作る
+-- 差分のある行（2回以上のスナップショットに存在したトラック）を持つトラックが対象で、
+-- play_count が0のトラックも含む
+-- compact形式では変化のないトラックの行がないため、変化行の有効期間から同じトラックを求めて補う
+-- （アーティスト・アルバム・ジャンル別の unique_tracks が保存形式によって変わらないようにする）
+
+WITH
+-- Import CTEs
+fact_snapshots AS (
+    SELECT
+        library_id,
+        track_key,
+        play_count_delta,
+        duration_min
+    FROM {{ ref('fact_play_count_snapshot') }}
+    WHERE play_count_delta IS NOT NULL
+),
+
+dim_tracks AS (
+    SELECT
+        track_key,
+        track_persistent_id,
+        artist_key,
+        album_key,
+        genre_key,
+        title,
+        artist_name,
+        album_artist_name,
+        album_name,
+        genre,
+        duration_min
+    FROM {{ ref('dim_track') }}
+),
+
+{% if var('raw_storage') == 'compact' %}
+snapshot_numbers AS (
+    SELECT
+        library_id,
+        snapshot_date,
+        ROW_NUMBER() OVER (
+            PARTITION BY library_id
+            ORDER BY snapshot_date
+        ) AS snapshot_number,
+        COUNT(*) OVER (PARTITION BY library_id) AS snapshot_total
+    FROM {{ ref('bronze_snapshots') }}
+),
+
+track_ranges AS (
+    SELECT
+        library_id,
+        persistent_id AS track_persistent_id,
+        valid_from,
+        valid_to
+    FROM {{ source('itunes', 'raw_itunes_library_changes') }}
+    WHERE persistent_id IS NOT NULL
+),
+
+track_keys AS (
+    SELECT
+        library_id,
+        track_persistent_id,
+        track_key
+    FROM {{ ref('silver_track_keys') }}
+),
+{% endif %}
+
+-- Functional CTEs
+track_plays AS (
+    SELECT
+        library_id,
+        track_key,
+        SUM(
+            CASE
+                WHEN play_count_delta > 0 THEN play_count_delta
+                ELSE 0
+            END
+        ) AS play_count,
+        -- スナップショット時点の曲の長さで計算した再生時間
+        SUM(
+            CASE
+                WHEN play_count_delta > 0 THEN play_count_delta * duration_min
+                ELSE 0
+            END
+        ) AS listening_minutes
+    FROM fact_snapshots
+    GROUP BY
+        library_id,
+        track_key
+),
+
+{% if var('raw_storage') == 'compact' %}
+-- 2回以上のスナップショットに存在したトラック（有効期間に含まれるスナップショットの数で数える）
+present_tracks AS (
+    SELECT
+        r.library_id,
+        k.track_key
+    FROM track_ranges AS r
+    INNER JOIN snapshot_numbers AS f
+        ON r.library_id = f.library_id
+        AND r.valid_from = f.snapshot_date
+    LEFT JOIN snapshot_numbers AS t
+        ON r.library_id = t.library_id
+        AND r.valid_to = t.snapshot_date
+    INNER JOIN track_keys AS k
+        ON r.library_id = k.library_id
+        AND r.track_persistent_id = k.track_persistent_id
+    GROUP BY
+        r.library_id,
+        k.track_key
+    HAVING SUM(COALESCE(t.snapshot_number, f.snapshot_total + 1) - f.snapshot_number) >= 2
+),
+{% endif %}
+
+all_track_plays AS (
+    SELECT * FROM track_plays
+    {% if var('raw_storage') == 'compact' %}
+    UNION ALL
+    SELECT
+        library_id,
+        track_key,
+        0 AS play_count,
+        0 AS listening_minutes
+    FROM present_tracks
+    ANTI JOIN track_plays
+        USING (library_id, track_key)
+    {% endif %}
+),
+
+joined_data AS (
+    SELECT
+        p.library_id,
+        p.track_key,
+        d.track_persistent_id,
+        d.artist_key,
+        d.album_key,
+        d.genre_key,
+        d.title,
+        d.artist_name,
+        d.album_artist_name,
+        d.album_name,
+        d.genre,
+        d.duration_min,
+        p.play_count,
+        p.listening_minutes
+    FROM all_track_plays AS p
+    LEFT JOIN dim_tracks AS d
+        ON p.track_key = d.track_key
+),
+
+final AS (
+    SELECT * FROM joined_data
+)
+
+SELECT * FROM final
@@ -0,0 +1,39 @@
+{{ config(materialized='view') }}
+
+-- 指定した期間のトップアルバム（ライブラリごと）
+-- 期間は dbt var で指定する（例: --vars '{replay_period_type: month, replay_period_start: 2025-01-01}'）
+-- 期間を挟むスナップショット日はライブラリごとに dim_period から引き、定数としてクエリに埋め込む
+-- 全ライブラリを1つのクエリで集計する
+{%- set period = replay_period_brackets() %}
+
+WITH
+-- Import CTEs
+periods AS (
+    {{ period.periods }}
+),
+
+report AS (
+    {{ period_top_albums(period_track_plays(
+        ref('fact_play_count_snapshot'),
+        ref('fact_track_plays'),
+        period.filter
+    )) }}
+),
+
+-- Functional CTE
+final AS (
+    SELECT
+        r.library_id,
+        '{{ period.period_type }}' AS period_type,
+        p.period_start,
+        p.period_end,
+        r.* EXCLUDE (library_id)
+    FROM report AS r
+    INNER JOIN periods AS p
+        ON r.library_id = p.library_id
+)
+
+SELECT * FROM final
+ORDER BY
+    library_id,
+    rank
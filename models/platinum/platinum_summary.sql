@@ -1,70 +1,37 @@
 {{ config(materialized='view') }}
 
 WITH
--- Import CTEs
-fact_snapshots AS (
+-- Import CTE
+track_plays AS (
     SELECT
-        track_persistent_id,
-        play_count_delta,
-        duration_min
-    FROM {{ ref('fact_play_count_snapshot') }}
-    WHERE play_count_delta IS NOT NULL
-),
-
-dim_tracks AS (
-    SELECT
-        track_persistent_id,
-        artist_name,
-        album_name
-    FROM {{ ref('dim_track') }}
+        library_id,
+        track_key,
+        artist_key,
+        album_name,
+        play_count,
+        listening_minutes
+    FROM {{ ref('fact_track_plays') }}
 ),
 
 -- Functional CTE
-joined_data AS (
-    SELECT
-        f.track_persistent_id,
-        f.play_count_delta,
-        f.duration_min,
-        d.artist_name,
-        d.album_name
-    FROM fact_snapshots AS f
-    LEFT JOIN dim_tracks AS d
-        ON f.track_persistent_id = d.track_persistent_id
-),
-
+-- ライブラリごとに1行
 summary AS (
     SELECT
+        library_id,
+
         -- 総再生時間（分）
-        SUM(
-            CASE
-                WHEN play_count_delta > 0 THEN play_count_delta * duration_min
-                ELSE 0
-            END
-        ) AS total_listening_minutes,
+        SUM(listening_minutes) AS total_listening_minutes,
 
         -- 総再生時間（時間）
-        ROUND(
-            SUM(
-                CASE
-                    WHEN play_count_delta > 0 THEN play_count_delta * duration_min
-                    ELSE 0
-                END
-            ) / 60.0,
-            1
-        ) AS total_listening_hours,
+        ROUND(SUM(listening_minutes) / 60.0, 1) AS total_listening_hours,
 
         -- 総再生回数
-        SUM(
-            CASE
-                WHEN play_count_delta > 0 THEN play_count_delta
-                ELSE 0
-            END
-        ) AS total_plays,
+        SUM(play_count) AS total_plays,
 
         -- ユニークトラック数
         COUNT(DISTINCT
             CASE
-                WHEN play_count_delta > 0 THEN track_persistent_id
+                WHEN play_count > 0 THEN track_key
                 ELSE NULL
             END
         ) AS unique_tracks_played,
@@ -72,7 +39,7 @@ summary AS (
         -- ユニークアーティスト数
         COUNT(DISTINCT
             CASE
-                WHEN play_count_delta > 0 THEN artist_name
+                WHEN play_count > 0 THEN artist_key
                 ELSE NULL
             END
         ) AS unique_artists_played,
@@ -80,11 +47,12 @@ summary AS (
         -- ユニークアルバム数
         COUNT(DISTINCT
             CASE
-                WHEN play_count_delta > 0 THEN album_name
+                WHEN play_count > 0 THEN album_name
                 ELSE NULL
             END
         ) AS unique_albums_played
-    FROM joined_data
+    FROM track_plays
+    GROUP BY library_id
 ),
 
 final AS (
@@ -92,3 +60,4 @@ final AS (
 )
 
 SELECT * FROM final
+ORDER BY library_id
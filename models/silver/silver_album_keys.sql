@@ -0,0 +1,35 @@
+{{
+    config(
+        materialized='incremental',
+        incremental_strategy='append'
+    )
+}}
+
+-- （ライブラリ, アルバム名, アルバムアーティスト）→ album_key
+-- アルバムアーティストがない場合はアーティスト名で代用する（platinum_top_albums の集計単位）
+-- silver_tracks はこのキーマップからキーを引く
+
+WITH
+-- Import CTE
+bronze_library AS (
+    SELECT
+        library_id,
+        album AS album_name,
+        COALESCE(album_artist, artist) AS album_artist_name,
+        snapshot_date
+    FROM {{ ref('bronze_itunes_library') }}
+    WHERE persistent_id IS NOT NULL
+        AND album IS NOT NULL
+        AND {{ new_snapshots_only(this_column='first_snapshot_date', watermark='silver_tracks') }}
+),
+
+-- Functional CTE
+new_keys AS (
+    {{ new_surrogate_keys('album_key', ['library_id', 'album_name', 'album_artist_name'], 'bronze_library') }}
+),
+
+final AS (
+    SELECT * FROM new_keys
+)
+
+SELECT * FROM final
@@ -0,0 +1,33 @@
+{{
+    config(
+        materialized='incremental',
+        incremental_strategy='append'
+    )
+}}
+
+-- （ライブラリ, ジャンル名）→ genre_key
+-- silver_tracks はこのキーマップからキーを引く
+
+WITH
+-- Import CTE
+bronze_library AS (
+    SELECT
+        library_id,
+        genre,
+        snapshot_date
+    FROM {{ ref('bronze_itunes_library') }}
+    WHERE persistent_id IS NOT NULL
+        AND genre IS NOT NULL
+        AND {{ new_snapshots_only(this_column='first_snapshot_date', watermark='silver_tracks') }}
+),
+
+-- Functional CTE
+new_keys AS (
+    {{ new_surrogate_keys('genre_key', ['library_id', 'genre'], 'bronze_library') }}
+),
+
+final AS (
+    SELECT * FROM new_keys
+)
+
+SELECT * FROM final
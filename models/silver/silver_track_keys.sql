@@ -0,0 +1,33 @@
+{{
+    config(
+        materialized='incremental',
+        incremental_strategy='append'
+    )
+}}
+
+-- （ライブラリ, トラックの固有ID（persistent_id））→ track_key
+-- 連番の整数にすることで、factの列がビットパッキングで小さく圧縮される
+-- silver_tracks はこのキーマップからキーを引く
+
+WITH
+-- Import CTE
+bronze_library AS (
+    SELECT
+        library_id,
+        persistent_id AS track_persistent_id,
+        snapshot_date
+    FROM {{ ref('bronze_itunes_library') }}
+    WHERE persistent_id IS NOT NULL
+        AND {{ new_snapshots_only(this_column='first_snapshot_date', watermark='silver_tracks') }}
+),
+
+-- Functional CTE
+new_keys AS (
+    {{ new_surrogate_keys('track_key', ['library_id', 'track_persistent_id'], 'bronze_library') }}
+),
+
+final AS (
+    SELECT * FROM new_keys
+)
+
+SELECT * FROM final
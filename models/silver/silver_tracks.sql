@@ -1,9 +1,16 @@
-{{ config(materialized='table') }}
+{{
+    config(
+        materialized='incremental',
+        incremental_strategy='delete+insert',
+        unique_key=['library_id', 'snapshot_date']
+    )
+}}
 
 WITH
 -- Import CTE
 bronze_library AS (
     SELECT
+        library_id,
         persistent_id,
         snapshot_date,
         snapshot_path,
@@ -28,15 +35,51 @@ bronze_library AS (
         rating,
         loved,
         date_added,
-        location
+        location,
+        prev_snapshot_date
     FROM {{ ref('bronze_itunes_library') }}
     WHERE persistent_id IS NOT NULL
+        AND {{ new_snapshots_only() }}
 ),
 
--- Functional CTE
+track_keys AS (
+    SELECT
+        track_key,
+        library_id,
+        track_persistent_id
+    FROM {{ ref('silver_track_keys') }}
+),
+
+artist_keys AS (
+    SELECT
+        artist_key,
+        library_id,
+        artist_name
+    FROM {{ ref('silver_artist_keys') }}
+),
+
+album_keys AS (
+    SELECT
+        album_key,
+        library_id,
+        album_name,
+        album_artist_name
+    FROM {{ ref('silver_album_keys') }}
+),
+
+genre_keys AS (
+    SELECT
+        genre_key,
+        library_id,
+        genre
+    FROM {{ ref('silver_genre_keys') }}
+),
+
+-- Functional CTEs
 transformed_tracks AS (
     SELECT
         -- Keys
+        library_id,
         persistent_id AS track_persistent_id,
         snapshot_date,
 
@@ -80,12 +123,40 @@ transformed_tracks AS (
         -- Metadata
         date_added AS added_at,
         location AS file_path,
-        snapshot_path
+        snapshot_path,
+
+        -- compact形式のみ: このトラックが直前に存在したスナップショット日
+        prev_snapshot_date
     FROM bronze_library
 ),
 
+-- トラック・アーティスト・アルバム・ジャンルの整数キー
+-- gold/platinum の結合と集計は文字列ではなくこれらのキーで行う
+keyed_tracks AS (
+    SELECT
+        k.track_key,
+        t.*,
+        a.artist_key,
+        al.album_key,
+        g.genre_key
+    FROM transformed_tracks AS t
+    INNER JOIN track_keys AS k
+        ON t.library_id = k.library_id
+        AND t.track_persistent_id = k.track_persistent_id
+    LEFT JOIN artist_keys AS a
+        ON t.library_id = a.library_id
+        AND t.artist_name = a.artist_name
+    LEFT JOIN album_keys AS al
+        ON t.library_id = al.library_id
+        AND t.album_name = al.album_name
+        AND COALESCE(t.album_artist_name, t.artist_name) IS NOT DISTINCT FROM al.album_artist_name
+    LEFT JOIN genre_keys AS g
+        ON t.library_id = g.library_id
+        AND t.genre = g.genre
+),
+
 final AS (
-    SELECT * FROM transformed_tracks
+    SELECT * FROM keyed_tracks
 )
 
 SELECT * FROM final
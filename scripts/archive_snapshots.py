@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+archive_snapshots.py
+スナップショットのXML/CSVをその場で圧縮する
+
+data/snapshots/YYYY-MM-DD/music-library.xml → music-library.xml.gz（または .zst）
+
+1. 元のファイルを読みながらSHA-256を計算し、同じディレクトリの一時ファイルに圧縮して書く
+2. 一時ファイルを展開しながらもう一度SHA-256を計算し、元のハッシュと一致することを確認する
+3. 一致したら一時ファイルを正式な名前に置き換え（mtimeは元のファイルに合わせる）、
+   マニフェスト（snapshot_manifest）の記録を圧縮後のパスに書き換えてから元のファイルを消す
+
+ローダー（load_xml_snapshot.py / load_csv_snapshot.py / extract_music_snapshots.py）は
+圧縮したファイルをそのまま読める。マニフェストはDuckDBファイル（--db）とレイク（--lake）の
+うち存在するものを書き換えるので、watch_snapshots.py や再実行したローダーは圧縮したファイルを読み直さない。
+"""
+
+import argparse
+import gzip
+import hashlib
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import duckdb
+
+import snapshot_lake
+from snapshot_compression import (
+    GZIP_SUFFIX, ZSTD_SUFFIX, open_snapshot, require_zstandard, zstandard,
+)
+from snapshot_manifest import rename_source
+
+
+OUTPUT_DB = "music_replay.duckdb"
+
+
+SNAPSHOT_SUFFIXES = (".xml", ".csv")
+
+DEFAULT_LEVELS = {GZIP_SUFFIX: 6, ZSTD_SUFFIX: 10}
+
+CHUNK_SIZE = 1 << 20
+
+
+def find_snapshot_files(paths: list[Path]) -> list[Path]:
+    """圧縮されていないスナップショットのファイル（ディレクトリは再帰的に探す）"""
+    files = []
+    for path in paths:
+        candidates = path.rglob("*") if path.is_dir() else [path]
+        files.extend(
+            p for p in candidates
+            if p.is_file() and p.suffix.lower() in SNAPSHOT_SUFFIXES and not p.name.startswith(".")
+        )
+    return sorted(files)
+
+
+def copy_compressed(src, dst, codec: str, level: int) -> str:
+    """src を圧縮して dst に書き、元の内容のSHA-256を返す"""
+    digest = hashlib.sha256()
+    if codec == GZIP_SUFFIX:
+        # ファイル名と時刻をヘッダーに入れない（同じ内容なら同じバイト列になる）
+        writer = gzip.GzipFile(filename="", mode="wb", fileobj=dst, compresslevel=level, mtime=0)
+    else:
+        writer = zstandard.ZstdCompressor(level=level).stream_writer(dst, closefd=False)
+    with writer:
+        while chunk := src.read(CHUNK_SIZE):
+            digest.update(chunk)
+            writer.write(chunk)
+    return digest.hexdigest()
+
+
+def hash_decompressed(path: Path) -> str:
+    """展開した内容のSHA-256"""
+    digest = hashlib.sha256()
+    with open_snapshot(path) as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def archive_file(path: Path, codec: str, level: int,
+                 manifests: list[duckdb.DuckDBPyConnection]) -> tuple[int, int, str]:
+    """1ファイルを圧縮して置き換え、マニフェストのパスも書き換える（元のサイズ, 圧縮後のサイズ, SHA-256）"""
+    target = path.with_name(path.name + codec)
+    if target.exists():
+        raise FileExistsError(f"圧縮済みのファイルが既にあります: {target}")
+
+    # ローダーや watch_snapshots.py の対象にならない名前（.で始まる）で書く
+    # 展開して確認できるよう、拡張子は圧縮形式のものにする
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp{codec}")
+    try:
+        with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+            content_hash = copy_compressed(src, dst, codec, level)
+            dst.flush()
+            os.fsync(dst.fileno())
+        # 圧縮したファイルを実際に展開して、元の内容と一致するか確認する
+        verified = hash_decompressed(tmp_path)
+        if verified != content_hash:
+            raise ValueError(f"展開した内容が元のファイルと一致しません: {path}")
+        shutil.copystat(path, tmp_path)
+        os.replace(tmp_path, target)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    # マニフェストを書き換えられなければ圧縮したファイルを消し、元のファイルを残す
+    try:
+        for con in manifests:
+            rename_source(con, str(path), str(target), target.stat())
+    except BaseException:
+        target.unlink(missing_ok=True)
+        raise
+    original_size = path.stat().st_size
+    path.unlink()
+    return original_size, target.stat().st_size, content_hash
+
+
+def main():
+    parser = argparse.ArgumentParser(description='スナップショットのXML/CSVをその場で圧縮')
+    parser.add_argument('paths', nargs='*', default=['data/snapshots'],
+                        help='圧縮するファイルまたはディレクトリ（省略時は data/snapshots）')
+    parser.add_argument('--format', choices=['gz', 'zst'], default='gz',
+                        help='圧縮形式（zst は zstandard が必要）')
+    parser.add_argument('--level', type=int, help='圧縮レベル（省略時は gz: 6 / zst: 10）')
+    parser.add_argument('--db', default=OUTPUT_DB, help='マニフェストを書き換えるDuckDBファイルのパス')
+    parser.add_argument('--lake', default=snapshot_lake.LAKE_DIR,
+                        help='マニフェストを書き換えるParquetレイクのディレクトリ')
+    parser.add_argument('--dry-run', action='store_true', help='対象のファイルを表示するだけにする')
+    args = parser.parse_args()
+
+    codec = f".{args.format}"
+    if codec == ZSTD_SUFFIX:
+        try:
+            require_zstandard()
+        except RuntimeError as e:
+            print(f"エラー: {e}")
+            sys.exit(1)
+    level = args.level if args.level is not None else DEFAULT_LEVELS[codec]
+
+    # 相対パスはプロジェクトルートから解決する
+    def resolve(arg: str) -> Path:
+        path = Path(arg)
+        return path if path.is_absolute() else Path(__file__).parent.parent / path
+
+    paths = [resolve(arg) for arg in args.paths]
+    files = find_snapshot_files(paths)
+    if not files:
+        print("圧縮するファイルがありません")
+        return
+
+    # マニフェストのあるDBだけを開く（ロード済みの記録のパスを圧縮後のものに書き換える）
+    manifests = []
+    if not args.dry_run:
+        for db_path in (resolve(args.db), snapshot_lake.manifest_path(str(resolve(args.lake)))):
+            if not db_path.exists():
+                continue
+            try:
+                manifests.append(duckdb.connect(str(db_path)))
+            except duckdb.Error as e:
+                print(f"エラー: マニフェストを開けません: {db_path}: {e}")
+                sys.exit(1)
+
+    total_before = total_after = 0
+    failed = 0
+    for path in files:
+        if args.dry_run:
+            print(f"{path} → {path.name}{codec}")
+            continue
+        try:
+            before, after, content_hash = archive_file(path, codec, level, manifests)
+        except (OSError, ValueError, duckdb.Error) as e:
+            print(f"エラー: {e}")
+            failed += 1
+            continue
+        total_before += before
+        total_after += after
+        print(f"{path} → {path.name}{codec}  {before / 1e6:.1f} MB → {after / 1e6:.2f} MB "
+              f"(sha256 {content_hash[:12]})")
+    for con in manifests:
+        con.close()
+
+    if total_before:
+        print(f"\n{len(files) - failed} files: {total_before / 1e6:.1f} MB → {total_after / 1e6:.1f} MB "
+              f"({total_after / total_before:.1%})")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
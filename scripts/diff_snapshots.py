@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+diff_snapshots.py
+2つのスナップショットを直接比較して、その間の再生数を表示する
+
+DuckDBへのロードやdbtの実行をせずに「前回のスナップショットから何を聴いたか」を確認する。
+古い方のファイルから Persistent ID → 再生数・スキップ数 のハッシュ表を作り、
+新しい方のファイルをストリームで読みながら突き合わせる。
+メモリに載るのは古い方の再生数と、差分のあったトラック、アーティスト・アルバムごとの曲数だけ。
+
+集計はウェアハウスと同じ:
+  - 両方のスナップショットにあるトラックの、再生数が増えた分だけを数える
+  - アーティスト・アルバムの曲数（unique_tracks）は、再生の有無によらず両方にあるトラックの数
+  - アーティストはトラックのアーティスト、アルバムは（アルバム名, アルバムアーティスト）で集計する
+  - 再生時間は新しい方のスナップショットの曲の長さ（分、小数2桁に丸め）で計算する
+"""
+
+import argparse
+import csv
+import heapq
+import io
+import json
+import sys
+import time
+import unicodedata
+from collections import Counter
+from collections.abc import Iterator
+from datetime import datetime
+from operator import itemgetter
+from pathlib import Path
+
+from load_csv_snapshot import iter_csv_tracks
+from plist_stream import iter_track_fields
+from snapshot_compression import open_snapshot, snapshot_format
+
+
+# 比較に使うフィールド（ローダーと同じ名前）
+DIFF_FIELDS = (
+    "persistent_id", "name", "artist", "album_artist", "album",
+    "total_time", "play_count", "skip_count",
+)
+
+# 古い方のスナップショットから読むフィールド
+COUNT_FIELDS = ("persistent_id", "play_count", "skip_count")
+
+EXPORT_FORMATS = (".csv", ".json")
+
+EXPORT_COLUMNS = [
+    "persistent_id", "title", "artist_name", "album_name", "album_artist_name",
+    "duration_min", "play_count_delta", "skip_count_delta", "listening_minutes",
+]
+
+
+def iter_snapshot(path: str, fields: tuple[str, ...], header: dict) -> Iterator[tuple]:
+    """XML/CSVのスナップショットを fields 順のタプルとしてyieldする"""
+    with open_snapshot(path) as f:
+        if snapshot_format(path) == ".csv":
+            project = itemgetter(*fields)
+            for track in iter_csv_tracks(io.TextIOWrapper(f, encoding="utf-8"), header):
+                yield project(track)
+        else:
+            # 必要なフィールドだけを正規表現で拾う（完全にパースするより数倍速い）
+            yield from iter_track_fields(f, fields, header)
+
+    # ローダーと同じく、日時がなければファイルの更新日時を使う
+    if not header.get("Date"):
+        header["Date"] = datetime.fromtimestamp(Path(path).stat().st_mtime)
+
+
+def index_counts(path: str, header: dict) -> dict[str, tuple[int, int]]:
+    """Persistent ID → (再生数, スキップ数) のハッシュ表"""
+    return {
+        persistent_id: (play_count or 0, skip_count or 0)
+        for persistent_id, play_count, skip_count in iter_snapshot(path, COUNT_FIELDS, header)
+        if persistent_id
+    }
+
+
+class SnapshotDiff:
+    """古いスナップショットのハッシュ表と新しいスナップショットのストリームを突き合わせた結果"""
+
+    def __init__(self, old_counts: dict[str, tuple[int, int]]):
+        self.old_counts = old_counts
+        self.tracks: list[dict] = []
+        self.new_track_count = 0
+        self.added_track_count = 0
+        self.matched_track_count = 0
+        # 両方にあるトラックの、アーティスト・アルバムごとの曲数
+        self.artist_track_counts: Counter = Counter()
+        self.album_track_counts: Counter = Counter()
+
+    def probe(self, new_tracks: Iterator[tuple]):
+        """新しいスナップショットの各トラックを古い方と比較する"""
+        for (persistent_id, name, artist, album_artist, album,
+             total_time, play_count, skip_count) in new_tracks:
+            if not persistent_id:
+                continue
+            self.new_track_count += 1
+            old = self.old_counts.get(persistent_id)
+            if old is None:
+                self.added_track_count += 1
+                continue
+            self.matched_track_count += 1
+            self.artist_track_counts[(artist,)] += 1
+            if album is not None:
+                self.album_track_counts[(album, album_artist or artist)] += 1
+            play_count_delta = (play_count or 0) - old[0]
+            skip_count_delta = (skip_count or 0) - old[1]
+            if play_count_delta == 0 and skip_count_delta == 0:
+                continue
+            duration_min = round(total_time / 1000 / 60, 2) if total_time is not None else None
+            self.tracks.append({
+                "persistent_id": persistent_id,
+                "title": name,
+                "artist_name": artist,
+                "album_name": album,
+                "album_artist_name": album_artist,
+                "duration_min": duration_min,
+                "play_count_delta": play_count_delta,
+                "skip_count_delta": skip_count_delta,
+                "listening_minutes": (
+                    play_count_delta * duration_min
+                    if play_count_delta > 0 and duration_min is not None else 0.0
+                ),
+            })
+
+    @property
+    def removed_track_count(self) -> int:
+        return len(self.old_counts) - self.matched_track_count
+
+    def played_tracks(self) -> list[dict]:
+        """再生数が増えたトラック"""
+        return [t for t in self.tracks if t["play_count_delta"] > 0]
+
+    def summary(self) -> dict:
+        """再生回数・再生時間・ユニーク数"""
+        played = self.played_tracks()
+        return {
+            "total_plays": sum(t["play_count_delta"] for t in played),
+            "total_listening_minutes": sum(t["listening_minutes"] for t in played),
+            "unique_tracks_played": len(played),
+            "unique_artists_played": len({t["artist_name"] for t in played if t["artist_name"] is not None}),
+            "unique_albums_played": len({t["album_name"] for t in played if t["album_name"] is not None}),
+            "total_skips": sum(t["skip_count_delta"] for t in self.tracks if t["skip_count_delta"] > 0),
+        }
+
+    def top_songs(self, limit: int) -> list[dict]:
+        """再生数の多いトラック"""
+        return rank(self.played_tracks(), limit)
+
+    def top_artists(self, limit: int) -> list[dict]:
+        """再生数の多いアーティスト"""
+        tracks = [t for t in self.played_tracks() if t["artist_name"] is not None]
+        return rank(rollup(tracks, ("artist_name",), self.artist_track_counts), limit)
+
+    def top_albums(self, limit: int) -> list[dict]:
+        """再生数の多いアルバム（アルバムアーティストがなければトラックのアーティスト）"""
+        tracks = [
+            {**t, "album_artist_name": t["album_artist_name"] or t["artist_name"]}
+            for t in self.played_tracks() if t["album_name"] is not None
+        ]
+        return rank(rollup(tracks, ("album_name", "album_artist_name"), self.album_track_counts), limit)
+
+
+def rollup(tracks: list[dict], keys: tuple[str, ...], track_counts: Counter) -> list[dict]:
+    """keysごとに再生数・再生時間を合計し、曲数（track_counts）を付ける"""
+    groups: dict[tuple, dict] = {}
+    for track in tracks:
+        key = tuple(track[k] for k in keys)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {
+                **dict(zip(keys, key)), "play_count_delta": 0, "listening_minutes": 0.0,
+                "unique_tracks": track_counts[key],
+            }
+        group["play_count_delta"] += track["play_count_delta"]
+        group["listening_minutes"] += track["listening_minutes"]
+    return list(groups.values())
+
+
+def rank(rows: list[dict], limit: int) -> list[dict]:
+    """再生数の上位limit件に順位を付ける（同数は同順位）"""
+    top = heapq.nlargest(limit, rows, key=itemgetter("play_count_delta"))
+    ranked = []
+    for i, row in enumerate(top):
+        if i > 0 and row["play_count_delta"] == top[i - 1]["play_count_delta"]:
+            position = ranked[-1]["rank"]
+        else:
+            position = i + 1
+        ranked.append({"rank": position, **row})
+    return ranked
+
+
+def print_table(title: str, rows: list[dict], columns: list[str]):
+    """列幅を揃えて表示"""
+    print(f"\n{title}")
+    if not rows:
+        print("  （なし）")
+        return
+    cells = [[format_cell(row[c]) for c in columns] for row in rows]
+    widths = [
+        max(display_width(c), *(display_width(r[i]) for r in cells))
+        for i, c in enumerate(columns)
+    ]
+    for line in [columns, *cells]:
+        print("  " + "  ".join(pad(v, w) for v, w in zip(line, widths)))
+
+
+def format_cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return f"{value:.1f}"
+    return str(value)
+
+
+def display_width(text: str) -> int:
+    """全角文字を2桁として数えた表示幅"""
+    return sum(2 if unicodedata.east_asian_width(ch) in "WF" else 1 for ch in text)
+
+
+def pad(text: str, width: int) -> str:
+    return text + " " * (width - display_width(text))
+
+
+def export_tracks(path: Path, tracks: list[dict]):
+    """トラック別の差分を書き出す（.csv / .json）"""
+    if path.suffix.lower() == ".json":
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(tracks, f, ensure_ascii=False, indent=2)
+    else:
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=EXPORT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(tracks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='2つのスナップショットを比較して、その間の再生数を表示')
+    parser.add_argument('old_path', help='古い方のスナップショット（XML/CSV、.gz / .zst も可）')
+    parser.add_argument('new_path', help='新しい方のスナップショット（XML/CSV、.gz / .zst も可）')
+    parser.add_argument('--limit', type=int, default=10, help='ランキングの表示件数')
+    parser.add_argument('--output', help='トラック別の差分を書き出すファイル（.csv / .json）')
+    args = parser.parse_args()
+
+    for path in (args.old_path, args.new_path):
+        if not Path(path).exists():
+            print(f"エラー: ファイルが見つかりません: {path}")
+            sys.exit(1)
+    output = Path(args.output) if args.output else None
+    if output is not None and output.suffix.lower() not in EXPORT_FORMATS:
+        print(f"エラー: --output は {' / '.join(EXPORT_FORMATS)} のファイルを指定してください: {output}")
+        sys.exit(1)
+
+    started = time.perf_counter()
+    old_header, new_header = {}, {}
+    diff = SnapshotDiff(index_counts(args.old_path, old_header))
+    diff.probe(iter_snapshot(args.new_path, DIFF_FIELDS, new_header))
+    elapsed = time.perf_counter() - started
+
+    old_date, new_date = old_header["Date"].date(), new_header["Date"].date()
+    if old_date > new_date:
+        print("Warning: 1つ目のスナップショットの方が新しい日付です。再生数の差分は負になります。")
+
+    summary = diff.summary()
+    print(f"スナップショット: {old_date} → {new_date}（{(new_date - old_date).days}日間）")
+    print(f"トラック: {len(diff.old_counts)} → {diff.new_track_count}"
+          f"（追加 {diff.added_track_count} / 削除 {diff.removed_track_count}）")
+    print(f"再生: {summary['total_plays']}回 / {summary['total_listening_minutes']:.1f}分"
+          f"（{summary['unique_tracks_played']}曲 / {summary['unique_artists_played']}アーティスト"
+          f" / {summary['unique_albums_played']}アルバム）  スキップ: {summary['total_skips']}回")
+
+    print_table("トップソング", diff.top_songs(args.limit),
+                ["rank", "title", "artist_name", "play_count_delta", "listening_minutes"])
+    print_table("トップアーティスト", diff.top_artists(args.limit),
+                ["rank", "artist_name", "play_count_delta", "listening_minutes", "unique_tracks"])
+    print_table("トップアルバム", diff.top_albums(args.limit),
+                ["rank", "album_name", "album_artist_name", "play_count_delta", "listening_minutes"])
+
+    if output is not None:
+        export_tracks(output, sorted(diff.tracks, key=itemgetter("play_count_delta"), reverse=True))
+        print(f"\n{len(diff.tracks)} tracks → {output}")
+    print(f"\n比較: {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
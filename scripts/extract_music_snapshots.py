@@ -5,16 +5,36 @@ TimeMachineからMusicライブラリのスナップショットを抽出
 
 対応するTimeMachine構造（APFS形式）:
 /Volumes/.timemachine/[UUID]/YYYY-MM-DD-HHMMSS.backup/YYYY-MM-DD-HHMMSS.backup/Data/Users/...
+
+--user を複数指定すると、同じバックアップから家族・チームのメンバーごとのライブラリを
+それぞれの library_id で1回の実行でロードする
 """
 
 import os
 import sys
-import plistlib
+import time
+import argparse
 import duckdb
+import pyarrow as pa
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
-from datetime import datetime
+from datetime import date, datetime
 from dotenv import load_dotenv
 
+from ingest import (
+    DEFAULT_LIBRARY_ID, LIBRARY_HELP, STORAGE_FULL, STORAGE_HELP, STORAGE_LAKE, STORAGES,
+    check_library_id, copy_snapshot, create_table_if_not_exists, load_snapshot, records_to_table,
+)
+from load_audit import (
+    PROFILE_DIR, STATUS_COPIED, STATUS_FAILED, STATUS_LOADED, LoadAudit, audit_stage, new_run_id, profile_parse,
+)
+from plist_stream import iter_tracks
+from snapshot_compression import COMPRESSED_SUFFIXES, open_snapshot
+import snapshot_lake
+from snapshot_manifest import SnapshotManifest
+
 # .envファイルから環境変数を読み込む
 load_dotenv()
 
@@ -30,19 +50,24 @@ if not TIMEMACHINE_VOLUME:
     print("エラー: 環境変数 TIMEMACHINE_VOLUME が設定されていません。")
     print(".envファイルに 'TIMEMACHINE_VOLUME=\"/Volumes/.timemachine/[UUID]\"' のように記述してください。")
     sys.exit(1)
-if not USERNAME:
-    print("エラー: 環境変数 USERNAME が見つかりません。")
-    print(".envファイルが正しく設定されているか確認してください。")
-    sys.exit(1)
 # ---------------------------
 
-# ライブラリパス候補
-LIBRARY_PATHS = [
-    f"Users/{USERNAME}/Music/Music/Music Library.xml",
-    f"Users/{USERNAME}/Music/iTunes/iTunes Music Library.xml",
-    f"Users/{USERNAME}/Music/iTunes/iTunes Library.xml",
+# ライブラリパス候補（{username} はユーザー名）
+LIBRARY_PATH_TEMPLATES = [
+    "Users/{username}/Music/Music/Music Library.xml",
+    "Users/{username}/Music/iTunes/iTunes Music Library.xml",
+    "Users/{username}/Music/iTunes/iTunes Library.xml",
 ]
 
+def library_paths(username: str) -> list[str]:
+    """ユーザーのライブラリパス候補"""
+    return [template.format(username=username) for template in LIBRARY_PATH_TEMPLATES]
+
+def parse_user(value: str) -> tuple[str, str]:
+    """--user の値 USER[=LIBRARY_ID] を（ユーザー名, ライブラリID）にする（省略時のIDはユーザー名）"""
+    username, _, library_id = value.partition("=")
+    return username, check_library_id(library_id or username)
+
 def find_backups(timemachine_path: str) -> list[tuple[datetime, str]]:
     """TimeMachineのバックアップ一覧を取得（APFS形式対応）
 
@@ -80,154 +105,236 @@ def find_backups(timemachine_path: str) -> list[tuple[datetime, str]]:
     return sorted(backups)
 
 def find_library_file(backup_path: str, library_paths: list[str]) -> str | None:
-    """バックアップ内のライブラリファイルを探す"""
+    """バックアップ内のライブラリファイルを探す（圧縮して保存したもの .gz / .zst も探す）"""
     # APFS形式では "Data" が主、従来形式も念のためサポート
     for volume in ["Data", "Macintosh HD - Data", "Macintosh HD"]:
         for lib_path in library_paths:
-            full_path = Path(backup_path) / volume / lib_path
-            if full_path.exists():
-                return str(full_path)
+            for suffix in ("",) + COMPRESSED_SUFFIXES:
+                full_path = Path(backup_path) / volume / (lib_path + suffix)
+                if full_path.exists():
+                    return str(full_path)
     return None
 
-def parse_music_library(library_path: str) -> list[dict]:
+def parse_music_library(library_path: str, audit: LoadAudit | None = None) -> pa.Table | None:
     """MusicライブラリXMLをパース"""
     try:
-        with open(library_path, 'rb') as f:
-            plist = plistlib.load(f)
+        with audit_stage(audit, "parse"), open_snapshot(library_path, audit) as f:
+            return records_to_table(iter_tracks(f))
     except Exception as e:
         print(f"Error parsing plist file {library_path}: {e}")
-        return []
+        if audit is not None:
+            audit.error = str(e)
+        return None
+
+def parse_library_job(job: tuple[datetime, str, date | None, LoadAudit, str | None]
+                      ) -> tuple[datetime, str, date | None, pa.Table | None, LoadAudit]:
+    """ワーカープロセスで1バックアップ分のライブラリをパース
 
-    tracks = []
-    for track_id, track_data in plist.get('Tracks', {}).items():
-        tracks.append({
-            'track_id': int(track_id),
-            'name': track_data.get('Name'),
-            'artist': track_data.get('Artist'),
-            'album_artist': track_data.get('Album Artist'),
-            'album': track_data.get('Album'),
-            'genre': track_data.get('Genre'),
-            'kind': track_data.get('Kind'),
-            'total_time': track_data.get('Total Time'),
-            'disc_number': track_data.get('Disc Number'),
-            'disc_count': track_data.get('Disc Count'),
-            'track_number': track_data.get('Track Number'),
-            'track_count': track_data.get('Track Count'),
-            'year': track_data.get('Year'),
-            'date_added': track_data.get('Date Added'),
-            'play_count': track_data.get('Play Count'),
-            'play_date': track_data.get('Play Date'),
-            'play_date_utc': track_data.get('Play Date UTC'),
-            'skip_count': track_data.get('Skip Count'),
-            'skip_date': track_data.get('Skip Date'),
-            'rating': track_data.get('Rating'),
-            'loved': track_data.get('Loved'),
-            'persistent_id': track_data.get('Persistent ID'),
-            'location': track_data.get('Location'),
-        })
-
-    return tracks
-
-def load_to_duckdb(db_path: str, snapshot_date: datetime,
-                   snapshot_path: str, tracks: list[dict]):
-    """DuckDBにロード"""
-    if not tracks:
+    同一内容のスナップショットがロード済み（copy_fromあり）ならパースしない。
+    ロード記録はワーカー側で計測したものを返す（メモリの増加もワーカーで計測した値）。
+    """
+    backup_date, library_path, copy_from, audit, profile_dir = job
+    if copy_from is not None:
+        return backup_date, library_path, copy_from, None, audit
+    with profile_parse(profile_dir, f"parse-{audit.library_id}-{backup_date:%Y-%m-%d-%H%M%S}"):
+        tracks = parse_music_library(library_path, audit)
+    return backup_date, library_path, None, tracks, audit
+
+def iter_parsed(jobs: list[tuple[datetime, str, date | None, LoadAudit, str | None]], workers: int):
+    """パース結果をジョブの順番どおりに返す
+
+    workers > 1 のときはプロセスプールで並列にパースする。
+    完了順に関係なく投入順で返すので、同じ日付のバックアップが複数あっても
+    結果は常に最後のバックアップで上書きされる。
+    先読みはworkers * 2件までに抑え、パース済みテーブルが溜まりすぎないようにする。
+    """
+    if workers <= 1:
+        for job in jobs:
+            yield parse_library_job(job)
         return
-        
-    con = duckdb.connect(db_path)
-
-    con.execute("""
-        CREATE TABLE IF NOT EXISTS raw_itunes_library (
-            snapshot_date DATE NOT NULL,
-            snapshot_path VARCHAR NOT NULL,
-            track_id BIGINT NOT NULL,
-            name VARCHAR,
-            artist VARCHAR,
-            album_artist VARCHAR,
-            album VARCHAR,
-            genre VARCHAR,
-            kind VARCHAR,
-            total_time INTEGER,
-            disc_number INTEGER,
-            disc_count INTEGER,
-            track_number INTEGER,
-            track_count INTEGER,
-            year INTEGER,
-            date_added TIMESTAMP,
-            play_count INTEGER,
-            play_date BIGINT,
-            play_date_utc TIMESTAMP,
-            skip_count INTEGER,
-            skip_date TIMESTAMP,
-            rating INTEGER,
-            loved BOOLEAN,
-            persistent_id VARCHAR,
-            location VARCHAR,
-            PRIMARY KEY (snapshot_date, track_id)
-        )
-    """)
-
-    # 既存のデータを削除してから挿入する
-    con.execute("DELETE FROM raw_itunes_library WHERE snapshot_date = ?", [snapshot_date.date()])
-
-    for track in tracks:
-        con.execute("""
-            INSERT INTO raw_itunes_library VALUES (
-                ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
-            )
-        """, [
-            snapshot_date.date(),
-            snapshot_path,
-            track['track_id'],
-            track['name'],
-            track['artist'],
-            track['album_artist'],
-            track['album'],
-            track['genre'],
-            track['kind'],
-            track['total_time'],
-            track['disc_number'],
-            track['disc_count'],
-            track['track_number'],
-            track['track_count'],
-            track['year'],
-            track['date_added'],
-            track['play_count'],
-            track['play_date'],
-            track['play_date_utc'],
-            track['skip_count'],
-            track['skip_date'],
-            track['rating'],
-            track['loved'],
-            track['persistent_id'],
-            track['location'],
-        ])
 
-    con.close()
-    print(f"Loaded {len(tracks)} tracks from {snapshot_date.date()}")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        job_iter = iter(jobs)
+        for job in islice(job_iter, workers * 2):
+            pending.append(pool.submit(parse_library_job, job))
+        while pending:
+            result = pending.popleft().result()
+            for job in islice(job_iter, 1):
+                pending.append(pool.submit(parse_library_job, job))
+            yield result
 
 def main():
+    parser = argparse.ArgumentParser(description='TimeMachineのバックアップからスナップショットを抽出')
+    parser.add_argument('--workers', type=int, default=1, help='パースに使うプロセス数')
+    parser.add_argument('--user', type=parse_user, action='append', default=[], metavar='USER[=LIBRARY_ID]',
+                        help='ライブラリを抽出するユーザー（複数指定可、ライブラリIDの省略時はユーザー名。'
+                             '省略時は環境変数 USERNAME のユーザーを --library のIDで抽出する）')
+    parser.add_argument('--library', type=check_library_id, default=DEFAULT_LIBRARY_ID, help=LIBRARY_HELP)
+    parser.add_argument('--storage', choices=STORAGES, default=STORAGE_FULL, help=STORAGE_HELP)
+    parser.add_argument('--lake', default=snapshot_lake.LAKE_DIR,
+                        help='--storage lake のときのParquetレイクのディレクトリ')
+    parser.add_argument('--rescan', action='store_true',
+                        help='マニフェストを無視してすべてのバックアップを読み直す')
+    parser.add_argument('--profile', nargs='?', const=PROFILE_DIR, metavar='DIR',
+                        help=f'パースをcProfileで計測してDIRに出力する（省略時は {PROFILE_DIR}/）')
+    args = parser.parse_args()
+
     # DuckDBファイルをプロジェクトルートに作成
     db_file = Path(__file__).parent.parent / OUTPUT_DB
+    lake_dir = Path(args.lake)
+    if not lake_dir.is_absolute():
+        lake_dir = Path(__file__).parent.parent / args.lake
+    use_lake = args.storage == STORAGE_LAKE
+    profile_dir = Path(args.profile) if args.profile else None
+    if profile_dir and not profile_dir.is_absolute():
+        profile_dir = Path(__file__).parent.parent / profile_dir
+    run_id = new_run_id()
+
+    users = args.user
+    if not users:
+        if not USERNAME:
+            print("エラー: 環境変数 USERNAME が見つかりません。")
+            print(".envファイルが正しく設定されているか、--user を指定してください。")
+            sys.exit(1)
+        users = [(USERNAME, args.library)]
+    library_ids = [library_id for _, library_id in users]
+    if len(set(library_ids)) != len(library_ids):
+        print("エラー: 同じライブラリIDが複数のユーザーに指定されています")
+        sys.exit(1)
 
     backups = find_backups(TIMEMACHINE_VOLUME)
     if not backups:
         return
 
-    print(f"Found {len(backups)} backups")
+    print(f"Found {len(backups)} backups, {len(users)} user(s)")
 
+    # 書き込みはこの1接続だけが行い、スナップショットごとにコミットする
+    # レイクに書き出す場合、この接続はレイク側のマニフェストだけに使う（本体のDBはロックしない）
+    if use_lake:
+        lake_dir.mkdir(parents=True, exist_ok=True)
+        con = duckdb.connect(str(lake_dir / snapshot_lake.LAKE_MANIFEST_DB))
+    else:
+        con = duckdb.connect(str(db_file))
+        create_table_if_not_exists(con, args.storage)
+    # マニフェストと同一内容のコピー元はライブラリごとに持つ
+    manifests = {library_id: SnapshotManifest(con, library_id) for library_id in library_ids}
+    planned_by_hash = {library_id: {} for library_id in library_ids}
+    # 日付ごとに最後にロードする予定の内容（同じ日のバックアップは後のものが残る）
+    planned_by_date = {library_id: {} for library_id in library_ids}
+
+    jobs = []
+    file_info = {}
+    # 同じ日の同じ内容のバックアップ（ロードする予定のジョブが成功した後で記録する）
+    duplicates = {}
+    skipped = 0
     for backup_date, backup_path in backups:
-        print(f"\nProcessing backup from {backup_date}...")
-        library_path = find_library_file(backup_path, LIBRARY_PATHS)
-        if not library_path:
-            print(f"-> No library file found in this backup.")
+        pending_users = [
+            (username, library_id) for username, library_id in users
+            if args.rescan or not manifests[library_id].is_missing(backup_path)
+        ]
+        skipped += len(users) - len(pending_users)
+        if not pending_users:
             continue
-        
-        print(f"-> Found library file: {library_path}")
-        tracks = parse_music_library(library_path)
-        
-        if tracks:
-            load_to_duckdb(str(db_file), backup_date, library_path, tracks)
+
+        print(f"\nProcessing backup from {backup_date}...")
+        for username, library_id in pending_users:
+            manifest = manifests[library_id]
+            audit = LoadAudit(run_id, "extract", args.storage, backup_path, library_id)
+            with audit.stage("discover"):
+                library_path = find_library_file(backup_path, library_paths(username))
+                if not library_path:
+                    print(f"-> [{library_id}] No library file found in this backup.")
+                    manifest.record_missing(backup_path, backup_date)
+                    continue
+
+                st = os.stat(library_path)
+                if not args.rescan and manifest.is_unchanged(library_path, st, backup_date.date()):
+                    print(f"-> [{library_id}] Already loaded: {library_path}")
+                    skipped += 1
+                    continue
+
+                print(f"-> [{library_id}] Found library file: {library_path}")
+                content_hash = manifest.content_hash(library_path, st)
+            copy_from = planned_by_hash[library_id].get(content_hash)
+            planned = copy_from is not None
+            if not planned and not args.rescan:
+                copy_from = manifest.loaded_snapshot_for(content_hash)
+            if copy_from == backup_date.date():
+                if planned_by_date[library_id].get(copy_from, content_hash) == content_hash:
+                    # 同じ日のバックアップ（1時間ごとなど）と同じ内容なら、パースもロードもしない
+                    print(f"-> [{library_id}] Same content as an earlier backup of the day: {library_path}")
+                    if planned:
+                        duplicates.setdefault((library_id, content_hash, copy_from), []).append(
+                            (library_path, backup_date, st))
+                    else:
+                        manifest.record_same_content(library_path, st, content_hash, backup_date)
+                    skipped += 1
+                    continue
+                copy_from = None
+            audit.source_path = library_path
+            audit.file_size = st.st_size
+            jobs.append((backup_date, library_path, copy_from, audit, profile_dir))
+            file_info[library_path] = (st, content_hash)
+            planned_by_hash[library_id][content_hash] = backup_date.date()
+            planned_by_date[library_id][backup_date.date()] = content_hash
+
+    if not jobs:
+        print(f"\nNothing to load ({skipped} backups skipped)")
+        con.close()
+        return
+
+    started = time.perf_counter()
+    loaded_backups = 0
+    loaded_tracks = 0
+    copied_backups = 0
+    for backup_date, library_path, copy_from, tracks, audit in iter_parsed(jobs, args.workers):
+        library_id = audit.library_id
+        loaded = 0
+        status = STATUS_LOADED
+        if copy_from is not None:
+            # 同一内容のスナップショットを行コピーで複製する
+            if use_lake:
+                loaded = snapshot_lake.copy_snapshot(str(lake_dir), backup_date, library_path, copy_from,
+                                                     audit, library_id)
+            else:
+                loaded = copy_snapshot(con, backup_date, library_path, copy_from, args.storage, audit, library_id)
+            if loaded:
+                copied_backups += 1
+                status = STATUS_COPIED
+                print(f"[{library_id}] Copied {loaded} tracks from {copy_from} to {backup_date.date()} "
+                      f"(identical content)")
+            else:
+                with profile_parse(profile_dir, f"parse-{library_id}-{backup_date:%Y-%m-%d-%H%M%S}"):
+                    tracks = parse_music_library(library_path, audit)
+        if not loaded:
+            if not tracks:
+                audit.finish(STATUS_FAILED, snapshot_date=backup_date, error=audit.error)
+                audit.record(con)
+                continue
+            if use_lake:
+                loaded = snapshot_lake.write_snapshot(str(lake_dir), backup_date, library_path, tracks,
+                                                      audit, library_id)
+            else:
+                loaded = load_snapshot(con, backup_date, library_path, tracks, args.storage, audit, library_id)
+            print(f"[{library_id}] Loaded {loaded} tracks from {backup_date.date()}")
+        audit.finish(status, loaded, backup_date)
+        audit.record(con)
+        print(f"-> {audit.summary()}")
+        st, content_hash = file_info[library_path]
+        manifests[library_id].record_loaded(library_path, backup_date, st, content_hash, loaded)
+        for duplicate_path, duplicate_date, duplicate_st in duplicates.pop(
+                (library_id, content_hash, backup_date.date()), []):
+            manifests[library_id].record_loaded(duplicate_path, duplicate_date, duplicate_st, content_hash, loaded)
+        loaded_backups += 1
+        loaded_tracks += loaded
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    con.close()
+
+    print(f"\nLoaded {loaded_backups} backups / {loaded_tracks} tracks in {elapsed:.2f}s "
+          f"({loaded_backups / elapsed:.2f} backups/s, {loaded_tracks / elapsed:.0f} tracks/s, "
+          f"workers={args.workers}, {copied_backups} copied, {skipped} skipped)")
+    print(f"Run ID: {run_id}（load_audit に記録）")
 
 if __name__ == "__main__":
     main()
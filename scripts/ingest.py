@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+ingest.py
+raw_itunes_libraryへの共通ロード処理
+
+パース済みのトラックを列指向のArrowテーブルに変換し、
+スナップショット単位で1トランザクションのバルク追加を行う
+
+storage="compact" のときはスナップショットごとの全件コピーではなく、
+変化した行だけを raw_itunes_library_changes に保存する
+storage="lake" のときはDuckDBには書かず、snapshot_lake.py でParquetレイクに書き出す
+
+複数のライブラリ（家族・チームのメンバーごと）を同じウェアハウスに入れられるよう、
+どのテーブルも library_id を持ち、削除・置き換えはライブラリ単位で行う
+"""
+
+import re
+from collections.abc import Iterable
+from datetime import date, datetime
+from itertools import islice
+
+import duckdb
+import pyarrow as pa
+
+from load_audit import LoadAudit, audit_stage
+
+
+RAW_TABLE = "raw_itunes_library"
+
+# compact形式: 最初のスナップショットを基準に、変化したトラックだけを
+# 有効期間（valid_from〜valid_to）付きで保存する（SCD Type 2）
+CHANGES_TABLE = "raw_itunes_library_changes"
+SNAPSHOT_LOG_TABLE = "raw_snapshot_log"
+
+STORAGE_FULL = "full"
+STORAGE_COMPACT = "compact"
+STORAGE_LAKE = "lake"
+STORAGES = (STORAGE_FULL, STORAGE_COMPACT, STORAGE_LAKE)
+
+STORAGE_HELP = ("full: スナップショットごとに全件保存 / compact: 変化した行だけを保存 / "
+                "lake: DuckDBを使わずParquetレイクに書き出す")
+
+# --library を省略したときのライブラリID（library_id 導入前のデータもこのIDに移行する）
+DEFAULT_LIBRARY_ID = "default"
+
+# パーティションのディレクトリ名とdbtが埋め込むSQLの文字列に使うため、使える文字を限る
+LIBRARY_ID_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]*")
+
+LIBRARY_HELP = f"ライブラリID（メンバーごとに分ける。英数字と _ . -、省略時は {DEFAULT_LIBRARY_ID}）"
+
+# Arrowに変換する際の1バッチの行数
+BATCH_ROWS = 65536
+
+# トラック単位の列定義（DuckDBの型, Arrowの型）
+# snapshot_date / snapshot_path はスナップショット単位で付与する
+TRACK_COLUMNS: list[tuple[str, str, pa.DataType]] = [
+    ("track_id", "BIGINT NOT NULL", pa.int64()),
+    ("name", "VARCHAR", pa.string()),
+    ("artist", "VARCHAR", pa.string()),
+    ("album_artist", "VARCHAR", pa.string()),
+    ("album", "VARCHAR", pa.string()),
+    ("genre", "VARCHAR", pa.string()),
+    ("kind", "VARCHAR", pa.string()),
+    ("total_time", "INTEGER", pa.int32()),
+    ("disc_number", "INTEGER", pa.int32()),
+    ("disc_count", "INTEGER", pa.int32()),
+    ("track_number", "INTEGER", pa.int32()),
+    ("track_count", "INTEGER", pa.int32()),
+    ("year", "INTEGER", pa.int32()),
+    ("date_added", "TIMESTAMP", pa.timestamp("us")),
+    ("play_count", "INTEGER", pa.int32()),
+    ("play_date", "BIGINT", pa.int64()),
+    ("play_date_utc", "TIMESTAMP", pa.timestamp("us")),
+    ("skip_count", "INTEGER", pa.int32()),
+    ("skip_date", "TIMESTAMP", pa.timestamp("us")),
+    ("rating", "INTEGER", pa.int32()),
+    ("loved", "BOOLEAN", pa.bool_()),
+    ("persistent_id", "VARCHAR", pa.string()),
+    ("location", "VARCHAR", pa.string()),
+]
+
+TRACK_FIELDS = [name for name, _, _ in TRACK_COLUMNS]
+
+TRACK_SCHEMA = pa.schema([(name, arrow_type) for name, _, arrow_type in TRACK_COLUMNS])
+
+
+def check_library_id(value: str) -> str:
+    """ライブラリIDとして使える文字列か確認する（argparse の type にも使う）"""
+    if not LIBRARY_ID_PATTERN.fullmatch(value):
+        raise ValueError(f"ライブラリIDに使えるのは英数字と _ . - だけです: {value!r}")
+    return value
+
+
+def create_table_if_not_exists(con: duckdb.DuckDBPyConnection, storage: str = STORAGE_FULL):
+    """テーブルを作成（library_id のない以前のテーブルは DEFAULT_LIBRARY_ID のデータとして移行する）"""
+    column_defs = ",\n            ".join(
+        f"{name} {sql_type}" for name, sql_type, _ in TRACK_COLUMNS
+    )
+    if storage == STORAGE_COMPACT:
+        tables = {
+            CHANGES_TABLE: f"""
+                CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (
+                    library_id VARCHAR NOT NULL,
+                    valid_from DATE NOT NULL,
+                    valid_to DATE,
+                    prev_snapshot_date DATE,
+                    {column_defs},
+                    PRIMARY KEY (library_id, valid_from, persistent_id)
+                )
+            """,
+            SNAPSHOT_LOG_TABLE: f"""
+                CREATE TABLE IF NOT EXISTS {SNAPSHOT_LOG_TABLE} (
+                    library_id VARCHAR NOT NULL,
+                    snapshot_date DATE NOT NULL,
+                    snapshot_path VARCHAR NOT NULL,
+                    track_count INTEGER NOT NULL,
+                    PRIMARY KEY (library_id, snapshot_date)
+                )
+            """,
+        }
+    else:
+        tables = {
+            RAW_TABLE: f"""
+                CREATE TABLE IF NOT EXISTS {RAW_TABLE} (
+                    library_id VARCHAR NOT NULL,
+                    snapshot_date DATE NOT NULL,
+                    snapshot_path VARCHAR NOT NULL,
+                    {column_defs},
+                    PRIMARY KEY (library_id, snapshot_date, track_id)
+                )
+            """,
+        }
+
+    for table, ddl in tables.items():
+        create_library_table(con, table, ddl)
+
+
+def create_library_table(con: duckdb.DuckDBPyConnection, table: str, ddl: str):
+    """library_id を先頭の列に持つテーブルを作成する
+
+    library_id のない以前のテーブルがあれば、主キーを変えるため作り直し、
+    既存の行は DEFAULT_LIBRARY_ID を付けて戻す。
+    """
+    columns = [row[0] for row in con.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = ?
+    """, [table]).fetchall()]
+    if not columns or "library_id" in columns:
+        con.execute(ddl)
+        return
+    con.begin()
+    try:
+        con.execute(f"ALTER TABLE {table} RENAME TO {table}_before_library_id")
+        con.execute(ddl)
+        con.execute(f"INSERT INTO {table} SELECT ?, * FROM {table}_before_library_id", [DEFAULT_LIBRARY_ID])
+        con.execute(f"DROP TABLE {table}_before_library_id")
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+
+
+def records_to_table(records: Iterable[tuple], batch_rows: int = BATCH_ROWS) -> pa.Table:
+    """TRACK_FIELDS順のタプルをbatch_rows件ずつ列に転置してArrowテーブルにする"""
+    batches = []
+    rows = list(islice(records, batch_rows))
+    while rows:
+        columns = zip(*rows)
+        batches.append(pa.record_batch(
+            [pa.array(values, type=field.type) for values, field in zip(columns, TRACK_SCHEMA)],
+            schema=TRACK_SCHEMA,
+        ))
+        rows = list(islice(records, batch_rows))
+    return pa.Table.from_batches(batches, schema=TRACK_SCHEMA)
+
+
+def tracks_to_table(tracks: Iterable[dict]) -> pa.Table:
+    """トラックのdictを列ごとの配列に詰め替えてArrowテーブルにする"""
+    return records_to_table(
+        tuple(track.get(name) for name in TRACK_FIELDS) for track in tracks
+    )
+
+
+def load_snapshot(con: duckdb.DuckDBPyConnection, snapshot_date: datetime,
+                  snapshot_path: str, table: pa.Table,
+                  storage: str = STORAGE_FULL, audit: LoadAudit | None = None,
+                  library_id: str = DEFAULT_LIBRARY_ID) -> int:
+    """1ライブラリの1スナップショット分を1トランザクションで置き換える"""
+    select_list = ", ".join(f"t.{name}" for name in TRACK_FIELDS)
+
+    con.register("_snapshot_batch", table)
+    con.begin()
+    try:
+        if storage == STORAGE_COMPACT:
+            with audit_stage(audit, "insert"):
+                loaded = apply_changes(con, library_id, snapshot_date, snapshot_path,
+                                       f"SELECT {select_list} FROM _snapshot_batch AS t", [], audit)
+        else:
+            # 既存のデータを削除してから挿入する（他のライブラリの行には触れない）
+            with audit_stage(audit, "delete"):
+                con.execute(f"DELETE FROM {RAW_TABLE} WHERE library_id = ? AND snapshot_date = ?",
+                            [library_id, snapshot_date.date()])
+            with audit_stage(audit, "insert"):
+                con.execute(f"""
+                    INSERT INTO {RAW_TABLE}
+                    SELECT ?::VARCHAR, ?::DATE, ?::VARCHAR, {select_list}
+                    FROM _snapshot_batch AS t
+                """, [library_id, snapshot_date.date(), snapshot_path])
+            loaded = table.num_rows
+        with audit_stage(audit, "commit"):
+            con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    finally:
+        con.unregister("_snapshot_batch")
+
+    return loaded
+
+
+def copy_snapshot(con: duckdb.DuckDBPyConnection, snapshot_date: datetime,
+                  snapshot_path: str, source_date: date,
+                  storage: str = STORAGE_FULL, audit: LoadAudit | None = None,
+                  library_id: str = DEFAULT_LIBRARY_ID) -> int:
+    """内容が同一のスナップショットを同じライブラリの既存の行からコピーする（パースしない）"""
+    select_list = ", ".join(TRACK_FIELDS)
+
+    con.begin()
+    try:
+        if storage == STORAGE_COMPACT:
+            # source_date時点の状態を変更行から復元して適用する
+            with audit_stage(audit, "insert"):
+                copied = apply_changes(con, library_id, snapshot_date, snapshot_path, f"""
+                    SELECT {select_list}
+                    FROM {CHANGES_TABLE}
+                    WHERE library_id = ?
+                        AND valid_from <= ?
+                        AND (valid_to IS NULL OR valid_to > ?)
+                """, [library_id, source_date, source_date], audit)
+        else:
+            with audit_stage(audit, "delete"):
+                con.execute(f"DELETE FROM {RAW_TABLE} WHERE library_id = ? AND snapshot_date = ?",
+                            [library_id, snapshot_date.date()])
+            with audit_stage(audit, "insert"):
+                copied = con.execute(f"""
+                    INSERT INTO {RAW_TABLE}
+                    SELECT library_id, ?::DATE, ?::VARCHAR, {select_list}
+                    FROM {RAW_TABLE}
+                    WHERE library_id = ?
+                        AND snapshot_date = ?
+                """, [snapshot_date.date(), snapshot_path, library_id, source_date]).fetchone()[0]
+        with audit_stage(audit, "commit"):
+            con.commit()
+    except Exception:
+        con.rollback()
+        raise
+
+    return copied
+
+
+def apply_changes(con: duckdb.DuckDBPyConnection, library_id: str, snapshot_date: datetime,
+                  snapshot_path: str, source_sql: str, params: list,
+                  audit: LoadAudit | None = None) -> int:
+    """compact形式で1ライブラリの1スナップショットを適用する（トランザクション内で呼ぶ）
+
+    1. 直近のスナップショットの再ロードなら、その日の変更を取り消す
+    2. 内容が変わった・消えたトラックの現行行を valid_to = snapshot_date で閉じる
+    3. 現行行のないトラックに新しい行を追加する
+    prev_snapshot_date には、そのトラックが最後に存在したスナップショット日を入れる。
+    persistent_idのない行はsilver以降で使われないため保存しない。
+    同じpersistent_idの行が複数あれば最後の行だけを残す。
+    1・2は delete ステージとして計測する（残りは呼び出し側の insert ステージ）。
+    """
+    day = snapshot_date.date()
+
+    con.execute("DROP TABLE IF EXISTS _snapshot_stage")
+    con.execute(f"""
+        CREATE TEMP TABLE _snapshot_stage AS
+        SELECT * FROM ({source_sql})
+        WHERE persistent_id IS NOT NULL
+    """, params)
+    con.execute("""
+        DELETE FROM _snapshot_stage
+        WHERE rowid NOT IN (SELECT MAX(rowid) FROM _snapshot_stage GROUP BY persistent_id)
+    """)
+    staged = con.execute("SELECT COUNT(*) FROM _snapshot_stage").fetchone()[0]
+    if not staged:
+        con.execute("DROP TABLE _snapshot_stage")
+        return 0
+
+    latest = con.execute(f"SELECT MAX(snapshot_date) FROM {SNAPSHOT_LOG_TABLE} WHERE library_id = ?",
+                         [library_id]).fetchone()[0]
+    if latest is not None and day < latest:
+        raise ValueError(
+            f"compact形式では最新のスナップショット（{library_id}: {latest}）より古い日付 {day} は追加できません。"
+            "全スナップショットを日付順にロードし直してください。"
+        )
+    same_state = " AND ".join(
+        f"s.{name} IS NOT DISTINCT FROM c.{name}" for name in TRACK_FIELDS
+    )
+    with audit_stage(audit, "delete"):
+        if day == latest:
+            con.execute(f"DELETE FROM {CHANGES_TABLE} WHERE library_id = ? AND valid_from = ?", [library_id, day])
+            con.execute(f"UPDATE {CHANGES_TABLE} SET valid_to = NULL WHERE library_id = ? AND valid_to = ?",
+                        [library_id, day])
+            con.execute(f"DELETE FROM {SNAPSHOT_LOG_TABLE} WHERE library_id = ? AND snapshot_date = ?",
+                        [library_id, day])
+
+        con.execute(f"""
+            UPDATE {CHANGES_TABLE} AS c
+            SET valid_to = ?
+            WHERE c.library_id = ?
+                AND c.valid_to IS NULL
+                AND NOT EXISTS (
+                    SELECT 1 FROM _snapshot_stage AS s
+                    WHERE {same_state}
+                )
+        """, [day, library_id])
+
+    select_list = ", ".join(f"s.{name}" for name in TRACK_FIELDS)
+    con.execute(f"""
+        INSERT INTO {CHANGES_TABLE}
+        WITH new_versions AS (
+            SELECT s.*
+            FROM _snapshot_stage AS s
+            ANTI JOIN {CHANGES_TABLE} AS c
+                ON c.library_id = ?
+                AND c.persistent_id = s.persistent_id
+                AND c.valid_to IS NULL
+        ),
+        last_seen AS (
+            SELECT
+                c.persistent_id,
+                MAX(c.valid_to) AS last_valid_to
+            FROM {CHANGES_TABLE} AS c
+            SEMI JOIN new_versions AS s
+                ON c.persistent_id = s.persistent_id
+            WHERE c.library_id = ?
+            GROUP BY c.persistent_id
+        )
+        SELECT
+            ?::VARCHAR AS library_id,
+            ?::DATE AS valid_from,
+            NULL::DATE AS valid_to,
+            (
+                SELECT MAX(l.snapshot_date)
+                FROM {SNAPSHOT_LOG_TABLE} AS l
+                WHERE l.library_id = ?
+                    AND l.snapshot_date < p.last_valid_to
+            ) AS prev_snapshot_date,
+            {select_list}
+        FROM new_versions AS s
+        LEFT JOIN last_seen AS p
+            ON p.persistent_id = s.persistent_id
+    """, [library_id, library_id, library_id, day, library_id])
+
+    con.execute(f"INSERT INTO {SNAPSHOT_LOG_TABLE} VALUES (?, ?, ?, ?)",
+                [library_id, day, snapshot_path, staged])
+    con.execute("DROP TABLE _snapshot_stage")
+    return staged
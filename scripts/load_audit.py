@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+load_audit.py
+スナップショットごとのロード記録（load_audit テーブル）
+
+ソースパス・ファイルサイズ・ステージごとの所要時間・ロード行数・ピークメモリを
+実行ID付きで1スナップショット1行として記録する。夜間のバックフィルが遅いときに、
+時間がディスクI/O・パース・DELETE・INSERT・コミットのどこで掛かったかを追えるようにする。
+
+ステージ:
+    discover  バックアップ内のライブラリファイルの探索・stat・内容ハッシュ
+    read      ファイルの読み込み（パース中のread呼び出しの合計）
+    parse     パースとArrowテーブルへの変換（readの時間を除く）
+    delete    既存スナップショットの削除（compact形式では変更行の取り消し・クローズ）
+    insert    行の追加（レイクではParquetの書き出し）
+    commit    コミット（レイクではファイルの置き換え）
+
+ステージは入れ子にでき、内側のステージの時間は外側から差し引かれる。
+total_seconds はステージの合計（並列パース時のキュー待ちなどは含まない）。
+メモリは各ステージの開始時と終了時にプロセスのピークRSS（ru_maxrss、macOS・Linuxとも）を読む:
+    peak_rss_mb         そのスナップショットの最後のステージを終えた時点のピークRSS
+    peak_rss_growth_mb  ステージの間にピークRSSが増えた量の最大（0ならそれまでのピークの範囲に収まった）
+"""
+
+import cProfile
+import io
+import pstats
+import resource
+import sys
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from datetime import date, datetime
+from pathlib import Path
+
+import duckdb
+
+
+LOAD_AUDIT_TABLE = "load_audit"
+
+STAGES = ("discover", "read", "parse", "delete", "insert", "commit")
+
+STATUS_LOADED = "loaded"
+STATUS_COPIED = "copied"
+STATUS_FAILED = "failed"
+
+# --profile のデフォルトの出力先と、レポートに出す関数の数
+PROFILE_DIR = "profiles"
+PROFILE_TOP_N = 40
+
+
+def create_load_audit_if_not_exists(con: duckdb.DuckDBPyConnection):
+    """ロード記録テーブルを作成"""
+    stage_defs = ",\n            ".join(f"{name}_seconds DOUBLE" for name in STAGES)
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {LOAD_AUDIT_TABLE} (
+            run_id VARCHAR NOT NULL,
+            library_id VARCHAR,
+            loader VARCHAR NOT NULL,
+            storage VARCHAR NOT NULL,
+            snapshot_date DATE,
+            source_path VARCHAR NOT NULL,
+            file_size BIGINT,
+            status VARCHAR NOT NULL,
+            rows_loaded INTEGER,
+            {stage_defs},
+            total_seconds DOUBLE,
+            peak_rss_mb DOUBLE,
+            peak_rss_growth_mb DOUBLE,
+            started_at TIMESTAMP NOT NULL,
+            finished_at TIMESTAMP,
+            error VARCHAR
+        )
+    """)
+    # library_id の導入前に作ったテーブル（以前の行は NULL のまま）
+    con.execute(f"ALTER TABLE {LOAD_AUDIT_TABLE} ADD COLUMN IF NOT EXISTS library_id VARCHAR")
+    # ピークRSSの列より前に作ったテーブル（以前の行は NULL のまま）
+    for column in ("peak_rss_mb", "peak_rss_growth_mb"):
+        con.execute(f"ALTER TABLE {LOAD_AUDIT_TABLE} ADD COLUMN IF NOT EXISTS {column} DOUBLE")
+
+
+def new_run_id() -> str:
+    """1回の実行（プロセス）で共通の実行ID"""
+    return uuid.uuid4().hex
+
+
+def peak_rss_mb() -> float:
+    """このプロセスのこれまでのピークRSS（MB）"""
+    # ru_maxrss はmacOSではバイト、LinuxではKB
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / (1 << 20)
+
+
+def audit_stage(audit: "LoadAudit | None", name: str):
+    """auditがあればステージを計測する（Noneなら何もしない）"""
+    return audit.stage(name) if audit is not None else nullcontext()
+
+
+def open_source(audit: "LoadAudit | None", path: str):
+    """ソースファイルをバイナリで開く（auditがあれば読み込み時間を計測する）"""
+    return audit.open(path) if audit is not None else open(path, "rb")
+
+
+class _TimedReader(io.RawIOBase):
+    """readinto の時間を read ステージとして加算するファイル"""
+
+    def __init__(self, raw: io.RawIOBase, audit: "LoadAudit"):
+        self.raw = raw
+        self.audit = audit
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        started = time.perf_counter()
+        n = self.raw.readinto(buffer)
+        self.audit.add("read", time.perf_counter() - started)
+        return n
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+class LoadAudit:
+    """1スナップショット分のロード記録"""
+
+    def __init__(self, run_id: str, loader: str, storage: str, source_path: str, library_id: str):
+        self.run_id = run_id
+        self.library_id = library_id
+        self.loader = loader
+        self.storage = storage
+        self.source_path = source_path
+        self.snapshot_date: date | None = None
+        self.file_size: int | None = None
+        self.status: str | None = None
+        self.rows_loaded: int | None = None
+        self.error: str | None = None
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.peak_rss_mb = 0.0
+        self.peak_rss_growth_mb = 0.0
+        self.started_at = datetime.now()
+        self.finished_at: datetime | None = None
+        self._nested: list[float] = []
+
+    def open(self, path: str) -> io.BufferedReader:
+        """読み込み時間を計測するバイナリファイルとして開く"""
+        return io.BufferedReader(_TimedReader(io.FileIO(path, "rb"), self))
+
+    def add(self, name: str, seconds: float):
+        """ステージに時間を加算する（実行中のステージからは差し引く）"""
+        self.seconds[name] += seconds
+        if self._nested:
+            self._nested[-1] += seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        """with ブロックの時間をステージとして計測する（ピークRSSの増加も記録する）"""
+        started = time.perf_counter()
+        peak_before = peak_rss_mb()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.seconds[name] += elapsed - self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+            peak_after = peak_rss_mb()
+            self.note_peak_rss(peak_after, peak_after - peak_before)
+
+    def note_peak_rss(self, peak_mb: float, growth_mb: float):
+        """ピークRSSとその増加を反映する（ワーカープロセスで計測した値も同じ記録にまとめる）"""
+        self.peak_rss_mb = max(self.peak_rss_mb, peak_mb)
+        self.peak_rss_growth_mb = max(self.peak_rss_growth_mb, growth_mb)
+
+    def finish(self, status: str, rows_loaded: int | None = None,
+               snapshot_date: date | datetime | None = None, error: str | None = None):
+        """結果を確定する"""
+        if isinstance(snapshot_date, datetime):
+            snapshot_date = snapshot_date.date()
+        self.status = status
+        self.rows_loaded = rows_loaded
+        self.snapshot_date = snapshot_date or self.snapshot_date
+        self.error = error
+        self.finished_at = datetime.now()
+
+    def summary(self) -> str:
+        """ステージごとの時間の1行サマリー"""
+        stages = " / ".join(f"{name} {self.seconds[name]:.2f}s" for name in STAGES if self.seconds[name])
+        return f"{stages} (peak {self.peak_rss_mb:.0f} MB, +{self.peak_rss_growth_mb:.0f} MB)"
+
+    def record(self, con: duckdb.DuckDBPyConnection):
+        """load_audit に1行追加する"""
+        create_load_audit_if_not_exists(con)
+        values = {
+            "run_id": self.run_id, "library_id": self.library_id, "loader": self.loader,
+            "storage": self.storage, "snapshot_date": self.snapshot_date,
+            "source_path": self.source_path, "file_size": self.file_size,
+            "status": self.status, "rows_loaded": self.rows_loaded,
+            **{f"{name}_seconds": self.seconds[name] for name in STAGES},
+            "total_seconds": sum(self.seconds.values()),
+            "peak_rss_mb": self.peak_rss_mb, "peak_rss_growth_mb": self.peak_rss_growth_mb,
+            "started_at": self.started_at, "finished_at": self.finished_at, "error": self.error,
+        }
+        # 列名で指定する（library_id を後から追加したテーブルでは列の順番が違う）
+        con.execute(f"""
+            INSERT INTO {LOAD_AUDIT_TABLE} ({', '.join(values)})
+            VALUES ({', '.join('?' * len(values))})
+        """, list(values.values()))
+
+    def record_to(self, db_path: str):
+        """DBファイルを開いて load_audit に1行追加する"""
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        con = duckdb.connect(db_path)
+        try:
+            self.record(con)
+        finally:
+            con.close()
+
+
+@contextmanager
+def profile_parse(profile_dir: str | None, name: str):
+    """profile_dir が指定されていれば with ブロックをcProfileで計測する
+
+    {profile_dir}/{name}.prof（pstats形式）と、累積時間順の上位を書いた
+    {profile_dir}/{name}.txt を出力する。
+    """
+    if profile_dir is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        out_dir = Path(profile_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(out_dir / f"{name}.prof")
+        with open(out_dir / f"{name}.txt", "w") as f:
+            pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+        print(f"Profile: {out_dir / name}.prof")
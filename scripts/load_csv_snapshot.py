@@ -6,172 +6,190 @@ music-library-exporter-swiftが出力したCSVファイルをDuckDBにロード
 
 import sys
 import csv
+import io
+from collections.abc import Iterator
+from typing import TextIO
 import duckdb
 from pathlib import Path
 from datetime import datetime
 import argparse
 
-
-def parse_csv_library(csv_path: str) -> tuple[datetime, list[dict]]:
-    """CSVファイルをパース"""
-    tracks = []
-    snapshot_date = None
-
-    with open(csv_path, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            # 最初の行からスナップショット日時を取得
-            if snapshot_date is None:
-                try:
-                    snapshot_date = datetime.fromisoformat(row['snapshot_date'].replace('Z', '+00:00'))
-                except (KeyError, ValueError):
-                    print("Warning: snapshot_dateのパースに失敗しました。現在時刻を使用します。")
-                    snapshot_date = datetime.now()
-
-            tracks.append({
-                'persistent_id': row.get('persistent_id', ''),
-                'name': row.get('title', ''),
-                'artist': row.get('artist', '') or None,
-                'album_artist': row.get('album_artist', '') or None,
-                'album': row.get('album', '') or None,
-                'genre': row.get('genre', '') or None,
-                'kind': row.get('kind', '') or None,
-                'total_time': int(row['total_time']) if row.get('total_time') else None,
-                'disc_number': int(row['disc_number']) if row.get('disc_number') else None,
-                'disc_count': int(row['disc_count']) if row.get('disc_count') else None,
-                'track_number': int(row['track_number']) if row.get('track_number') else None,
-                'track_count': int(row['track_count']) if row.get('track_count') else None,
-                'year': int(row['year']) if row.get('year') else None,
-                'date_added': datetime.fromisoformat(row['date_added'].replace('Z', '+00:00')) if row.get('date_added') else None,
-                'play_count': int(row['play_count']) if row.get('play_count') else 0,
-                'play_date_utc': datetime.fromisoformat(row['last_played_date'].replace('Z', '+00:00')) if row.get('last_played_date') else None,
-                'skip_count': int(row['skip_count']) if row.get('skip_count') else 0,
-                'skip_date': datetime.fromisoformat(row['skip_date'].replace('Z', '+00:00')) if row.get('skip_date') else None,
-                'rating': int(row['rating']) if row.get('rating') else None,
-                'loved': row.get('loved', '').lower() == 'true',
-                'location': row.get('location', '') or None,
-            })
-
-    return snapshot_date, tracks
-
-
-def create_table_if_not_exists(con: duckdb.DuckDBPyConnection):
-    """テーブルを作成"""
-    con.execute("""
-        CREATE TABLE IF NOT EXISTS raw_itunes_library (
-            snapshot_date DATE NOT NULL,
-            snapshot_path VARCHAR NOT NULL,
-            track_id BIGINT NOT NULL,
-            name VARCHAR,
-            artist VARCHAR,
-            album_artist VARCHAR,
-            album VARCHAR,
-            genre VARCHAR,
-            kind VARCHAR,
-            total_time INTEGER,
-            disc_number INTEGER,
-            disc_count INTEGER,
-            track_number INTEGER,
-            track_count INTEGER,
-            year INTEGER,
-            date_added TIMESTAMP,
-            play_count INTEGER,
-            play_date BIGINT,
-            play_date_utc TIMESTAMP,
-            skip_count INTEGER,
-            skip_date TIMESTAMP,
-            rating INTEGER,
-            loved BOOLEAN,
-            persistent_id VARCHAR,
-            location VARCHAR,
-            PRIMARY KEY (snapshot_date, track_id)
-        )
-    """)
+from ingest import (
+    DEFAULT_LIBRARY_ID, LIBRARY_HELP, STORAGE_FULL, STORAGE_HELP, STORAGE_LAKE, STORAGES,
+    check_library_id, create_table_if_not_exists, load_snapshot, tracks_to_table,
+)
+from load_audit import (
+    PROFILE_DIR, STATUS_FAILED, STATUS_LOADED, LoadAudit, audit_stage, new_run_id, profile_parse,
+)
+import snapshot_lake
+from snapshot_compression import open_snapshot
+
+
+def parse_csv_library(csv_path: str, audit: LoadAudit | None = None,
+                      profile_dir: str | None = None) -> tuple[datetime, list[dict]]:
+    """CSVファイルをパース（読めなければ (None, None) を返し、audit.error に理由を残す）"""
+    try:
+        with audit_stage(audit, "parse"), profile_parse(profile_dir, f"parse-{Path(csv_path).stem}"):
+            return _parse_csv_rows(csv_path, audit)
+    except Exception as e:
+        print(f"Error parsing CSV file {csv_path}: {e}")
+        if audit is not None:
+            audit.error = str(e)
+        return None, None
+
+
+def _parse_csv_rows(csv_path: str, audit: LoadAudit | None) -> tuple[datetime, list[dict]]:
+    """CSVの各行をトラックのdictに変換"""
+    header = {}
+    with io.TextIOWrapper(open_snapshot(csv_path, audit), encoding='utf-8') as f:
+        tracks = list(iter_csv_tracks(f, header))
+    return header.get('Date'), tracks
+
+
+def iter_csv_tracks(f: TextIO, header: dict | None = None) -> Iterator[dict]:
+    """CSVの各行をトラックのdictとしてyieldする
+
+    headerにdictを渡すと、最初の行のsnapshot_dateを 'Date' に格納する。
+    """
+    reader = csv.DictReader(f)
+    for row in reader:
+        # 最初の行からスナップショット日時を取得
+        if header is not None and 'Date' not in header:
+            try:
+                header['Date'] = datetime.fromisoformat(row['snapshot_date'].replace('Z', '+00:00'))
+            except (KeyError, ValueError):
+                print("Warning: snapshot_dateのパースに失敗しました。現在時刻を使用します。")
+                header['Date'] = datetime.now()
+
+        yield {
+            'persistent_id': row.get('persistent_id', ''),
+            'name': row.get('title', ''),
+            'artist': row.get('artist', '') or None,
+            'album_artist': row.get('album_artist', '') or None,
+            'album': row.get('album', '') or None,
+            'genre': row.get('genre', '') or None,
+            'kind': row.get('kind', '') or None,
+            'total_time': int(row['total_time']) if row.get('total_time') else None,
+            'disc_number': int(row['disc_number']) if row.get('disc_number') else None,
+            'disc_count': int(row['disc_count']) if row.get('disc_count') else None,
+            'track_number': int(row['track_number']) if row.get('track_number') else None,
+            'track_count': int(row['track_count']) if row.get('track_count') else None,
+            'year': int(row['year']) if row.get('year') else None,
+            'date_added': datetime.fromisoformat(row['date_added'].replace('Z', '+00:00')) if row.get('date_added') else None,
+            'play_count': int(row['play_count']) if row.get('play_count') else 0,
+            'play_date_utc': datetime.fromisoformat(row['last_played_date'].replace('Z', '+00:00')) if row.get('last_played_date') else None,
+            'skip_count': int(row['skip_count']) if row.get('skip_count') else 0,
+            'skip_date': datetime.fromisoformat(row['skip_date'].replace('Z', '+00:00')) if row.get('skip_date') else None,
+            'rating': int(row['rating']) if row.get('rating') else None,
+            'loved': row.get('loved', '').lower() == 'true',
+            'location': row.get('location', '') or None,
+        }
+
+
+def assign_track_ids(tracks: list[dict]):
+    """CSVにはtrack_idがないので、persistent_idのハッシュを使用"""
+    for i, track in enumerate(tracks):
+        # persistent_idから数値IDを生成（16進数の下位8桁を整数化）
+        persistent_id = track['persistent_id']
+        try:
+            track['track_id'] = int(persistent_id[-8:], 16) if persistent_id else i
+        except ValueError:
+            track['track_id'] = i
 
 
 def load_to_duckdb(db_path: str, snapshot_date: datetime,
-                   snapshot_path: str, tracks: list[dict]):
+                   snapshot_path: str, tracks: list[dict], storage: str = STORAGE_FULL,
+                   audit: LoadAudit | None = None, library_id: str = DEFAULT_LIBRARY_ID):
     """DuckDBにロード"""
     if not tracks:
         print("No tracks to load.")
         return
 
+    with audit_stage(audit, "parse"):
+        assign_track_ids(tracks)
+        # play_date はCSVに含まれないのでNULLになる
+        table = tracks_to_table(tracks)
     con = duckdb.connect(db_path)
-    create_table_if_not_exists(con)
+    create_table_if_not_exists(con, storage)
+    loaded = load_snapshot(con, snapshot_date, snapshot_path, table, storage, audit, library_id)
+    if audit is not None:
+        audit.finish(STATUS_LOADED, loaded, snapshot_date)
+        audit.record(con)
+    con.close()
+    print(f"Loaded {loaded} tracks from {snapshot_date.date()} ({library_id})")
+    if audit is not None:
+        print(audit.summary())
 
-    # 既存のデータを削除してから挿入する
-    con.execute("DELETE FROM raw_itunes_library WHERE snapshot_date = ?", [snapshot_date.date()])
 
-    # CSVにはtrack_idがないので、persistent_idのハッシュを使用
-    for i, track in enumerate(tracks):
-        # persistent_idから数値IDを生成（16進数の下位8桁を整数化）
-        persistent_id = track['persistent_id']
-        try:
-            track_id = int(persistent_id[-8:], 16) if persistent_id else i
-        except ValueError:
-            track_id = i
-
-        con.execute("""
-            INSERT INTO raw_itunes_library VALUES (
-                ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
-            )
-        """, [
-            snapshot_date.date(),
-            snapshot_path,
-            track_id,
-            track['name'],
-            track['artist'],
-            track['album_artist'],
-            track['album'],
-            track['genre'],
-            track['kind'],
-            track['total_time'],
-            track['disc_number'],
-            track['disc_count'],
-            track['track_number'],
-            track['track_count'],
-            track['year'],
-            track['date_added'],
-            track['play_count'],
-            None,  # play_date (CSVには含まれない)
-            track['play_date_utc'],
-            track['skip_count'],
-            track['skip_date'],
-            track['rating'],
-            track['loved'],
-            track['persistent_id'],
-            track['location'],
-        ])
+def load_to_lake(lake_dir: str, snapshot_date: datetime,
+                 snapshot_path: str, tracks: list[dict], audit: LoadAudit | None = None,
+                 library_id: str = DEFAULT_LIBRARY_ID):
+    """Parquetレイクに書き出す"""
+    if not tracks:
+        print("No tracks to load.")
+        return
 
-    con.close()
-    print(f"Loaded {len(tracks)} tracks from {snapshot_date.date()}")
+    with audit_stage(audit, "parse"):
+        assign_track_ids(tracks)
+        table = tracks_to_table(tracks)
+    loaded = snapshot_lake.write_snapshot(lake_dir, snapshot_date, snapshot_path, table, audit, library_id)
+    if audit is not None:
+        audit.finish(STATUS_LOADED, loaded, snapshot_date)
+        audit.record_to(str(snapshot_lake.manifest_path(lake_dir)))
+    print(f"Wrote {loaded} tracks from {snapshot_date.date()} "
+          f"to {snapshot_lake.partition_path(lake_dir, snapshot_date.date(), library_id)}")
+    if audit is not None:
+        print(audit.summary())
 
 
 def main():
     parser = argparse.ArgumentParser(description='CSVスナップショットをDuckDBにロード')
-    parser.add_argument('csv_path', help='CSVファイルのパス')
+    parser.add_argument('csv_path', help='CSVファイルのパス（.csv.gz / .csv.zst も可）')
     parser.add_argument('--db', default='music_replay.duckdb', help='DuckDBファイルのパス')
+    parser.add_argument('--library', type=check_library_id, default=DEFAULT_LIBRARY_ID, help=LIBRARY_HELP)
+    parser.add_argument('--storage', choices=STORAGES, default=STORAGE_FULL, help=STORAGE_HELP)
+    parser.add_argument('--lake', default=snapshot_lake.LAKE_DIR,
+                        help='--storage lake のときのParquetレイクのディレクトリ')
+    parser.add_argument('--profile', nargs='?', const=PROFILE_DIR, metavar='DIR',
+                        help=f'パースをcProfileで計測してDIRに出力する（省略時は {PROFILE_DIR}/）')
     args = parser.parse_args()
 
     csv_path = Path(args.csv_path)
-    if not csv_path.exists():
-        print(f"エラー: ファイルが見つかりません: {csv_path}")
-        sys.exit(1)
+    audit = LoadAudit(new_run_id(), "csv", args.storage, str(csv_path), args.library)
+    with audit.stage("discover"):
+        if not csv_path.exists():
+            print(f"エラー: ファイルが見つかりません: {csv_path}")
+            sys.exit(1)
+        audit.file_size = csv_path.stat().st_size
 
     # DBファイルのパスを解決
     db_path = Path(args.db)
     if not db_path.is_absolute():
         # プロジェクトルートに作成
         db_path = Path(__file__).parent.parent / args.db
+    lake_dir = Path(args.lake)
+    if not lake_dir.is_absolute():
+        lake_dir = Path(__file__).parent.parent / args.lake
+    profile_dir = Path(args.profile) if args.profile else None
+    if profile_dir and not profile_dir.is_absolute():
+        profile_dir = Path(__file__).parent.parent / profile_dir
 
     print(f"CSVファイル: {csv_path}")
-    print(f"DBファイル: {db_path}")
+    if args.storage == STORAGE_LAKE:
+        print(f"レイク: {lake_dir}")
+    else:
+        print(f"DBファイル: {db_path}")
 
-    snapshot_date, tracks = parse_csv_library(str(csv_path))
+    snapshot_date, tracks = parse_csv_library(str(csv_path), audit, profile_dir)
     if snapshot_date and tracks:
-        load_to_duckdb(str(db_path), snapshot_date, str(csv_path), tracks)
+        if args.storage == STORAGE_LAKE:
+            load_to_lake(str(lake_dir), snapshot_date, str(csv_path), tracks, audit, args.library)
+        else:
+            load_to_duckdb(str(db_path), snapshot_date, str(csv_path), tracks, args.storage, audit, args.library)
     else:
         print("エラー: CSVのパースに失敗しました")
+        audit.finish(STATUS_FAILED, snapshot_date=snapshot_date)
+        audit.record_to(str(snapshot_lake.manifest_path(lake_dir) if args.storage == STORAGE_LAKE else db_path))
         sys.exit(1)
 
 
@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+load_exporter_snapshots.py
+music-library-exporter-swiftが出力したCSV / JSONファイルをDuckDBの読み込み関数でまとめてロード
+
+load_csv_snapshot.py は1行ずつPythonで型変換するが、こちらは列の型を指定した
+read_csv / read_json でファイルを読み、列名の対応・タイムスタンプのUTC変換・
+persistent_idからのtrack_idの導出をSQLで行う。
+引数のファイル（glob・ディレクトリも可）は形式ごとに1つのクエリでまとめて読み、
+--storage full では全スナップショットを1トランザクションの DELETE / INSERT で置き換える。
+
+ロード結果は load_csv_snapshot.py と同じになる:
+    - snapshot_date は各ファイルの最初の行の snapshot_date の日付部分
+    - track_id は persistent_id の下位8桁の16進数（変換できなければファイル内の行番号）
+    - play_count / skip_count の空欄は0、loved は true 以外 false、play_date はNULL
+同じ日付のファイルが複数あるときは、snapshot_date の時刻が最も新しいファイルを使う。
+snapshot_date が日付として読めないファイルはスキップする（load_csv_snapshot.py は現在時刻を使う）。
+
+CSVの列は位置で読むため、先にヘッダーの列名が順番も含めてエクスポーターの列と一致することを確認し、
+一致しないファイルがあれば何もロードしない（.zst のCSVのヘッダーを読むには zstandard が必要）。
+JSONはCSVと同じキーを持つオブジェクトの配列か、1行1オブジェクト（NDJSON）。
+"""
+
+import argparse
+import csv
+import glob
+import io
+import sys
+from datetime import date, datetime, time
+from pathlib import Path
+
+import duckdb
+
+from ingest import (
+    DEFAULT_LIBRARY_ID, LIBRARY_HELP, RAW_TABLE, STORAGE_COMPACT, STORAGE_FULL, STORAGE_HELP,
+    STORAGE_LAKE, STORAGES, TRACK_FIELDS, TRACK_SCHEMA, apply_changes, check_library_id,
+    create_table_if_not_exists,
+)
+from load_audit import STAGES, STATUS_FAILED, STATUS_LOADED, LoadAudit, audit_stage, new_run_id
+import snapshot_lake
+from snapshot_compression import open_snapshot
+
+
+FORMAT_CSV = "csv"
+FORMAT_JSON = "json"
+
+# 拡張子 → 形式（.gz / .zst はDuckDBが展開する）
+EXPORTER_SUFFIXES = {
+    ".csv": FORMAT_CSV, ".csv.gz": FORMAT_CSV, ".csv.zst": FORMAT_CSV,
+    ".json": FORMAT_JSON, ".json.gz": FORMAT_JSON, ".json.zst": FORMAT_JSON,
+    ".ndjson": FORMAT_JSON, ".ndjson.gz": FORMAT_JSON, ".ndjson.zst": FORMAT_JSON,
+    ".jsonl": FORMAT_JSON, ".jsonl.gz": FORMAT_JSON, ".jsonl.zst": FORMAT_JSON,
+}
+
+# エクスポーターの列（CSVの列順）とDuckDBの型
+EXPORTER_COLUMNS = [
+    # 日付はファイルに書かれたまま使うので文字列で読む（日時はセッションのタイムゾーンに依存しないよう文字列で読んで変換する）
+    ("snapshot_date", "VARCHAR"),
+    ("persistent_id", "VARCHAR"),
+    ("title", "VARCHAR"),
+    ("artist", "VARCHAR"),
+    ("album_artist", "VARCHAR"),
+    ("album", "VARCHAR"),
+    ("genre", "VARCHAR"),
+    ("kind", "VARCHAR"),
+    ("total_time", "INTEGER"),
+    ("disc_number", "INTEGER"),
+    ("disc_count", "INTEGER"),
+    ("track_number", "INTEGER"),
+    ("track_count", "INTEGER"),
+    ("year", "INTEGER"),
+    ("date_added", "VARCHAR"),
+    ("play_count", "INTEGER"),
+    ("last_played_date", "VARCHAR"),
+    ("skip_count", "INTEGER"),
+    ("skip_date", "VARCHAR"),
+    ("rating", "INTEGER"),
+    ("loved", "BOOLEAN"),
+    ("location", "VARCHAR"),
+]
+
+
+def utc_timestamp_sql(column: str, cast: str = "CAST") -> str:
+    """ISO 8601の日時文字列をUTCのTIMESTAMPにする式（オフセットのない時刻はUTCとして読む。load_csv_snapshot.py と同じ）"""
+    return (f"CASE WHEN regexp_matches({column}, '[T ][0-9:.]+(Z|[+-][0-9:]+)$') "
+            f"THEN {cast}({column} AS TIMESTAMPTZ) AT TIME ZONE 'UTC' "
+            f"ELSE {cast}({column} AS TIMESTAMP) END")
+
+
+# raw_itunes_library の列 → エクスポーターの列からの式（load_csv_snapshot.iter_csv_tracks と同じ変換）
+TRACK_EXPRESSIONS = {
+    # persistent_idの16進数の下位8桁（変換できなければファイル内の0始まりの行番号）
+    "track_id": "COALESCE(TRY_CAST('0x' || right(persistent_id, 8) AS BIGINT), file_row)",
+    "name": "COALESCE(title, '')",
+    "artist": "artist",
+    "album_artist": "album_artist",
+    "album": "album",
+    "genre": "genre",
+    "kind": "kind",
+    "total_time": "total_time",
+    "disc_number": "disc_number",
+    "disc_count": "disc_count",
+    "track_number": "track_number",
+    "track_count": "track_count",
+    "year": "year",
+    "date_added": utc_timestamp_sql("date_added"),
+    "play_count": "COALESCE(play_count, 0)",
+    # エクスポーターには含まれない
+    "play_date": "NULL::BIGINT",
+    "play_date_utc": utc_timestamp_sql("last_played_date"),
+    "skip_count": "COALESCE(skip_count, 0)",
+    "skip_date": utc_timestamp_sql("skip_date"),
+    "rating": "rating",
+    "loved": "COALESCE(loved, false)",
+    "persistent_id": "COALESCE(persistent_id, '')",
+    "location": "location",
+}
+
+STAGE_TABLE = "_exporter_stage"
+
+
+def exporter_format(path: Path) -> str | None:
+    """拡張子からファイル形式を判定する（エクスポーターのファイルでなければNone）"""
+    name = path.name.lower()
+    for suffix, fmt in EXPORTER_SUFFIXES.items():
+        if name.endswith(suffix):
+            return fmt
+    return None
+
+
+def expand_paths(patterns: list[str]) -> tuple[list[Path], list[str]]:
+    """ファイル・glob・ディレクトリを展開し、(エクスポーターのファイル, 見つからなかった引数) を返す"""
+    files, missing = [], []
+    for pattern in patterns:
+        pattern = str(Path(pattern).expanduser())
+        if any(c in pattern for c in "*?["):
+            matches = [Path(p) for p in sorted(glob.glob(pattern, recursive=True))]
+        elif Path(pattern).is_dir():
+            matches = sorted(p for p in Path(pattern).rglob("*") if p.is_file())
+        else:
+            matches = [Path(pattern)] if Path(pattern).exists() else []
+        matches = [p for p in matches if p.is_file() and exporter_format(p)]
+        if not matches:
+            missing.append(pattern)
+        files.extend(p for p in matches if p not in files)
+    return files, missing
+
+
+def csv_header(path: Path) -> list[str]:
+    """CSVファイルの1行目（列名）"""
+    with open_snapshot(path) as f:
+        return next(csv.reader(io.TextIOWrapper(f, encoding="utf-8-sig", newline="")), [])
+
+
+def find_header_mismatches(files: list[Path]) -> dict[str, list[str]]:
+    """ヘッダーがエクスポーターの列と一致しないCSVファイル → そのヘッダー"""
+    expected = [name for name, _ in EXPORTER_COLUMNS]
+    headers = {str(path): csv_header(path) for path in files if exporter_format(path) == FORMAT_CSV}
+    return {path: header for path, header in headers.items() if header != expected}
+
+
+def _source_sql(fmt: str, param: str) -> str:
+    """1つの形式のファイルをまとめて読むSELECT（$param はファイルのリスト）"""
+    columns = "{" + ", ".join(f"'{name}': '{sql_type}'" for name, sql_type in EXPORTER_COLUMNS) + "}"
+    if fmt == FORMAT_CSV:
+        reader = (f"read_csv(${param}, columns = {columns}, header = true, auto_detect = false, "
+                  "delim = ',', quote = '\"', escape = '\"', filename = true)")
+    else:
+        reader = f"read_json(${param}, columns = {columns}, format = 'auto', filename = true)"
+    return f"SELECT * FROM {reader} WITH ORDINALITY"
+
+
+def stage_files(con: duckdb.DuckDBPyConnection, files: list[Path]) -> int:
+    """ファイルを読み、raw_itunes_library の列に変換した一時テーブルを作る"""
+    by_format = {}
+    for path in files:
+        by_format.setdefault(exporter_format(path), []).append(str(path))
+    sources = "\n            UNION ALL\n            ".join(_source_sql(fmt, fmt) for fmt in by_format)
+    track_list = ",\n            ".join(f"{TRACK_EXPRESSIONS[name]} AS {name}" for name in TRACK_FIELDS)
+
+    con.execute(f"DROP TABLE IF EXISTS {STAGE_TABLE}")
+    con.execute(f"""
+        CREATE TEMP TABLE {STAGE_TABLE} AS
+        WITH exporter_rows AS (
+            {sources}
+        ),
+        numbered AS (
+            SELECT
+                *,
+                ROW_NUMBER() OVER (PARTITION BY filename ORDER BY ordinality) - 1 AS file_row,
+                -- 最初の行のスナップショット日時をファイル全体に使う
+                arg_min(snapshot_date, ordinality) OVER (PARTITION BY filename) AS snapshot_at
+            FROM exporter_rows
+        )
+        SELECT
+            filename AS source_path,
+            snapshot_at,
+            TRY_CAST(left(snapshot_at, 10) AS DATE) AS snapshot_date,
+            {track_list}
+        FROM numbered
+    """, by_format)
+    return con.execute(f"SELECT COUNT(*) FROM {STAGE_TABLE}").fetchone()[0]
+
+
+def select_snapshots(con: duckdb.DuckDBPyConnection) -> tuple[dict[str, tuple[date, int]], dict[str, str]]:
+    """日付ごとに1ファイルを選び、残りを一時テーブルから消す
+
+    ({ソースパス: (スナップショット日, 行数)}, {ロードしないソースパス: 理由}) を返す。
+    """
+    files = con.execute(f"""
+        SELECT source_path, snapshot_date, COUNT(*) AS row_count
+        FROM {STAGE_TABLE}
+        GROUP BY source_path, snapshot_date, snapshot_at
+        ORDER BY snapshot_date, {utc_timestamp_sql('snapshot_at', 'TRY_CAST')} DESC, source_path DESC
+    """).fetchall()
+    selected, skipped = {}, {}
+    days = set()
+    for source_path, snapshot_date, row_count in files:
+        if snapshot_date is None:
+            skipped[source_path] = "snapshot_dateがありません"
+        elif snapshot_date in days:
+            skipped[source_path] = f"{snapshot_date} のより新しいファイルがあります"
+        else:
+            selected[source_path] = (snapshot_date, row_count)
+            days.add(snapshot_date)
+    if skipped:
+        con.execute(f"DELETE FROM {STAGE_TABLE} WHERE list_contains(?, source_path)", [list(skipped)])
+    return selected, skipped
+
+
+def share_stages(batch: LoadAudit, audits: dict[str, LoadAudit], rows: dict[str, int]):
+    """まとめて計測したステージの時間を、ファイルごとの記録に行数の割合で配分する
+
+    ピークメモリは配分できないので、まとめて計測した値をそのまま付ける。
+    """
+    total = sum(rows.values())
+    if not total:
+        return
+    for source_path, count in rows.items():
+        for name in STAGES:
+            audits[source_path].add(name, batch.seconds[name] * count / total)
+        audits[source_path].note_peak_rss(batch.peak_rss_mb, batch.peak_rss_growth_mb)
+
+
+def load_to_duckdb(con: duckdb.DuckDBPyConnection, selected: dict[str, tuple[date, int]],
+                   storage: str, batch: LoadAudit, audits: dict[str, LoadAudit],
+                   library_id: str = DEFAULT_LIBRARY_ID) -> int:
+    """一時テーブルの全スナップショットを1トランザクションでロードする"""
+    create_table_if_not_exists(con, storage)
+    select_list = ", ".join(TRACK_FIELDS)
+    con.begin()
+    try:
+        if storage == STORAGE_COMPACT:
+            # compact形式は日付順に1スナップショットずつ適用する
+            loaded = 0
+            for source_path, (snapshot_date, _) in sorted(selected.items(), key=lambda item: item[1][0]):
+                audit = audits[source_path]
+                with audit_stage(audit, "insert"):
+                    loaded += apply_changes(
+                        con, library_id, datetime.combine(snapshot_date, time()), source_path,
+                        f"SELECT {select_list} FROM {STAGE_TABLE} WHERE snapshot_date = ?",
+                        [snapshot_date], audit,
+                    )
+        else:
+            # 既存のデータを削除してから挿入する（他のライブラリ・日付の行には触れない）
+            with batch.stage("delete"):
+                con.execute(f"""
+                    DELETE FROM {RAW_TABLE}
+                    WHERE library_id = ?
+                        AND snapshot_date IN (SELECT DISTINCT snapshot_date FROM {STAGE_TABLE})
+                """, [library_id])
+            with batch.stage("insert"):
+                loaded = con.execute(f"""
+                    INSERT INTO {RAW_TABLE}
+                    SELECT ?::VARCHAR, snapshot_date, source_path, {select_list}
+                    FROM {STAGE_TABLE}
+                """, [library_id]).fetchone()[0]
+        with batch.stage("commit"):
+            con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    return loaded
+
+
+def load_to_lake(con: duckdb.DuckDBPyConnection, lake_dir: str, selected: dict[str, tuple[date, int]],
+                 audits: dict[str, LoadAudit], library_id: str = DEFAULT_LIBRARY_ID) -> int:
+    """一時テーブルのスナップショットを日付ごとのParquetファイルに書き出す"""
+    select_list = ", ".join(TRACK_FIELDS)
+    loaded = 0
+    for source_path, (snapshot_date, _) in sorted(selected.items(), key=lambda item: item[1][0]):
+        audit = audits[source_path]
+        with audit_stage(audit, "parse"):
+            table = con.execute(f"SELECT {select_list} FROM {STAGE_TABLE} WHERE snapshot_date = ?",
+                                [snapshot_date]).arrow().read_all().cast(TRACK_SCHEMA)
+        loaded += snapshot_lake.write_snapshot(lake_dir, datetime.combine(snapshot_date, time()),
+                                               source_path, table, audit, library_id)
+    return loaded
+
+
+def record_audits(audits: list[LoadAudit], storage: str, db_path: Path, lake_dir: Path):
+    """ファイルごとのロード記録を書き込む"""
+    target = Path(snapshot_lake.manifest_path(str(lake_dir)) if storage == STORAGE_LAKE else db_path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    con = duckdb.connect(str(target))
+    try:
+        for audit in audits:
+            audit.record(con)
+    finally:
+        con.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='エクスポーターのCSV / JSONスナップショットをDuckDBの読み込み関数でまとめてロード')
+    parser.add_argument('paths', nargs='+',
+                        help='CSV / JSONファイル・glob・ディレクトリ（.gz / .zst も可、globは引用符で囲む）')
+    parser.add_argument('--db', default='music_replay.duckdb', help='DuckDBファイルのパス')
+    parser.add_argument('--library', type=check_library_id, default=DEFAULT_LIBRARY_ID, help=LIBRARY_HELP)
+    parser.add_argument('--storage', choices=STORAGES, default=STORAGE_FULL, help=STORAGE_HELP)
+    parser.add_argument('--lake', default=snapshot_lake.LAKE_DIR,
+                        help='--storage lake のときのParquetレイクのディレクトリ')
+    args = parser.parse_args()
+
+    # DBファイル・レイクのパスを解決（相対パスはプロジェクトルートから）
+    db_path = Path(args.db)
+    if not db_path.is_absolute():
+        db_path = Path(__file__).parent.parent / args.db
+    lake_dir = Path(args.lake)
+    if not lake_dir.is_absolute():
+        lake_dir = Path(__file__).parent.parent / args.lake
+
+    run_id = new_run_id()
+    batch = LoadAudit(run_id, "exporter", args.storage, ", ".join(args.paths), args.library)
+    with batch.stage("discover"):
+        files, missing = expand_paths(args.paths)
+    for pattern in missing:
+        print(f"Warning: エクスポーターのファイルが見つかりません: {pattern}")
+    if not files:
+        print("エラー: ロードするファイルがありません")
+        sys.exit(1)
+
+    # CSVは列を位置で読むので、列名・列順の違うファイルがあればロードしない
+    try:
+        with batch.stage("discover"):
+            mismatches = find_header_mismatches(files)
+    except (OSError, RuntimeError, ValueError, csv.Error) as e:
+        print(f"エラー: CSVのヘッダーを読めません: {e}")
+        sys.exit(1)
+    if mismatches:
+        expected = ",".join(name for name, _ in EXPORTER_COLUMNS)
+        for source_path, header in mismatches.items():
+            print(f"エラー: CSVの列がエクスポーターの列と一致しません: {source_path}")
+            print(f"  ヘッダー: {','.join(header)}")
+        print(f"  期待する列: {expected}")
+        sys.exit(1)
+
+    audits = {}
+    for path in files:
+        audit = LoadAudit(run_id, "exporter", args.storage, str(path), args.library)
+        audit.file_size = path.stat().st_size
+        audits[str(path)] = audit
+
+    print(f"ファイル: {len(files)}")
+    if args.storage == STORAGE_LAKE:
+        print(f"レイク: {lake_dir}")
+    else:
+        print(f"DBファイル: {db_path}")
+
+    con = duckdb.connect() if args.storage == STORAGE_LAKE else duckdb.connect(str(db_path))
+    try:
+        with batch.stage("parse"):
+            staged = stage_files(con, files)
+            selected, skipped = select_snapshots(con)
+        print(f"Parsed {staged} tracks from {len(files)} files")
+        for source_path in audits:
+            if source_path not in selected:
+                skipped.setdefault(source_path, "トラックがありません")
+        for source_path, reason in skipped.items():
+            print(f"Warning: {reason}。スキップします: {source_path}")
+        if not selected:
+            raise ValueError("ロードできるトラックがありません")
+
+        if args.storage == STORAGE_LAKE:
+            loaded = load_to_lake(con, str(lake_dir), selected, audits, args.library)
+        else:
+            loaded = load_to_duckdb(con, selected, args.storage, batch, audits, args.library)
+    except (duckdb.Error, ValueError) as e:
+        con.close()
+        print(f"エラー: ロードに失敗しました: {e}")
+        for audit in audits.values():
+            audit.finish(STATUS_FAILED, error=str(e))
+        record_audits(list(audits.values()), args.storage, db_path, lake_dir)
+        sys.exit(1)
+    con.close()
+
+    share_stages(batch, audits, {source_path: rows for source_path, (_, rows) in selected.items()})
+    for source_path, audit in audits.items():
+        if source_path in selected:
+            snapshot_date, rows = selected[source_path]
+            audit.finish(STATUS_LOADED, rows, snapshot_date)
+        else:
+            audit.finish(STATUS_FAILED, error=skipped[source_path])
+    record_audits(list(audits.values()), args.storage, db_path, lake_dir)
+
+    days = sorted(snapshot_date for snapshot_date, _ in selected.values())
+    print(f"Loaded {loaded} tracks from {len(days)} snapshots ({days[0]} - {days[-1]}, {args.library})")
+    # 全ファイルのステージの合計
+    for name in STAGES:
+        batch.seconds[name] = sum(audit.seconds[name] for audit in audits.values())
+    print(batch.summary())
+
+if __name__ == "__main__":
+    main()
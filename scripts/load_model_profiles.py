@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+load_model_profiles.py
+dbt run のモデルごとのクエリプロファイルを model_profile テーブルに取り込む
+
+dbt run --vars '{profile_models: true}' が target/ に書き出したDuckDBのJSONプロファイル
+（target/model_profile.<invocation_id>.<モデル名>.json、macros/profile_models.sql）と
+target/run_results.json を読み、演算子ごとに1行として記録する。
+モデルの列（実行時間・クエリ全体の時間・メモリ）は同じモデルの全演算子の行で同じ値になる。
+同じ invocation_id を取り込み直すと置き換わるので、dbt run のたびに実行してよい。
+
+table / incremental はモデルのSQLを実行する CREATE TABLE AS、view はビューの全行を読むクエリの
+プロファイル。実行時に掛かった時間を、実行の間で比べたり遅くなった演算子を探したりする。
+"""
+
+import argparse
+import json
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import duckdb
+import pyarrow as pa
+
+
+OUTPUT_DB = "music_replay.duckdb"
+TARGET_DIR = "target"
+
+MODEL_PROFILE_TABLE = "model_profile"
+
+# (列名, DuckDBの型, Arrowの型)
+PROFILE_COLUMNS = [
+    ("invocation_id", "VARCHAR NOT NULL", pa.string()),
+    ("run_started_at", "TIMESTAMP", pa.timestamp("us")),
+    ("full_refresh", "BOOLEAN", pa.bool_()),
+    ("model", "VARCHAR NOT NULL", pa.string()),
+    ("materialized", "VARCHAR", pa.string()),
+    ("status", "VARCHAR", pa.string()),
+    # dbtが計測したモデルの実行時間（メタデータの問い合わせや delete+insert を含む）
+    ("execution_time", "DOUBLE", pa.float64()),
+    # プロファイルしたクエリ全体
+    ("query_latency", "DOUBLE", pa.float64()),
+    ("query_cpu_time", "DOUBLE", pa.float64()),
+    ("peak_buffer_memory", "BIGINT", pa.int64()),
+    ("total_memory_allocated", "BIGINT", pa.int64()),
+    ("rows_scanned", "BIGINT", pa.int64()),
+    # 演算子（木を深さ優先でたどった順に0から番号を振る）
+    ("operator_id", "INTEGER", pa.int32()),
+    ("parent_operator_id", "INTEGER", pa.int32()),
+    ("depth", "INTEGER", pa.int32()),
+    ("operator_type", "VARCHAR", pa.string()),
+    ("operator_name", "VARCHAR", pa.string()),
+    ("operator_timing", "DOUBLE", pa.float64()),
+    ("operator_cardinality", "BIGINT", pa.int64()),
+    ("operator_rows_scanned", "BIGINT", pa.int64()),
+    ("extra_info", "JSON", pa.string()),
+]
+
+PROFILE_SCHEMA = pa.schema([(name, arrow_type) for name, _, arrow_type in PROFILE_COLUMNS])
+
+
+def create_model_profile_if_not_exists(con: duckdb.DuckDBPyConnection):
+    """モデルプロファイルのテーブルを作成"""
+    column_defs = ",\n            ".join(f"{name} {sql_type}" for name, sql_type, _ in PROFILE_COLUMNS)
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {MODEL_PROFILE_TABLE} (
+            {column_defs},
+            loaded_at TIMESTAMP NOT NULL
+        )
+    """)
+
+
+def profile_path(target_dir: Path, invocation_id: str, model: str) -> Path:
+    """macros/profile_models.sql が書き出すプロファイルのパス"""
+    return target_dir / f"model_profile.{invocation_id}.{model}.json"
+
+
+def iter_operators(node: dict, parent_id: int | None = None, depth: int = 0, counter: list | None = None):
+    """プロファイルの演算子の木を深さ優先でたどり、(id, 親のid, 深さ, 演算子) をyieldする"""
+    counter = counter if counter is not None else [0]
+    operator_id = counter[0]
+    counter[0] += 1
+    yield operator_id, parent_id, depth, node
+    for child in node.get("children", []):
+        yield from iter_operators(child, operator_id, depth + 1, counter)
+
+
+def profile_rows(run: dict, model: dict, profile: dict) -> list[dict]:
+    """1モデルのプロファイルを演算子ごとの行にする（ルートはクエリ全体）"""
+    rows = []
+    for operator_id, parent_id, depth, node in iter_operators(profile):
+        rows.append({
+            **run,
+            **model,
+            "query_latency": profile.get("latency"),
+            "query_cpu_time": profile.get("cpu_time"),
+            "peak_buffer_memory": profile.get("system_peak_buffer_memory"),
+            "total_memory_allocated": profile.get("total_memory_allocated"),
+            "rows_scanned": profile.get("cumulative_rows_scanned"),
+            "operator_id": operator_id,
+            "parent_operator_id": parent_id,
+            "depth": depth,
+            "operator_type": node.get("operator_type") or "QUERY",
+            "operator_name": node.get("operator_name") or "QUERY",
+            "operator_timing": profile.get("latency") if depth == 0 else node.get("operator_timing"),
+            "operator_cardinality": node.get("operator_cardinality"),
+            "operator_rows_scanned": node.get("operator_rows_scanned"),
+            "extra_info": json.dumps(node.get("extra_info") or {}, ensure_ascii=False),
+        })
+    return rows
+
+
+def parse_timestamp(value: str | None) -> datetime | None:
+    """dbtのISO 8601（末尾Z）のUTC時刻"""
+    return datetime.fromisoformat(value.rstrip("Z")) if value else None
+
+
+def collect_profiles(target_dir: Path) -> tuple[str, list[dict], list[str]]:
+    """run_results.json とプロファイルを読み、(invocation_id, 行, プロファイルのないモデル) を返す"""
+    run_results = json.loads((target_dir / "run_results.json").read_text())
+    metadata = run_results["metadata"]
+    invocation_id = metadata["invocation_id"]
+    manifest_path = target_dir / "manifest.json"
+    nodes = json.loads(manifest_path.read_text())["nodes"] if manifest_path.exists() else {}
+
+    run = {
+        "invocation_id": invocation_id,
+        "run_started_at": parse_timestamp(metadata.get("invocation_started_at") or metadata.get("generated_at")),
+        "full_refresh": bool(run_results.get("args", {}).get("full_refresh")),
+    }
+    rows, missing = [], []
+    for result in run_results["results"]:
+        unique_id = result["unique_id"]
+        if not unique_id.startswith("model."):
+            continue
+        name = unique_id.split(".")[-1]
+        model = {
+            "model": name,
+            "materialized": nodes.get(unique_id, {}).get("config", {}).get("materialized"),
+            "status": result["status"],
+            "execution_time": result["execution_time"],
+        }
+        path = profile_path(target_dir, invocation_id, name)
+        if not path.exists():
+            missing.append(name)
+            continue
+        rows.extend(profile_rows(run, model, json.loads(path.read_text())))
+    return invocation_id, rows, missing
+
+
+def load_profiles(con: duckdb.DuckDBPyConnection, invocation_id: str, rows: list[dict]) -> int:
+    """1回の dbt run 分の行を置き換えて書き込む"""
+    create_model_profile_if_not_exists(con)
+    profiles = pa.Table.from_pylist(rows, schema=PROFILE_SCHEMA)
+    columns = ", ".join(name for name, _, _ in PROFILE_COLUMNS)
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"DELETE FROM {MODEL_PROFILE_TABLE} WHERE invocation_id = ?", [invocation_id])
+        con.execute(f"""
+            INSERT INTO {MODEL_PROFILE_TABLE} ({columns}, loaded_at)
+            SELECT {columns}, now()::TIMESTAMP FROM profiles
+        """)
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    return profiles.num_rows
+
+
+def print_hot_spots(con: duckdb.DuckDBPyConnection, invocation_id: str, limit: int):
+    """この実行で時間の掛かったモデルと演算子"""
+    models = con.execute(f"""
+        SELECT model, materialized, execution_time, query_latency, peak_buffer_memory / 1e6
+        FROM {MODEL_PROFILE_TABLE}
+        WHERE invocation_id = ? AND operator_id = 0
+        ORDER BY query_latency DESC
+        LIMIT ?
+    """, [invocation_id, limit]).fetchall()
+    print("\nモデル（クエリの時間順）")
+    for model, materialized, execution_time, latency, memory_mb in models:
+        print(f"  {model:<32} {materialized or '':<12} {latency:8.3f}s  (dbt {execution_time:.3f}s, "
+              f"peak {memory_mb:.1f} MB)")
+
+    operators = con.execute(f"""
+        SELECT model, operator_name, operator_timing, operator_cardinality
+        FROM {MODEL_PROFILE_TABLE}
+        WHERE invocation_id = ? AND operator_id > 0
+        ORDER BY operator_timing DESC
+        LIMIT ?
+    """, [invocation_id, limit]).fetchall()
+    print("\n演算子（時間順）")
+    for model, operator_name, timing, cardinality in operators:
+        print(f"  {model:<32} {operator_name:<24} {timing:8.3f}s  {cardinality or 0:>12,} rows")
+
+
+def resolve(path: str) -> Path:
+    """相対パスはプロジェクトルートからのパスにする"""
+    path = Path(path).expanduser()
+    return path if path.is_absolute() else Path(__file__).parent.parent / path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='dbt run のモデルごとのクエリプロファイルを model_profile に取り込む')
+    parser.add_argument('--db', default=OUTPUT_DB, help='DuckDBファイルのパス')
+    parser.add_argument('--target', default=TARGET_DIR, help='dbtの target ディレクトリ（run_results.json の場所）')
+    parser.add_argument('--limit', type=int, default=10, help='表示するモデル・演算子の数')
+    args = parser.parse_args()
+
+    db_path = resolve(args.db)
+    target_dir = resolve(args.target)
+    if not (target_dir / "run_results.json").exists():
+        print(f"エラー: run_results.json が見つかりません: {target_dir}")
+        sys.exit(1)
+
+    invocation_id, rows, missing = collect_profiles(target_dir)
+    print(f"Invocation ID: {invocation_id}")
+    if not rows:
+        print("プロファイルがありません。dbt run --profiles-dir . --vars '{profile_models: true}' で実行してください")
+        sys.exit(1)
+    if missing:
+        print(f"Warning: プロファイルがないモデル: {', '.join(missing)}")
+
+    with duckdb.connect(str(db_path)) as con:
+        loaded = load_profiles(con, invocation_id, rows)
+        model_count = len({row["model"] for row in rows})
+        print(f"{model_count} models, {loaded} operators → {db_path.name}:{MODEL_PROFILE_TABLE}")
+        print_hot_spots(con, invocation_id, args.limit)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,169 +5,134 @@ iTunes/Music Library XMLファイルをDuckDBにロード
 """
 
 import sys
-import plistlib
 import duckdb
+import pyarrow as pa
 from pathlib import Path
 from datetime import datetime
 import argparse
 
+from ingest import (
+    DEFAULT_LIBRARY_ID, LIBRARY_HELP, STORAGE_FULL, STORAGE_HELP, STORAGE_LAKE, STORAGES,
+    check_library_id, create_table_if_not_exists, load_snapshot, records_to_table,
+)
+from load_audit import (
+    PROFILE_DIR, STATUS_FAILED, STATUS_LOADED, LoadAudit, audit_stage, new_run_id, profile_parse,
+)
+import snapshot_lake
+from snapshot_compression import open_snapshot
+from plist_stream import iter_tracks
 
-def parse_music_library(library_path: str) -> tuple[datetime, list[dict]]:
+
+def parse_music_library(library_path: str, audit: LoadAudit | None = None,
+                        profile_dir: str | None = None) -> tuple[datetime, pa.Table]:
     """MusicライブラリXMLをパース"""
+    header = {}
     try:
-        with open(library_path, 'rb') as f:
-            plist = plistlib.load(f)
+        with audit_stage(audit, "parse"), profile_parse(profile_dir, f"parse-{Path(library_path).stem}"):
+            with open_snapshot(library_path, audit) as f:
+                tracks = records_to_table(iter_tracks(f, header))
     except Exception as e:
         print(f"Error parsing plist file {library_path}: {e}")
-        return None, []
+        if audit is not None:
+            audit.error = str(e)
+        return None, None
 
     # スナップショット日時を取得
-    snapshot_date = plist.get('Date')
+    snapshot_date = header.get('Date')
     if not snapshot_date:
         # ファイル名から日付を推測
         print("Warning: XMLにDate要素がありません。ファイルの更新日時を使用します。")
         snapshot_date = datetime.fromtimestamp(Path(library_path).stat().st_mtime)
 
-    tracks = []
-    for track_id, track_data in plist.get('Tracks', {}).items():
-        tracks.append({
-            'track_id': int(track_id),
-            'name': track_data.get('Name'),
-            'artist': track_data.get('Artist'),
-            'album_artist': track_data.get('Album Artist'),
-            'album': track_data.get('Album'),
-            'genre': track_data.get('Genre'),
-            'kind': track_data.get('Kind'),
-            'total_time': track_data.get('Total Time'),
-            'disc_number': track_data.get('Disc Number'),
-            'disc_count': track_data.get('Disc Count'),
-            'track_number': track_data.get('Track Number'),
-            'track_count': track_data.get('Track Count'),
-            'year': track_data.get('Year'),
-            'date_added': track_data.get('Date Added'),
-            'play_count': track_data.get('Play Count'),
-            'play_date': track_data.get('Play Date'),
-            'play_date_utc': track_data.get('Play Date UTC'),
-            'skip_count': track_data.get('Skip Count'),
-            'skip_date': track_data.get('Skip Date'),
-            'rating': track_data.get('Rating'),
-            'loved': track_data.get('Loved'),
-            'persistent_id': track_data.get('Persistent ID'),
-            'location': track_data.get('Location'),
-        })
-
     return snapshot_date, tracks
 
 
-def create_table_if_not_exists(con: duckdb.DuckDBPyConnection):
-    """テーブルを作成"""
-    con.execute("""
-        CREATE TABLE IF NOT EXISTS raw_itunes_library (
-            snapshot_date DATE NOT NULL,
-            snapshot_path VARCHAR NOT NULL,
-            track_id BIGINT NOT NULL,
-            name VARCHAR,
-            artist VARCHAR,
-            album_artist VARCHAR,
-            album VARCHAR,
-            genre VARCHAR,
-            kind VARCHAR,
-            total_time INTEGER,
-            disc_number INTEGER,
-            disc_count INTEGER,
-            track_number INTEGER,
-            track_count INTEGER,
-            year INTEGER,
-            date_added TIMESTAMP,
-            play_count INTEGER,
-            play_date BIGINT,
-            play_date_utc TIMESTAMP,
-            skip_count INTEGER,
-            skip_date TIMESTAMP,
-            rating INTEGER,
-            loved BOOLEAN,
-            persistent_id VARCHAR,
-            location VARCHAR,
-            PRIMARY KEY (snapshot_date, track_id)
-        )
-    """)
-
-
 def load_to_duckdb(db_path: str, snapshot_date: datetime,
-                   snapshot_path: str, tracks: list[dict]):
+                   snapshot_path: str, tracks: pa.Table, storage: str = STORAGE_FULL,
+                   audit: LoadAudit | None = None, library_id: str = DEFAULT_LIBRARY_ID):
     """DuckDBにロード"""
     if not tracks:
         print("No tracks to load.")
         return
 
     con = duckdb.connect(db_path)
-    create_table_if_not_exists(con)
-
-    # 既存のデータを削除してから挿入する
-    con.execute("DELETE FROM raw_itunes_library WHERE snapshot_date = ?", [snapshot_date.date()])
-
-    for track in tracks:
-        con.execute("""
-            INSERT INTO raw_itunes_library VALUES (
-                ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
-            )
-        """, [
-            snapshot_date.date(),
-            snapshot_path,
-            track['track_id'],
-            track['name'],
-            track['artist'],
-            track['album_artist'],
-            track['album'],
-            track['genre'],
-            track['kind'],
-            track['total_time'],
-            track['disc_number'],
-            track['disc_count'],
-            track['track_number'],
-            track['track_count'],
-            track['year'],
-            track['date_added'],
-            track['play_count'],
-            track['play_date'],
-            track['play_date_utc'],
-            track['skip_count'],
-            track['skip_date'],
-            track['rating'],
-            track['loved'],
-            track['persistent_id'],
-            track['location'],
-        ])
-
+    create_table_if_not_exists(con, storage)
+    loaded = load_snapshot(con, snapshot_date, snapshot_path, tracks, storage, audit, library_id)
+    if audit is not None:
+        audit.finish(STATUS_LOADED, loaded, snapshot_date)
+        audit.record(con)
     con.close()
-    print(f"Loaded {len(tracks)} tracks from {snapshot_date.date()}")
+    print(f"Loaded {loaded} tracks from {snapshot_date.date()} ({library_id})")
+    if audit is not None:
+        print(audit.summary())
+
+
+def load_to_lake(lake_dir: str, snapshot_date: datetime,
+                 snapshot_path: str, tracks: pa.Table, audit: LoadAudit | None = None,
+                 library_id: str = DEFAULT_LIBRARY_ID):
+    """Parquetレイクに書き出す"""
+    if not tracks:
+        print("No tracks to load.")
+        return
+
+    loaded = snapshot_lake.write_snapshot(lake_dir, snapshot_date, snapshot_path, tracks, audit, library_id)
+    if audit is not None:
+        audit.finish(STATUS_LOADED, loaded, snapshot_date)
+        audit.record_to(str(snapshot_lake.manifest_path(lake_dir)))
+    print(f"Wrote {loaded} tracks from {snapshot_date.date()} "
+          f"to {snapshot_lake.partition_path(lake_dir, snapshot_date.date(), library_id)}")
+    if audit is not None:
+        print(audit.summary())
 
 
 def main():
     parser = argparse.ArgumentParser(description='XMLスナップショットをDuckDBにロード')
-    parser.add_argument('xml_path', help='XMLファイルのパス')
+    parser.add_argument('xml_path', help='XMLファイルのパス（.xml.gz / .xml.zst も可）')
     parser.add_argument('--db', default='music_replay.duckdb', help='DuckDBファイルのパス')
+    parser.add_argument('--library', type=check_library_id, default=DEFAULT_LIBRARY_ID, help=LIBRARY_HELP)
+    parser.add_argument('--storage', choices=STORAGES, default=STORAGE_FULL, help=STORAGE_HELP)
+    parser.add_argument('--lake', default=snapshot_lake.LAKE_DIR,
+                        help='--storage lake のときのParquetレイクのディレクトリ')
+    parser.add_argument('--profile', nargs='?', const=PROFILE_DIR, metavar='DIR',
+                        help=f'パースをcProfileで計測してDIRに出力する（省略時は {PROFILE_DIR}/）')
     args = parser.parse_args()
 
     xml_path = Path(args.xml_path)
-    if not xml_path.exists():
-        print(f"エラー: ファイルが見つかりません: {xml_path}")
-        sys.exit(1)
+    audit = LoadAudit(new_run_id(), "xml", args.storage, str(xml_path), args.library)
+    with audit.stage("discover"):
+        if not xml_path.exists():
+            print(f"エラー: ファイルが見つかりません: {xml_path}")
+            sys.exit(1)
+        audit.file_size = xml_path.stat().st_size
 
     # DBファイルのパスを解決
     db_path = Path(args.db)
     if not db_path.is_absolute():
         # プロジェクトルートに作成
         db_path = Path(__file__).parent.parent / args.db
+    lake_dir = Path(args.lake)
+    if not lake_dir.is_absolute():
+        lake_dir = Path(__file__).parent.parent / args.lake
+    profile_dir = Path(args.profile) if args.profile else None
+    if profile_dir and not profile_dir.is_absolute():
+        profile_dir = Path(__file__).parent.parent / profile_dir
 
     print(f"XMLファイル: {xml_path}")
-    print(f"DBファイル: {db_path}")
+    if args.storage == STORAGE_LAKE:
+        print(f"レイク: {lake_dir}")
+    else:
+        print(f"DBファイル: {db_path}")
 
-    snapshot_date, tracks = parse_music_library(str(xml_path))
+    snapshot_date, tracks = parse_music_library(str(xml_path), audit, profile_dir)
     if snapshot_date and tracks:
-        load_to_duckdb(str(db_path), snapshot_date, str(xml_path), tracks)
+        if args.storage == STORAGE_LAKE:
+            load_to_lake(str(lake_dir), snapshot_date, str(xml_path), tracks, audit, args.library)
+        else:
+            load_to_duckdb(str(db_path), snapshot_date, str(xml_path), tracks, args.storage, audit, args.library)
     else:
         print("エラー: XMLのパースに失敗しました")
+        audit.finish(STATUS_FAILED, snapshot_date=snapshot_date, error=audit.error)
+        audit.record_to(str(snapshot_lake.manifest_path(lake_dir) if args.storage == STORAGE_LAKE else db_path))
         sys.exit(1)
 
 
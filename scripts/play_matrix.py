@@ -0,0 +1,547 @@
+#!/usr/bin/env python3
+"""
+play_matrix.py
+トラック／アーティスト × スナップショット／期間の再生数の疎行列と、それを使った分析
+
+fact_play_count_snapshot の正の play_count_delta をArrowで読み、SciPyの圧縮疎行列（CSR）にする。
+行は dim_track / dim_artist のキーの順（キーは連番で追加のみなので、新しいトラックは後ろに付く）、
+列はスナップショット日・期間の開始日の順。PlayMatrix.row_keys / col_dates で元のキー・日付に戻せる。
+最初のスナップショット（差分の基準）は列にしない。期間の列は、スナップショットのない期間も含めて連続させる。
+
+分析はNumPy/SciPyでベクトル化して計算し、platinum_* テーブルとしてウェアハウスに書き込む:
+    platinum_artist_affinity      一緒に聴かれるアーティスト（期間ごとの再生のコサイン類似度の上位）
+    platinum_rediscovered_tracks  しばらく再生のなかった曲を再び聴いた期間
+    platinum_listening_diversity  期間ごとの聴き方の多様性（再生の分布のエントロピー・実効曲数）
+    platinum_rotation_churn       前の期間からのローテーション（再生した曲）の入れ替わり
+行はライブラリ・期間の単位（--period）ごとに置き換わる。dbt run の後に実行する。
+
+numpy と scipy が必要（pip install numpy scipy）。ノートブックからは build_play_matrix を使う:
+    from play_matrix import build_play_matrix
+    matrix = build_play_matrix(con, "default", "artist", "month")
+"""
+
+import argparse
+import sys
+from datetime import date
+from pathlib import Path
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ingest import check_library_id
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = None
+    sparse = None
+
+
+OUTPUT_DB = "music_replay.duckdb"
+
+AXIS_TRACK = "track"
+AXIS_ARTIST = "artist"
+# 行の軸 → (行のディメンション, キー列)
+AXES = {
+    AXIS_TRACK: ("dim_track", "track_key"),
+    AXIS_ARTIST: ("dim_artist", "artist_key"),
+}
+
+PERIOD_SNAPSHOT = "snapshot"
+PERIOD_TYPES = [PERIOD_SNAPSHOT, "week", "month", "year"]
+
+AFFINITY_TABLE = "platinum_artist_affinity"
+REDISCOVERED_TABLE = "platinum_rediscovered_tracks"
+DIVERSITY_TABLE = "platinum_listening_diversity"
+CHURN_TABLE = "platinum_rotation_churn"
+
+# テーブル → (列名, DuckDBの型)。キー以外の名前の列はディメンションから引く
+PLATINUM_COLUMNS = {
+    AFFINITY_TABLE: [
+        ("library_id", "VARCHAR NOT NULL"),
+        ("period_type", "VARCHAR NOT NULL"),
+        ("artist_key", "INTEGER NOT NULL"),
+        ("artist_name", "VARCHAR"),
+        ("rank", "INTEGER NOT NULL"),
+        ("related_artist_key", "INTEGER NOT NULL"),
+        ("related_artist_name", "VARCHAR"),
+        # 期間ごとの再生数（log1p）のベクトルのコサイン類似度
+        ("affinity", "DOUBLE"),
+        ("shared_periods", "INTEGER"),
+        ("artist_plays", "BIGINT"),
+        ("related_artist_plays", "BIGINT"),
+    ],
+    REDISCOVERED_TABLE: [
+        ("library_id", "VARCHAR NOT NULL"),
+        ("period_type", "VARCHAR NOT NULL"),
+        ("period_start", "DATE NOT NULL"),
+        ("track_key", "INTEGER NOT NULL"),
+        ("title", "VARCHAR"),
+        ("artist_name", "VARCHAR"),
+        ("plays", "BIGINT"),
+        # 前に再生のあった期間と、その間の再生のなかった期間の数
+        ("prev_period_start", "DATE"),
+        ("gap_periods", "INTEGER"),
+        ("prior_plays", "BIGINT"),
+    ],
+    DIVERSITY_TABLE: [
+        ("library_id", "VARCHAR NOT NULL"),
+        ("period_type", "VARCHAR NOT NULL"),
+        ("period_start", "DATE NOT NULL"),
+        ("total_plays", "BIGINT"),
+        ("active_tracks", "INTEGER"),
+        # 再生の分布のシャノンエントロピー（自然対数）と、その exp（同じ多様性になる均等な曲数）
+        ("track_entropy", "DOUBLE"),
+        ("effective_tracks", "DOUBLE"),
+        # エントロピー / log(active_tracks)（1なら全曲を同じ回数ずつ）
+        ("track_evenness", "DOUBLE"),
+        ("active_artists", "INTEGER"),
+        ("artist_entropy", "DOUBLE"),
+        ("effective_artists", "DOUBLE"),
+    ],
+    CHURN_TABLE: [
+        ("library_id", "VARCHAR NOT NULL"),
+        ("period_type", "VARCHAR NOT NULL"),
+        ("period_start", "DATE NOT NULL"),
+        ("prev_period_start", "DATE NOT NULL"),
+        ("active_tracks", "INTEGER"),
+        ("prev_active_tracks", "INTEGER"),
+        ("retained_tracks", "INTEGER"),
+        ("new_tracks", "INTEGER"),
+        ("dropped_tracks", "INTEGER"),
+        ("jaccard", "DOUBLE"),
+        # 今期の再生曲のうち前の期間に再生のなかった曲の割合と、その曲の再生数の割合
+        ("churn_rate", "DOUBLE"),
+        ("new_play_share", "DOUBLE"),
+    ],
+}
+
+# 計算結果（r）に名前を付けて書き込むSELECT
+PLATINUM_SELECTS = {
+    AFFINITY_TABLE: """
+        SELECT
+            r.library_id, r.period_type, r.artist_key, a.artist_name, r.rank,
+            r.related_artist_key, ra.artist_name, r.affinity, r.shared_periods,
+            r.artist_plays, r.related_artist_plays
+        FROM _platinum_result AS r
+        LEFT JOIN dim_artist AS a
+            ON r.library_id = a.library_id AND r.artist_key = a.artist_key
+        LEFT JOIN dim_artist AS ra
+            ON r.library_id = ra.library_id AND r.related_artist_key = ra.artist_key
+        ORDER BY r.library_id, r.artist_key, r.rank
+    """,
+    REDISCOVERED_TABLE: """
+        SELECT
+            r.library_id, r.period_type, r.period_start, r.track_key, t.title, t.artist_name,
+            r.plays, r.prev_period_start, r.gap_periods, r.prior_plays
+        FROM _platinum_result AS r
+        LEFT JOIN dim_track AS t
+            ON r.track_key = t.track_key
+        ORDER BY r.library_id, r.period_start, r.plays DESC
+    """,
+    DIVERSITY_TABLE: "SELECT * FROM _platinum_result ORDER BY library_id, period_start",
+    CHURN_TABLE: "SELECT * FROM _platinum_result ORDER BY library_id, period_start",
+}
+
+
+def require_scipy():
+    """疎行列を扱うのに numpy と scipy が必要"""
+    if sparse is None:
+        raise RuntimeError("play_matrix.py には numpy と scipy が必要です（pip install numpy scipy）")
+
+
+class PlayMatrix:
+    """1ライブラリの再生数の疎行列（行: トラック／アーティスト、列: スナップショット／期間）"""
+
+    def __init__(self, library_id: str, axis: str, period_type: str,
+                 matrix: "sparse.csr_matrix", row_keys: "np.ndarray", col_dates: list[date]):
+        self.library_id = library_id
+        self.axis = axis
+        self.period_type = period_type
+        self.matrix = matrix
+        self.row_keys = row_keys
+        self.col_dates = col_dates
+
+    @property
+    def key_column(self) -> str:
+        """行のキーの列名（track_key / artist_key）"""
+        return AXES[self.axis][1]
+
+    def row_index(self) -> pa.Table:
+        """行番号 → キーの対応表"""
+        return pa.table({
+            "row_index": pa.array(np.arange(len(self.row_keys), dtype=np.int32)),
+            self.key_column: pa.array(self.row_keys),
+        })
+
+    def col_index(self) -> pa.Table:
+        """列番号 → スナップショット日・期間の開始日の対応表"""
+        return pa.table({
+            "col_index": pa.array(np.arange(len(self.col_dates), dtype=np.int32)),
+            "period_start": pa.array(self.col_dates, type=pa.date32()),
+        })
+
+    def save(self, out_dir: Path) -> Path:
+        """行列（.npz）と行・列の対応表（Parquet）を書き出す"""
+        out_dir.mkdir(parents=True, exist_ok=True)
+        stem = f"play_matrix.{self.library_id}.{self.axis}.{self.period_type}"
+        sparse.save_npz(out_dir / f"{stem}.npz", self.matrix)
+        pq.write_table(self.row_index(), out_dir / f"{stem}.rows.parquet")
+        pq.write_table(self.col_index(), out_dir / f"{stem}.cols.parquet")
+        return out_dir / f"{stem}.npz"
+
+
+def _period_sql(period_type: str, column: str) -> str:
+    """スナップショット日 → 列の日付（スナップショット日・期間の開始日）"""
+    if period_type == PERIOD_SNAPSHOT:
+        return column
+    return f"CAST(date_trunc('{period_type}', {column}) AS DATE)"
+
+
+def _index_ctes(axis: str, period_type: str) -> str:
+    """行（row_index）・列（col_index）の番号を振るCTE（$1 は library_id）"""
+    dimension, key_column = AXES[axis]
+    if period_type == PERIOD_SNAPSHOT:
+        col_dates = "SELECT snapshot_date AS col_date FROM later_snapshots"
+    else:
+        col_dates = f"""
+            SELECT CAST(UNNEST(generate_series(first_col, last_col, INTERVAL 1 {period_type})) AS DATE) AS col_date
+            FROM (
+                SELECT
+                    CAST(MIN({_period_sql(period_type, 'snapshot_date')}) AS TIMESTAMP) AS first_col,
+                    CAST(MAX({_period_sql(period_type, 'snapshot_date')}) AS TIMESTAMP) AS last_col
+                FROM later_snapshots
+            )
+            WHERE first_col IS NOT NULL
+        """
+    return f"""
+        row_keys AS (
+            SELECT
+                {key_column} AS row_key,
+                ROW_NUMBER() OVER (ORDER BY {key_column}) - 1 AS row_index
+            FROM {dimension}
+            WHERE library_id = $1 AND {key_column} IS NOT NULL
+        ),
+        -- 最初のスナップショット（差分の基準）より後のスナップショット
+        later_snapshots AS (
+            SELECT snapshot_date
+            FROM bronze_snapshots
+            WHERE library_id = $1
+                AND snapshot_date > (SELECT MIN(snapshot_date) FROM bronze_snapshots WHERE library_id = $1)
+        ),
+        col_keys AS (
+            SELECT
+                col_date,
+                ROW_NUMBER() OVER (ORDER BY col_date) - 1 AS col_index
+            FROM ({col_dates})
+        )
+    """
+
+
+def build_play_matrix(con: duckdb.DuckDBPyConnection, library_id: str,
+                      axis: str = AXIS_TRACK, period_type: str = "month") -> PlayMatrix:
+    """fact_play_count_snapshot から1ライブラリの再生数の疎行列を作る"""
+    require_scipy()
+    ctes = _index_ctes(axis, period_type)
+    # アーティストの行は、トラックの最新のアーティストに集計する
+    row_key = "t.artist_key" if axis == AXIS_ARTIST else "f.track_key"
+    row_join = "INNER JOIN dim_track AS t ON f.track_key = t.track_key" if axis == AXIS_ARTIST else ""
+
+    row_keys = con.execute(f"WITH {ctes} SELECT row_key FROM row_keys ORDER BY row_index",
+                           [library_id]).arrow().read_all()
+    col_dates = con.execute(f"WITH {ctes} SELECT col_date FROM col_keys ORDER BY col_index",
+                            [library_id]).arrow().read_all()
+    entries = con.execute(f"""
+        WITH {ctes},
+        plays AS (
+            SELECT
+                {row_key} AS row_key,
+                {_period_sql(period_type, 'f.snapshot_date')} AS col_date,
+                SUM(f.play_count_delta) AS plays
+            FROM fact_play_count_snapshot AS f
+            {row_join}
+            WHERE f.library_id = $1
+                AND f.play_count_delta > 0
+            GROUP BY ALL
+        )
+        SELECT r.row_index, c.col_index, p.plays
+        FROM plays AS p
+        INNER JOIN row_keys AS r
+            ON p.row_key = r.row_key
+        INNER JOIN col_keys AS c
+            ON p.col_date = c.col_date
+    """, [library_id]).arrow().read_all()
+
+    shape = (row_keys.num_rows, col_dates.num_rows)
+    matrix = sparse.csr_matrix(
+        (entries.column("plays").to_numpy().astype(np.int64),
+         (entries.column("row_index").to_numpy(), entries.column("col_index").to_numpy())),
+        shape=shape,
+    )
+    matrix.sort_indices()
+    return PlayMatrix(library_id, axis, period_type, matrix,
+                      row_keys.column("row_key").to_numpy(), col_dates.column("col_date").to_pylist())
+
+
+def _row_ids(matrix: "sparse.csr_matrix") -> "np.ndarray":
+    """CSRの各要素の行番号"""
+    return np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+
+
+def _nullable(values: "np.ndarray", valid: "np.ndarray") -> pa.Array:
+    """valid でない要素をNULLにしたArrowの配列"""
+    return pa.array(values, mask=~valid)
+
+
+def artist_affinity(artists: PlayMatrix, top_n: int = 10, min_shared: int = 2) -> pa.Table:
+    """アーティストごとに、期間ごとの再生が似ているアーティストの上位 top_n
+
+    再生数は log1p で弱めてから行を正規化し、X Xᵀ でコサイン類似度をまとめて求める。
+    一緒に再生された期間が min_shared 未満の組は除く。
+    """
+    plays = artists.matrix
+    weights = plays.astype(np.float64)
+    weights.data = np.log1p(weights.data)
+    norms = np.sqrt(np.asarray(weights.multiply(weights).sum(axis=1)).ravel())
+    inverse = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    normalized = sparse.diags(inverse) @ weights
+    similarity = (normalized @ normalized.T).tocsr()
+    active = (plays > 0).astype(np.int32)
+    co_periods = (active @ active.T).tocsr()
+
+    # 共通の期間数は類似度の非ゼロの位置ごとに引く（2つの行列の要素の並びには依存しない）
+    rows = _row_ids(similarity)
+    cols = similarity.indices
+    shared = np.zeros(len(rows), dtype=np.int32)
+    if len(rows):
+        shared[:] = np.asarray(co_periods[rows, cols]).ravel()
+    keep = (rows != cols) & (shared >= min_shared)
+    rows, cols = rows[keep], cols[keep]
+    affinity, shared_periods = similarity.data[keep], shared[keep]
+
+    # 行ごとに類似度の高い順（同じなら相手のキーの順）に並べて順位を振る
+    order = np.lexsort((cols, -affinity, rows))
+    rows, cols, affinity, shared_periods = rows[order], cols[order], affinity[order], shared_periods[order]
+    position = np.arange(len(rows))
+    starts = np.r_[True, rows[1:] != rows[:-1]] if len(rows) else np.zeros(0, dtype=bool)
+    rank = position - np.maximum.accumulate(np.where(starts, position, 0)) + 1
+    top = rank <= top_n
+    rows, cols, rank = rows[top], cols[top], rank[top]
+
+    totals = np.asarray(plays.sum(axis=1)).ravel()
+    return pa.table({
+        "library_id": pa.array([artists.library_id] * len(rows), type=pa.string()),
+        "period_type": pa.array([artists.period_type] * len(rows), type=pa.string()),
+        "artist_key": pa.array(artists.row_keys[rows]),
+        "rank": pa.array(rank.astype(np.int32)),
+        "related_artist_key": pa.array(artists.row_keys[cols]),
+        "affinity": pa.array(affinity[top]),
+        "shared_periods": pa.array(shared_periods[top]),
+        "artist_plays": pa.array(totals[rows]),
+        "related_artist_plays": pa.array(totals[cols]),
+    })
+
+
+def rediscovered_tracks(tracks: PlayMatrix, min_gap: int = 3) -> pa.Table:
+    """前に再生のあった曲を、min_gap 期間以上あいだを空けて再び再生した期間
+
+    CSRの各行の列番号は昇順なので、同じ行の隣り合う要素の列番号の差があいだの期間数になる。
+    """
+    plays = tracks.matrix
+    rows = _row_ids(plays)
+    cols = plays.indices
+    prev_cols = np.r_[-1, cols[:-1]]
+    same_track = np.r_[False, rows[1:] == rows[:-1]]
+    gaps = cols - prev_cols - 1
+    # その行のそれまでの再生数（累積和から行の先頭までの累積和を引く）
+    before = np.cumsum(plays.data) - plays.data
+    prior_plays = before - before[plays.indptr[rows]]
+
+    found = same_track & (gaps >= min_gap)
+    col_dates = pa.array(tracks.col_dates, type=pa.date32())
+    return pa.table({
+        "library_id": pa.array([tracks.library_id] * int(found.sum()), type=pa.string()),
+        "period_type": pa.array([tracks.period_type] * int(found.sum()), type=pa.string()),
+        "period_start": col_dates.take(pa.array(cols[found])),
+        "track_key": pa.array(tracks.row_keys[rows[found]]),
+        "plays": pa.array(plays.data[found]),
+        "prev_period_start": col_dates.take(pa.array(prev_cols[found])),
+        "gap_periods": pa.array(gaps[found].astype(np.int32)),
+        "prior_plays": pa.array(prior_plays[found]),
+    })
+
+
+def _column_entropy(matrix: "sparse.csr_matrix") -> tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+    """列ごとの (再生数の合計, 再生のあった行の数, 再生の分布のエントロピー)"""
+    by_column = matrix.tocsc()
+    totals = np.asarray(by_column.sum(axis=0)).ravel()
+    cols = np.repeat(np.arange(by_column.shape[1]), np.diff(by_column.indptr))
+    shares = by_column.data / totals[cols]
+    entropy = np.bincount(cols, weights=-shares * np.log(shares), minlength=by_column.shape[1]).astype(np.float64)
+    return totals, np.diff(by_column.indptr), entropy
+
+
+def listening_diversity(tracks: PlayMatrix, artists: PlayMatrix) -> pa.Table:
+    """期間ごとの再生の分布の多様性（トラック・アーティスト）"""
+    assert tracks.col_dates == artists.col_dates
+    totals, active_tracks, track_entropy = _column_entropy(tracks.matrix)
+    _, active_artists, artist_entropy = _column_entropy(artists.matrix)
+    played = totals > 0
+    spread = active_tracks > 1
+    evenness = np.divide(track_entropy, np.log(np.maximum(active_tracks, 2)))
+    return pa.table({
+        "library_id": pa.array([tracks.library_id] * len(totals), type=pa.string()),
+        "period_type": pa.array([tracks.period_type] * len(totals), type=pa.string()),
+        "period_start": pa.array(tracks.col_dates, type=pa.date32()),
+        "total_plays": pa.array(totals),
+        "active_tracks": pa.array(active_tracks.astype(np.int32)),
+        "track_entropy": _nullable(track_entropy, played),
+        "effective_tracks": _nullable(np.exp(track_entropy), played),
+        "track_evenness": _nullable(evenness, spread),
+        "active_artists": pa.array(active_artists.astype(np.int32)),
+        "artist_entropy": _nullable(artist_entropy, active_artists > 0),
+        "effective_artists": _nullable(np.exp(artist_entropy), active_artists > 0),
+    })
+
+
+def rotation_churn(tracks: PlayMatrix) -> pa.Table:
+    """前の期間と比べた、再生した曲の入れ替わり"""
+    plays = tracks.matrix.tocsc()
+    active = (plays > 0).astype(np.int64)
+    counts = np.diff(active.indptr)
+    totals = np.asarray(plays.sum(axis=0)).ravel()
+    # 隣り合う列の要素ごとの積の列和 = 両方の期間で再生した曲の数・再生数
+    retained = np.asarray(active[:, 1:].multiply(active[:, :-1]).sum(axis=0)).ravel()
+    retained_plays = np.asarray(plays[:, 1:].multiply(active[:, :-1]).sum(axis=0)).ravel()
+
+    current, previous = counts[1:], counts[:-1]
+    union = current + previous - retained
+    new_tracks = current - retained
+    with np.errstate(divide="ignore", invalid="ignore"):
+        jaccard = retained / union
+        churn_rate = new_tracks / current
+        new_play_share = (totals[1:] - retained_plays) / totals[1:]
+    col_dates = tracks.col_dates
+    return pa.table({
+        "library_id": pa.array([tracks.library_id] * len(current), type=pa.string()),
+        "period_type": pa.array([tracks.period_type] * len(current), type=pa.string()),
+        "period_start": pa.array(col_dates[1:], type=pa.date32()),
+        "prev_period_start": pa.array(col_dates[:-1], type=pa.date32()),
+        "active_tracks": pa.array(current.astype(np.int32)),
+        "prev_active_tracks": pa.array(previous.astype(np.int32)),
+        "retained_tracks": pa.array(retained.astype(np.int32)),
+        "new_tracks": pa.array(new_tracks.astype(np.int32)),
+        "dropped_tracks": pa.array((previous - retained).astype(np.int32)),
+        "jaccard": _nullable(jaccard, union > 0),
+        "churn_rate": _nullable(churn_rate, current > 0),
+        "new_play_share": _nullable(new_play_share, totals[1:] > 0),
+    })
+
+
+def write_platinum(con: duckdb.DuckDBPyConnection, results: dict[str, list[pa.Table]],
+                   library_ids: list[str], period_type: str) -> dict[str, int]:
+    """ライブラリ・期間の単位ごとに platinum_* テーブルの行を1トランザクションで置き換える"""
+    written = {}
+    con.begin()
+    try:
+        for table_name, tables in results.items():
+            columns = PLATINUM_COLUMNS[table_name]
+            column_defs = ",\n                ".join(f"{name} {sql_type}" for name, sql_type in columns)
+            con.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table_name} (
+                    {column_defs}
+                )
+            """)
+            con.execute(f"DELETE FROM {table_name} WHERE list_contains(?, library_id) AND period_type = ?",
+                        [library_ids, period_type])
+            result = pa.concat_tables(tables)
+            con.register("_platinum_result", result)
+            try:
+                con.execute(f"""
+                    INSERT INTO {table_name} ({', '.join(name for name, _ in columns)})
+                    {PLATINUM_SELECTS[table_name]}
+                """)
+            finally:
+                con.unregister("_platinum_result")
+            written[table_name] = result.num_rows
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    return written
+
+
+def list_libraries(con: duckdb.DuckDBPyConnection) -> list[str]:
+    """スナップショットのあるライブラリID"""
+    return [row[0] for row in con.execute(
+        "SELECT DISTINCT library_id FROM bronze_snapshots ORDER BY library_id"
+    ).fetchall()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='再生数の疎行列を作り、分析結果を platinum_* テーブルに書き込む')
+    parser.add_argument('--db', default=OUTPUT_DB, help='DuckDBファイルのパス')
+    parser.add_argument('--library', type=check_library_id, action='append',
+                        help='分析するライブラリID（複数指定可、省略時はすべてのライブラリ）')
+    parser.add_argument('--period', choices=PERIOD_TYPES, default='month', help='列の単位')
+    parser.add_argument('--top', type=int, default=10, help='アーティストごとに記録する似たアーティストの数')
+    parser.add_argument('--min-shared', type=int, default=2,
+                        help='似たアーティストとする、一緒に再生された期間の最小数')
+    parser.add_argument('--gap', type=int, default=3, help='再発見とする、再生のなかった期間の最小数')
+    parser.add_argument('--save', metavar='DIR',
+                        help='行列（.npz）と行・列の対応表（Parquet）をDIRに書き出す')
+    args = parser.parse_args()
+
+    try:
+        require_scipy()
+    except RuntimeError as e:
+        print(f"エラー: {e}")
+        sys.exit(1)
+
+    db_path = Path(args.db)
+    if not db_path.is_absolute():
+        db_path = Path(__file__).parent.parent / args.db
+    if not db_path.exists():
+        print(f"エラー: DBファイルが見つかりません: {db_path}")
+        sys.exit(1)
+    save_dir = Path(args.save) if args.save else None
+    if save_dir and not save_dir.is_absolute():
+        save_dir = Path(__file__).parent.parent / save_dir
+
+    con = duckdb.connect(str(db_path))
+    try:
+        try:
+            library_ids = args.library or list_libraries(con)
+        except duckdb.CatalogException:
+            print("エラー: bronze_snapshots がありません。先に dbt run を実行してください")
+            sys.exit(1)
+
+        results = {AFFINITY_TABLE: [], REDISCOVERED_TABLE: [], DIVERSITY_TABLE: [], CHURN_TABLE: []}
+        for library_id in library_ids:
+            tracks = build_play_matrix(con, library_id, AXIS_TRACK, args.period)
+            artists = build_play_matrix(con, library_id, AXIS_ARTIST, args.period)
+            for matrix in (tracks, artists):
+                cells = matrix.matrix.shape[0] * matrix.matrix.shape[1]
+                print(f"{library_id}: {matrix.axis} × {args.period} {matrix.matrix.shape[0]:,} × "
+                      f"{matrix.matrix.shape[1]:,}, {matrix.matrix.nnz:,} nonzero "
+                      f"({matrix.matrix.nnz / cells if cells else 0:.2%})")
+                if save_dir:
+                    print(f"  → {matrix.save(save_dir)}")
+
+            results[AFFINITY_TABLE].append(artist_affinity(artists, args.top, args.min_shared))
+            results[REDISCOVERED_TABLE].append(rediscovered_tracks(tracks, args.gap))
+            results[DIVERSITY_TABLE].append(listening_diversity(tracks, artists))
+            results[CHURN_TABLE].append(rotation_churn(tracks))
+
+        written = write_platinum(con, results, library_ids, args.period)
+    finally:
+        con.close()
+
+    for table_name, rows in written.items():
+        print(f"{table_name}: {rows:,} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+plist_stream.py
+Music Library XMLをストリーミングでパース
+
+plistlib.loadと違いファイル全体のdictを作らず、expatのイベントを追って
+Tracks配下だけを読む。Playlistsは読み込まずに打ち切る。
+各トラックはingest.TRACK_FIELDSと同じ並びのタプルとしてyieldする。
+
+一部のフィールドだけが必要な場合は、正規表現で値を拾う iter_track_fields を使える。
+"""
+
+import html
+import re
+from collections.abc import Iterator, Sequence
+from datetime import datetime
+from typing import BinaryIO
+from xml.parsers import expat
+
+from ingest import TRACK_FIELDS
+
+
+# XMLのキー → TRACK_FIELDSの位置（ロードする23キーのみ）
+XML_KEYS = {
+    "Name": "name",
+    "Artist": "artist",
+    "Album Artist": "album_artist",
+    "Album": "album",
+    "Genre": "genre",
+    "Kind": "kind",
+    "Total Time": "total_time",
+    "Disc Number": "disc_number",
+    "Disc Count": "disc_count",
+    "Track Number": "track_number",
+    "Track Count": "track_count",
+    "Year": "year",
+    "Date Added": "date_added",
+    "Play Count": "play_count",
+    "Play Date": "play_date",
+    "Play Date UTC": "play_date_utc",
+    "Skip Count": "skip_count",
+    "Skip Date": "skip_date",
+    "Rating": "rating",
+    "Loved": "loved",
+    "Persistent ID": "persistent_id",
+    "Location": "location",
+}
+FIELD_INDEX = {key: TRACK_FIELDS.index(field) for key, field in XML_KEYS.items()}
+TRACK_ID_INDEX = TRACK_FIELDS.index("track_id")
+
+# トップレベルで拾うスカラー値（Date など）
+HEADER_KEYS = {"Date", "Library Persistent ID", "Application Version"}
+
+CHUNK_SIZE = 1 << 16
+
+_CONTAINERS = {"dict", "array"}
+
+
+def _parse_date(text: str) -> datetime:
+    """plistの日付（YYYY-MM-DDTHH:MM:SSZ）をnaiveなUTC datetimeに変換"""
+    return datetime(
+        int(text[0:4]), int(text[5:7]), int(text[8:10]),
+        int(text[11:13]), int(text[14:16]), int(text[17:19]),
+    )
+
+
+_CONVERTERS = {
+    "string": str,
+    "integer": int,
+    "real": float,
+    "date": _parse_date,
+}
+
+
+class _TrackHandler:
+    """expatのイベントを受けてトラックのタプルを組み立てる"""
+
+    def __init__(self, header: dict | None):
+        self.header = header
+        self.records: list[tuple] = []
+        self.done = False
+        self.depth = 0          # dict/arrayのネスト深さ
+        self.skip_depth = 0     # この深さを抜けるまでイベントを無視
+        self.text: list[str] = []
+        self.collecting = False
+        self.top_key = None     # ルートdictの現在のキー
+        self.in_tracks = False
+        self.track_key = None   # Tracks dictの現在のキー（トラックID）
+        self.record = None
+        self.field = None       # 現在の値を格納する位置（対象外キーはNone）
+
+    def start(self, tag, _attrs):
+        if self.done:
+            return
+        if self.skip_depth:
+            if tag in _CONTAINERS:
+                self.depth += 1
+            return
+
+        if tag in _CONTAINERS:
+            self.depth += 1
+            if self.depth == 2 and tag == "dict" and self.top_key == "Tracks":
+                self.in_tracks = True
+            elif self.depth == 3 and self.in_tracks and tag == "dict":
+                self.record = [None] * len(TRACK_FIELDS)
+                self.record[TRACK_ID_INDEX] = int(self.track_key)
+                self.field = None
+            elif self.depth > 1:
+                # Playlistsやトラック内のネストしたコンテナは読み飛ばす
+                self.skip_depth = self.depth
+            return
+
+        if tag == "key" or self._value_wanted():
+            self.text.clear()
+            self.collecting = True
+
+    def end(self, tag):
+        if self.done:
+            return
+        if self.skip_depth:
+            if tag in _CONTAINERS:
+                if self.depth == self.skip_depth:
+                    self.skip_depth = 0
+                    self._value_consumed()
+                self.depth -= 1
+            return
+
+        if tag in _CONTAINERS:
+            if self.depth == 3 and self.record is not None:
+                self.records.append(tuple(self.record))
+                self.record = None
+            elif self.depth == 2 and self.in_tracks:
+                # Tracksを読み終えたら残り（Playlists）はパースしない
+                self.in_tracks = False
+                self.done = True
+            self.depth -= 1
+            self._value_consumed()
+            return
+
+        text = "".join(self.text) if self.collecting else ""
+        self.collecting = False
+
+        if tag == "key":
+            if self.depth == 1:
+                self.top_key = text
+            elif self.depth == 2 and self.in_tracks:
+                self.track_key = text
+            elif self.depth == 3 and self.record is not None:
+                self.field = FIELD_INDEX.get(text)
+            return
+
+        if self.depth == 3 and self.record is not None:
+            if self.field is not None:
+                self.record[self.field] = self._convert(tag, text)
+        elif self.depth == 1 and self.header is not None and self.top_key in HEADER_KEYS:
+            self.header[self.top_key] = self._convert(tag, text)
+        self._value_consumed()
+
+    def chars(self, data):
+        if self.collecting:
+            self.text.append(data)
+
+    def _value_wanted(self) -> bool:
+        if self.depth == 3 and self.record is not None:
+            return self.field is not None
+        return self.depth == 1 and self.top_key in HEADER_KEYS
+
+    def _value_consumed(self):
+        if self.depth == 3:
+            self.field = None
+        elif self.depth == 1:
+            self.top_key = None
+
+    @staticmethod
+    def _convert(tag: str, text: str):
+        if tag == "true":
+            return True
+        if tag == "false":
+            return False
+        converter = _CONVERTERS.get(tag)
+        return converter(text) if converter else None
+
+
+def iter_tracks(fp: BinaryIO, header: dict | None = None,
+                chunk_size: int = CHUNK_SIZE) -> Iterator[tuple]:
+    """Tracks配下のトラックをTRACK_FIELDS順のタプルとしてyieldする
+
+    headerにdictを渡すと、ルートのDate等をそこに格納する。
+    DateはTracksより前にあるため、最初のトラックをyieldした時点で埋まっている。
+    """
+    handler = _TrackHandler(header)
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = handler.start
+    parser.EndElementHandler = handler.end
+    parser.CharacterDataHandler = handler.chars
+
+    while not handler.done:
+        chunk = fp.read(chunk_size)
+        parser.Parse(chunk, not chunk)
+        if handler.records:
+            yield from handler.records
+            handler.records.clear()
+        if not chunk:
+            break
+
+
+# iter_track_fields 用: Tracks の開始位置とヘッダーの日時
+_TRACKS_START = re.compile(rb"<key>Tracks</key>\s*<dict>")
+_HEADER_DATE = re.compile(rb"<key>Date</key>\s*<date>([^<]*)</date>")
+
+SCAN_CHUNK_SIZE = 1 << 20
+
+
+def _scan_value(tag: bytes, text: bytes):
+    """正規表現で拾った値を変換する"""
+    if tag == b"string":
+        value = text.decode("utf-8")
+        return html.unescape(value) if "&" in value else value
+    if tag == b"true":
+        return True
+    if tag == b"false":
+        return False
+    return _CONVERTERS[tag.decode()](text.decode())
+
+
+def iter_track_fields(fp: BinaryIO, fields: Sequence[str], header: dict | None = None,
+                      chunk_size: int = SCAN_CHUNK_SIZE) -> Iterator[tuple]:
+    """Tracks配下のトラックから fields の値だけを取り出し、その順のタプルとしてyieldする
+
+    iter_tracks と違いXMLを完全にはパースせず、<key>と値の組を正規表現で拾う。
+    Music.appのトラックのdictはネストしないので、</dict> をトラックの終わりとみなす。
+    差分の比較など一部のフィールドだけが必要なときに iter_tracks より数倍速い。
+    headerにdictを渡すと、ルートのDateを格納する。
+    """
+    keys = [key for key, field in XML_KEYS.items() if field in fields]
+    position = {key.encode(): fields.index(XML_KEYS[key]) for key in keys}
+    # 先頭の < を括り出す（選択肢ごとに書くと正規表現エンジンの前方一致の最適化が効かず数倍遅くなる）
+    pattern = re.compile(
+        rb"<(?:key>(" + b"|".join(re.escape(key.encode()) for key in keys) + rb")</key>\s*"
+        rb"(?:<(string|integer|real|date)>([^<]*)</|<(true|false)/>)"
+        rb"|(/dict>)|key>(Playlists)</key>)"
+    )
+
+    buffer = b""
+    in_tracks = False
+    record = [None] * len(fields)
+    while True:
+        chunk = fp.read(chunk_size)
+        buffer += chunk
+        if not in_tracks:
+            match = _TRACKS_START.search(buffer)
+            if match is None:
+                if chunk:
+                    continue
+                return
+            if header is not None:
+                date = _HEADER_DATE.search(buffer, 0, match.start())
+                if date:
+                    header["Date"] = _parse_date(date.group(1).decode())
+            buffer = buffer[match.end():]
+            in_tracks = True
+
+        # 最後の </dict> までは値の途中で切れていないので、そこまでを処理する
+        end = len(buffer) if not chunk else buffer.rfind(b"</dict>") + len(b"</dict>")
+        if end < len(b"</dict>"):
+            continue
+        for key, tag, text, flag, dict_end, playlists in pattern.findall(buffer, 0, end):
+            if key:
+                record[position[key]] = _scan_value(tag or flag, text)
+            elif dict_end:
+                # Tracks自体の </dict> では空のレコードになる
+                if any(value is not None for value in record):
+                    yield tuple(record)
+                record = [None] * len(fields)
+            else:
+                return
+        buffer = buffer[end:]
+        if not chunk:
+            return
@@ -0,0 +1,556 @@
+#!/usr/bin/env python3
+"""
+prune_snapshots.py
+古いスナップショットを間引いて、rawデータを日次→週次→月次の粒度にする
+
+保持ポリシー（ライブラリごとの最新スナップショットからの経過日数で決める）:
+    --daily 日数未満      すべて残す（1日1スナップショット）
+    --weekly 日数未満     週ごと・月ごとに最後のスナップショットを残す（週単位で判定）
+    それより古いもの      月ごとに最後のスナップショットを残す
+ライブラリの最初と最新のスナップショットは常に残す。期間の最後のスナップショットを残すので、
+週次の範囲では週・月・年、月次の範囲では月・年の期間別Replay（dim_period）の結果は変わらない。
+
+再生数は累積値なので、残したスナップショットの間の差分は間引いても変わらない。
+ただし次の場合はそのままでは差分が変わるため、行を移すかスナップショットを残す:
+  - 区間の途中で消えたトラック: 区間内の最後の行を区間の終わりのスナップショットに移す
+  - 間引くスナップショットで初めて現れ、区間の終わりまでに再生数・スキップ数が変わったトラック:
+    そのスナップショットを残す（前のスナップショットに行を移すと、まだ無かったトラックが現れる）
+  - 再生数・スキップ数が減ったトラック（リセットなど）: 減る前後のスナップショットを残す
+適用する前に、残す区間ごと・トラックごとの再生数とスキップ数の差分の合計が
+間引く前と一致することを確認し、一致しなければ何も変更しない。
+
+full形式（raw_itunes_library）とlake形式（Parquetレイク）に対応する。
+compact形式は変化した行だけを保存しているので対象外。
+間引いた後は dbt run --full-refresh でモデルを作り直す（--rebuild で実行する）。
+"""
+
+import argparse
+import os
+import shlex
+import subprocess
+import sys
+from pathlib import Path
+
+import duckdb
+
+from ingest import (
+    RAW_TABLE, STORAGE_COMPACT, STORAGE_FULL, STORAGE_HELP, STORAGE_LAKE, STORAGES, TRACK_FIELDS,
+    check_library_id,
+)
+import snapshot_lake
+from snapshot_manifest import mark_pruned
+
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+OUTPUT_DB = "music_replay.duckdb"
+
+DEFAULT_DAILY_DAYS = 90
+DEFAULT_WEEKLY_DAYS = 730
+
+TIER_DAILY = "daily"
+TIER_WEEKLY = "weekly"
+TIER_MONTHLY = "monthly"
+
+
+def quote_literal(value: str) -> str:
+    """SQLの文字列リテラル"""
+    return "'" + value.replace("'", "''") + "'"
+
+
+def lake_source_sql(lake_dir: Path) -> str:
+    """レイクの全パーティションを読むSQL"""
+    pattern = lake_dir / RAW_TABLE / "library_id=*" / "snapshot_date=*" / "*.parquet"
+    return f"""
+        SELECT * FROM read_parquet(
+            {quote_literal(str(pattern))},
+            hive_partitioning = true,
+            hive_types = {{'library_id': VARCHAR, 'snapshot_date': DATE}}
+        )
+    """
+
+
+def plan_retention(con: duckdb.DuckDBPyConnection, source_sql: str,
+                   daily_days: int, weekly_days: int, library_id: str | None):
+    """残すスナップショットと移す行を一時テーブルに作る
+
+    _retention_snapshots: スナップショットごとの保持区分・残すか・区間（prev_kept, interval_end]
+    _retention_moves:     移す行（元のスナップショット日 → target_date）と移した後のtrack_id
+    """
+    library_filter = f"WHERE library_id = {quote_literal(library_id)}" if library_id else ""
+    con.execute(f"CREATE OR REPLACE TEMP VIEW _retention_source AS SELECT * FROM ({source_sql}) {library_filter}")
+
+    # 保持ポリシー: 日次はすべて、週次は週・月ごと、月次は月ごとに最後のスナップショットを残す
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE _retention_policy AS
+        WITH snapshots AS (
+            SELECT
+                library_id,
+                snapshot_date,
+                ANY_VALUE(snapshot_path) AS snapshot_path,
+                MAX(track_id) AS max_track_id,
+                COUNT(*) AS row_count
+            FROM _retention_source
+            GROUP BY
+                library_id,
+                snapshot_date
+        ),
+        aged AS (
+            SELECT
+                *,
+                MAX(snapshot_date) OVER (PARTITION BY library_id) AS latest_snapshot_date,
+                snapshot_date = MIN(snapshot_date) OVER (PARTITION BY library_id) AS is_first,
+                date_trunc('week', snapshot_date)::DATE AS week_start,
+                date_trunc('month', snapshot_date)::DATE AS month_start
+            FROM snapshots
+        ),
+        tiered AS (
+            SELECT
+                *,
+                -- 週の途中で区分が変わらないよう、週次か月次かは翌週の最後の日の経過日数で決める
+                -- （週次の最初の週も、前の週の最後のスナップショットが残って範囲が変わらない）
+                CASE
+                    WHEN date_diff('day', snapshot_date, latest_snapshot_date) < ? THEN '{TIER_DAILY}'
+                    WHEN date_diff('day', week_start + 13, latest_snapshot_date) < ? THEN '{TIER_WEEKLY}'
+                    ELSE '{TIER_MONTHLY}'
+                END AS tier
+            FROM aged
+        )
+        SELECT
+            * EXCLUDE (latest_snapshot_date, week_start, month_start),
+            tier = '{TIER_DAILY}'
+                OR is_first
+                OR snapshot_date = latest_snapshot_date
+                -- 月の最後のスナップショットはどの区分でも残す（月をまたぐ週でも月・年の範囲が変わらない）
+                OR snapshot_date = MAX(snapshot_date) OVER (PARTITION BY library_id, month_start)
+                OR (
+                    tier = '{TIER_WEEKLY}'
+                    AND snapshot_date = MAX(snapshot_date) OVER (PARTITION BY library_id, week_start)
+                ) AS keep_by_policy
+        FROM tiered
+    """, [daily_days, weekly_days])
+
+    # 再生数・スキップ数が減ったトラックがあるスナップショットと、その直前の行のスナップショット
+    # （間に挟むと、減った分だけ差分の合計が変わる）
+    con.execute("""
+        CREATE OR REPLACE TEMP TABLE _retention_required AS
+        WITH track_rows AS (
+            SELECT
+                library_id,
+                snapshot_date,
+                COALESCE(play_count, 0) AS play_count,
+                COALESCE(skip_count, 0) AS skip_count,
+                LAG(snapshot_date) OVER w AS prev_snapshot_date,
+                LAG(COALESCE(play_count, 0)) OVER w AS prev_play_count,
+                LAG(COALESCE(skip_count, 0)) OVER w AS prev_skip_count
+            FROM _retention_source
+            WHERE persistent_id IS NOT NULL
+            WINDOW w AS (PARTITION BY library_id, persistent_id ORDER BY snapshot_date)
+        ),
+        decreases AS (
+            SELECT *
+            FROM track_rows
+            WHERE play_count < prev_play_count
+                OR skip_count < prev_skip_count
+        )
+        SELECT library_id, snapshot_date FROM decreases
+        UNION
+        SELECT library_id, prev_snapshot_date FROM decreases
+    """)
+
+    # 間引くスナップショットで初めて現れ、区間の終わりまでに再生数・スキップ数が変わったトラックがある
+    # スナップショット（最初の行を移すと、前のスナップショットに存在しなかったトラックが現れる）
+    con.execute("""
+        INSERT INTO _retention_required
+        WITH intervals AS (
+            SELECT
+                p.library_id,
+                p.snapshot_date,
+                p.keep_by_policy OR r.snapshot_date IS NOT NULL AS keep,
+                MIN(CASE WHEN p.keep_by_policy OR r.snapshot_date IS NOT NULL THEN p.snapshot_date END) OVER (
+                    PARTITION BY p.library_id
+                    ORDER BY p.snapshot_date
+                    ROWS BETWEEN CURRENT ROW AND UNBOUNDED FOLLOWING
+                ) AS interval_end
+            FROM _retention_policy AS p
+            LEFT JOIN _retention_required AS r
+                ON p.library_id = r.library_id
+                AND p.snapshot_date = r.snapshot_date
+        ),
+        first_rows AS (
+            SELECT
+                library_id,
+                persistent_id,
+                snapshot_date,
+                COALESCE(play_count, 0) AS play_count,
+                COALESCE(skip_count, 0) AS skip_count
+            FROM _retention_source
+            WHERE persistent_id IS NOT NULL
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY library_id, persistent_id
+                ORDER BY snapshot_date
+            ) = 1
+        )
+        SELECT DISTINCT
+            f.library_id,
+            f.snapshot_date
+        FROM first_rows AS f
+        INNER JOIN intervals AS i
+            ON f.library_id = i.library_id
+            AND f.snapshot_date = i.snapshot_date
+        INNER JOIN _retention_source AS r
+            ON f.library_id = r.library_id
+            AND f.persistent_id = r.persistent_id
+            AND r.snapshot_date > f.snapshot_date
+            AND r.snapshot_date <= i.interval_end
+        WHERE NOT i.keep
+            AND (
+                COALESCE(r.play_count, 0) <> f.play_count
+                OR COALESCE(r.skip_count, 0) <> f.skip_count
+            )
+    """)
+
+    con.execute("""
+        CREATE OR REPLACE TEMP TABLE _retention_snapshots AS
+        WITH kept AS (
+            SELECT
+                p.*,
+                p.keep_by_policy OR r.snapshot_date IS NOT NULL AS keep
+            FROM _retention_policy AS p
+            LEFT JOIN _retention_required AS r
+                ON p.library_id = r.library_id
+                AND p.snapshot_date = r.snapshot_date
+        )
+        SELECT
+            *,
+            -- 間引くスナップショットが属する区間（prev_kept, interval_end]
+            MAX(CASE WHEN keep THEN snapshot_date END) OVER (
+                PARTITION BY library_id
+                ORDER BY snapshot_date
+                ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+            ) AS prev_kept,
+            MIN(CASE WHEN keep THEN snapshot_date END) OVER (
+                PARTITION BY library_id
+                ORDER BY snapshot_date
+                ROWS BETWEEN CURRENT ROW AND UNBOUNDED FOLLOWING
+            ) AS interval_end
+        FROM kept
+    """)
+
+    con.execute("""
+        CREATE OR REPLACE TEMP TABLE _retention_moves AS
+        WITH dropped_rows AS (
+            SELECT
+                r.library_id,
+                r.snapshot_date,
+                r.persistent_id,
+                s.interval_end
+            FROM _retention_source AS r
+            INNER JOIN _retention_snapshots AS s
+                ON r.library_id = s.library_id
+                AND r.snapshot_date = s.snapshot_date
+            WHERE NOT s.keep
+                AND r.persistent_id IS NOT NULL
+        ),
+
+        -- 区間の終わりのスナップショットにないトラックは、区間内の最後の行を区間の終わりに移す
+        forward_moves AS (
+            SELECT
+                d.library_id,
+                d.snapshot_date,
+                d.persistent_id,
+                d.interval_end AS target_date
+            FROM dropped_rows AS d
+            ANTI JOIN _retention_source AS r
+                ON d.library_id = r.library_id
+                AND d.interval_end = r.snapshot_date
+                AND d.persistent_id = r.persistent_id
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY d.library_id, d.persistent_id, d.interval_end
+                ORDER BY d.snapshot_date DESC
+            ) = 1
+        )
+
+        -- 移した先のスナップショットでtrack_idが重ならないよう、その日の最大値から振り直す
+        SELECT
+            m.*,
+            t.snapshot_path AS target_snapshot_path,
+            t.max_track_id + ROW_NUMBER() OVER (
+                PARTITION BY m.library_id, m.target_date
+                ORDER BY m.persistent_id
+            ) AS target_track_id
+        FROM forward_moves AS m
+        INNER JOIN _retention_snapshots AS t
+            ON m.library_id = t.library_id
+            AND m.target_date = t.snapshot_date
+    """)
+
+
+def _interval_deltas_sql(rows_sql: str) -> str:
+    """区間ごと・トラックごとの再生数・スキップ数の差分（増えた分だけ）の合計"""
+    return f"""
+        SELECT
+            library_id,
+            persistent_id,
+            interval_end,
+            SUM(CASE WHEN play_count_delta > 0 THEN play_count_delta ELSE 0 END) AS plays,
+            SUM(CASE WHEN skip_count_delta > 0 THEN skip_count_delta ELSE 0 END) AS skips
+        FROM (
+            SELECT
+                library_id,
+                persistent_id,
+                interval_end,
+                COALESCE(play_count, 0) - LAG(COALESCE(play_count, 0)) OVER w AS play_count_delta,
+                COALESCE(skip_count, 0) - LAG(COALESCE(skip_count, 0)) OVER w AS skip_count_delta
+            FROM ({rows_sql})
+            WINDOW w AS (PARTITION BY library_id, persistent_id ORDER BY snapshot_date)
+        )
+        GROUP BY
+            library_id,
+            persistent_id,
+            interval_end
+    """
+
+
+def verify_plan(con: duckdb.DuckDBPyConnection) -> int:
+    """間引く前後で区間ごとの差分の合計が一致しないトラック・区間の数"""
+    before = _interval_deltas_sql("""
+        SELECT r.library_id, r.persistent_id, r.snapshot_date, s.interval_end, r.play_count, r.skip_count
+        FROM _retention_source AS r
+        INNER JOIN _retention_snapshots AS s
+            ON r.library_id = s.library_id
+            AND r.snapshot_date = s.snapshot_date
+        WHERE r.persistent_id IS NOT NULL
+    """)
+    after = _interval_deltas_sql("""
+        SELECT r.library_id, r.persistent_id, r.snapshot_date, r.snapshot_date AS interval_end,
+            r.play_count, r.skip_count
+        FROM _retention_source AS r
+        INNER JOIN _retention_snapshots AS s
+            ON r.library_id = s.library_id
+            AND r.snapshot_date = s.snapshot_date
+        WHERE s.keep
+            AND r.persistent_id IS NOT NULL
+        UNION ALL
+        SELECT r.library_id, r.persistent_id, m.target_date, m.target_date, r.play_count, r.skip_count
+        FROM _retention_source AS r
+        INNER JOIN _retention_moves AS m
+            ON r.library_id = m.library_id
+            AND r.snapshot_date = m.snapshot_date
+            AND r.persistent_id = m.persistent_id
+    """)
+    return con.execute(f"""
+        SELECT COUNT(*)
+        FROM ({before}) AS b
+        FULL OUTER JOIN ({after}) AS a
+            ON b.library_id = a.library_id
+            AND b.persistent_id = a.persistent_id
+            AND b.interval_end = a.interval_end
+        WHERE COALESCE(b.plays, 0) <> COALESCE(a.plays, 0)
+            OR COALESCE(b.skips, 0) <> COALESCE(a.skips, 0)
+    """).fetchone()[0]
+
+
+def summarize_plan(con: duckdb.DuckDBPyConnection) -> list[tuple]:
+    """ライブラリごとの（スナップショット数, 残す数, 区分別の残す数, 行数, 残す行数, 移す行数）"""
+    return con.execute(f"""
+        SELECT
+            s.library_id,
+            COUNT(*) AS snapshots,
+            COUNT(*) FILTER (WHERE s.keep) AS kept,
+            COUNT(*) FILTER (WHERE s.keep AND s.tier = '{TIER_DAILY}') AS kept_daily,
+            COUNT(*) FILTER (WHERE s.keep AND s.tier = '{TIER_WEEKLY}') AS kept_weekly,
+            COUNT(*) FILTER (WHERE s.keep AND s.tier = '{TIER_MONTHLY}') AS kept_monthly,
+            SUM(s.row_count) AS row_count,
+            SUM(s.row_count) FILTER (WHERE s.keep) + COALESCE(ANY_VALUE(m.moved), 0) AS kept_rows,
+            COALESCE(ANY_VALUE(m.moved), 0) AS moved_rows
+        FROM _retention_snapshots AS s
+        LEFT JOIN (
+            SELECT library_id, COUNT(*) AS moved FROM _retention_moves GROUP BY library_id
+        ) AS m
+            ON s.library_id = m.library_id
+        GROUP BY s.library_id
+        ORDER BY s.library_id
+    """).fetchall()
+
+
+def moved_rows_sql() -> str:
+    """移す行（移した先のスナップショット日・パス・track_idに置き換えたもの）"""
+    columns = ", ".join(
+        "m.target_track_id AS track_id" if name == "track_id" else f"r.{name}" for name in TRACK_FIELDS
+    )
+    return f"""
+        SELECT r.library_id, m.target_date AS snapshot_date, m.target_snapshot_path AS snapshot_path, {columns}
+        FROM _retention_source AS r
+        INNER JOIN _retention_moves AS m
+            ON r.library_id = m.library_id
+            AND r.snapshot_date = m.snapshot_date
+            AND r.persistent_id = m.persistent_id
+    """
+
+
+def dropped_snapshots(con: duckdb.DuckDBPyConnection) -> list[tuple]:
+    """間引く（library_id, snapshot_date）"""
+    return con.execute("""
+        SELECT library_id, snapshot_date FROM _retention_snapshots WHERE NOT keep ORDER BY ALL
+    """).fetchall()
+
+
+def apply_to_duckdb(con: duckdb.DuckDBPyConnection):
+    """raw_itunes_library に移す行を追加し、間引くスナップショットを削除する（1トランザクション）"""
+    columns = ", ".join(["library_id", "snapshot_date", "snapshot_path", *TRACK_FIELDS])
+    dropped = dropped_snapshots(con)
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"INSERT INTO {RAW_TABLE} ({columns}) {moved_rows_sql()}")
+        con.execute(f"""
+            DELETE FROM {RAW_TABLE} AS r
+            USING _retention_snapshots AS s
+            WHERE r.library_id = s.library_id
+                AND r.snapshot_date = s.snapshot_date
+                AND NOT s.keep
+        """)
+        mark_pruned(con, dropped)
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    con.execute("CHECKPOINT")
+
+
+def apply_to_lake(con: duckdb.DuckDBPyConnection, lake_dir: Path):
+    """移す行を受け取るパーティションを書き直し、間引くパーティションを削除する
+
+    書き直し → マニフェストの記録 → 削除の順なので、途中で止まっても再実行すれば同じ結果になる。
+    """
+    columns = ", ".join(["snapshot_path", *TRACK_FIELDS])
+    targets = con.execute("""
+        SELECT DISTINCT library_id, target_date FROM _retention_moves ORDER BY ALL
+    """).fetchall()
+    for library_id, target_date in targets:
+        path = snapshot_lake.partition_path(str(lake_dir), target_date, library_id)
+        # 読み手の glob（*.parquet）に掛からない名前で書いてから置き換える
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            con.execute(f"""
+                COPY (
+                    SELECT {columns} FROM read_parquet({quote_literal(str(path))})
+                    UNION ALL
+                    SELECT {columns} FROM ({moved_rows_sql()})
+                    WHERE library_id = ? AND snapshot_date = ?
+                ) TO {quote_literal(str(tmp_path))} (FORMAT parquet, COMPRESSION zstd)
+            """, [library_id, target_date])
+            os.replace(tmp_path, path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    dropped = dropped_snapshots(con)
+    manifest_db = snapshot_lake.manifest_path(str(lake_dir))
+    if manifest_db.exists():
+        with duckdb.connect(str(manifest_db)) as manifest_con:
+            mark_pruned(manifest_con, dropped)
+    for library_id, snapshot_date in dropped:
+        path = snapshot_lake.partition_path(str(lake_dir), snapshot_date, library_id)
+        path.unlink(missing_ok=True)
+        try:
+            path.parent.rmdir()
+        except OSError:
+            pass
+
+
+def rebuild_command(storage: str, lake_dir: Path) -> list[str]:
+    """モデルを作り直す dbt run --full-refresh のコマンド"""
+    dbt_vars = f"raw_storage: {storage}"
+    if storage == STORAGE_LAKE:
+        dbt_vars += f", raw_lake_path: '{lake_dir}'"
+    return ["dbt", "run", "--profiles-dir", ".", "--full-refresh", "--vars", f"{{{dbt_vars}}}"]
+
+
+def resolve(path: str) -> Path:
+    """相対パスはプロジェクトルートからのパスにする"""
+    path = Path(path).expanduser()
+    return path if path.is_absolute() else PROJECT_DIR / path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='古いスナップショットを間引いて日次→週次→月次の粒度にする')
+    parser.add_argument('--db', default=OUTPUT_DB, help='DuckDBファイルのパス')
+    parser.add_argument('--storage', choices=STORAGES, default=STORAGE_FULL, help=STORAGE_HELP)
+    parser.add_argument('--lake', default=snapshot_lake.LAKE_DIR,
+                        help='--storage lake のときのParquetレイクのディレクトリ')
+    parser.add_argument('--library', type=check_library_id,
+                        help='間引くライブラリID（省略時はすべてのライブラリ）')
+    parser.add_argument('--daily', type=int, default=DEFAULT_DAILY_DAYS,
+                        help=f'すべてのスナップショットを残す日数（省略時は {DEFAULT_DAILY_DAYS}）')
+    parser.add_argument('--weekly', type=int, default=DEFAULT_WEEKLY_DAYS,
+                        help=f'週ごと・月ごとに1つ残す日数。これより古いものは月ごとに1つ（省略時は {DEFAULT_WEEKLY_DAYS}）')
+    parser.add_argument('--dry-run', action='store_true', help='間引く内容を表示するだけにする')
+    parser.add_argument('--rebuild', action='store_true', help='間引いた後に dbt run --full-refresh を実行する')
+    args = parser.parse_args()
+
+    if args.storage == STORAGE_COMPACT:
+        print("エラー: compact形式は変化した行だけを保存しているため、間引きの対象外です")
+        sys.exit(1)
+    if not 0 < args.daily <= args.weekly:
+        print("エラー: 0 < --daily <= --weekly になるように指定してください")
+        sys.exit(1)
+
+    db_path = resolve(args.db)
+    lake_dir = resolve(args.lake)
+    if args.storage == STORAGE_LAKE:
+        print(f"レイク: {lake_dir}")
+        if not (lake_dir / RAW_TABLE).exists():
+            print(f"エラー: レイクが見つかりません: {lake_dir / RAW_TABLE}")
+            sys.exit(1)
+        snapshot_lake.migrate_legacy_partitions(str(lake_dir))
+        con = duckdb.connect()
+        source_sql = lake_source_sql(lake_dir)
+    else:
+        print(f"DBファイル: {db_path}")
+        if not db_path.exists():
+            print(f"エラー: ファイルが見つかりません: {db_path}")
+            sys.exit(1)
+        con = duckdb.connect(str(db_path), read_only=args.dry_run)
+        source_sql = f"SELECT * FROM {RAW_TABLE}"
+    print(f"保持: {args.daily}日未満はすべて / {args.weekly}日未満は週・月ごと / それより古いものは月ごと")
+
+    plan_retention(con, source_sql, args.daily, args.weekly, args.library)
+    summary = summarize_plan(con)
+    if not summary:
+        print("スナップショットがありません")
+        return
+    for (library_id, snapshots, kept, kept_daily, kept_weekly, kept_monthly,
+         row_count, kept_rows, moved_rows) in summary:
+        print(f"  {library_id}: {snapshots} → {kept} snapshots "
+              f"(daily {kept_daily} / weekly {kept_weekly} / monthly {kept_monthly}), "
+              f"{row_count} → {kept_rows} rows ({moved_rows} moved)")
+
+    mismatches = verify_plan(con)
+    if mismatches:
+        print(f"エラー: 間引くと {mismatches} 件のトラック・区間で再生数の差分が変わるため中止しました")
+        sys.exit(1)
+    print("確認: 残す区間ごとの再生数・スキップ数の差分は間引く前と一致します")
+
+    if all(snapshots == kept for _, snapshots, kept, *_ in summary):
+        print("間引くスナップショットはありません")
+        return
+    if args.dry_run:
+        return
+
+    if args.storage == STORAGE_LAKE:
+        apply_to_lake(con, lake_dir)
+    else:
+        apply_to_duckdb(con)
+    con.close()
+    print("間引きました")
+
+    command = rebuild_command(args.storage, lake_dir)
+    if not args.rebuild:
+        print(f"モデルを作り直すには {shlex.join(command)} を実行してください")
+        return
+    print(f"Running: {shlex.join(command)}")
+    sys.exit(subprocess.run(command, cwd=PROJECT_DIR).returncode)
+
+
+if __name__ == "__main__":
+    main()
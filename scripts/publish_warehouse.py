@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+publish_warehouse.py
+gold/platinumを読み取り専用のDuckDBファイルとして公開する
+
+music_replay.duckdb（ローダーと dbt run が書き込む）→ published/music_replay.duckdb
+
+1. 公開先と同じディレクトリの一時ファイルに新しいDuckDBを作り、ウェアハウスを READ_ONLY でATTACHする
+   （dbtのビューはDB名で修飾されているので、ウェアハウスはファイル名と同じ名前でATTACHする）
+2. gold（dim_* / fact_*）とplatinum（platinum_*）を、ビューも含めてテーブルとしてコピーする
+   ライブラリ・日付・順位の順に並べて書くので、読み取り側はゾーンマップで行グループを読み飛ばせる
+   replay_server.py / replay_query.py が使う bronze_snapshots・load_audit とReplay用のテーブルマクロもコピーする
+3. CHECKPOINTして閉じ、fsyncしてから os.replace で公開ファイルと入れ替える
+
+BIツールやノートブックは公開ファイルを read_only で開く。ビューの計算は公開時に1回だけ行われ、
+次の dbt run の書き込みロックを妨げない。入れ替える前から開いている接続は前のビルドを読み続け、
+新しく開いた接続は新しいビルドを読む。dbt run が成功したあとに実行する
+（watch_snapshots.py --publish ではdbtの実行後に自動で公開する）。
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import duckdb
+
+
+OUTPUT_DB = "music_replay.duckdb"
+PUBLISH_DB = "published/music_replay.duckdb"
+
+# 公開するテーブル・ビュー（LIKEのパターン）
+PUBLISH_PATTERNS = ("dim\\_%", "fact\\_%", "platinum\\_%")
+# replay_server.py / replay_query.py が参照するテーブル
+SUPPORT_TABLES = ("bronze_snapshots", "load_audit")
+# 公開に必要なテーブル（なければ dbt run がまだ）
+REQUIRED_TABLES = ("bronze_snapshots", "dim_period", "fact_play_count_snapshot", "platinum_summary")
+
+# 並べ替えに使う列（テーブルにある列だけをこの順で使う）
+SORT_COLUMNS = ("library_id", "period_type", "period_start", "snapshot_date", "play_date", "rank")
+
+MACRO_PREFIX = "replay\\_%"
+
+
+def quote_literal(value: str) -> str:
+    """SQLの文字列リテラル"""
+    return "'" + value.replace("'", "''") + "'"
+
+
+def list_relations(con: duckdb.DuckDBPyConnection, catalog: str) -> list[str]:
+    """公開するテーブル・ビューの名前"""
+    patterns = " OR ".join(f"table_name LIKE '{pattern}' ESCAPE '\\'" for pattern in PUBLISH_PATTERNS)
+    rows = con.execute(f"""
+        SELECT table_name
+        FROM information_schema.tables
+        WHERE table_catalog = ? AND table_schema = 'main'
+            AND ({patterns} OR table_name IN ({", ".join(quote_literal(t) for t in SUPPORT_TABLES)}))
+        ORDER BY table_name
+    """, [catalog]).fetchall()
+    return [row[0] for row in rows]
+
+
+def copy_relation(con: duckdb.DuckDBPyConnection, catalog: str, name: str) -> int:
+    """ウェアハウスのテーブル・ビューを並べ替えたテーブルとしてコピーし、行数を返す"""
+    columns = {
+        row[0] for row in con.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_catalog = ? AND table_schema = 'main' AND table_name = ?
+        """, [catalog, name]).fetchall()
+    }
+    order = [column for column in SORT_COLUMNS if column in columns]
+    order_by = f"ORDER BY {', '.join(order)}" if order else ""
+    con.execute(f"CREATE TABLE publish.main.{name} AS SELECT * FROM {catalog}.main.{name} {order_by}")
+    return con.execute(f"SELECT COUNT(*) FROM publish.main.{name}").fetchone()[0]
+
+
+def copy_macros(con: duckdb.DuckDBPyConnection, catalog: str) -> list[str]:
+    """Replay用のテーブルマクロ（replay_top_songs など）を作り直す"""
+    rows = con.execute(f"""
+        SELECT function_name, parameters, macro_definition
+        FROM duckdb_functions()
+        WHERE database_name = ? AND function_type = 'table_macro'
+            AND function_name LIKE '{MACRO_PREFIX}' ESCAPE '\\'
+        ORDER BY function_name
+    """, [catalog]).fetchall()
+    # マクロ本体の main.* は公開ファイルのテーブルを指すようにする
+    con.execute("USE publish")
+    for name, parameters, definition in rows:
+        con.execute(f"CREATE MACRO publish.main.{name}({', '.join(parameters)}) AS TABLE {definition}")
+    return [row[0] for row in rows]
+
+
+def publish(db_path: Path, publish_path: Path) -> list[tuple[str, int]]:
+    """公開用のDuckDBファイルを作って入れ替え、コピーした（テーブル, 行数）を返す"""
+    publish_path.parent.mkdir(parents=True, exist_ok=True)
+    # 読み取り側が開かない名前（.で始まる）で書き、完成してから入れ替える
+    tmp_path = publish_path.with_name(f".{publish_path.name}.{os.getpid()}.tmp")
+    tmp_wal = tmp_path.with_name(tmp_path.name + ".wal")
+    catalog = db_path.stem
+    try:
+        con = duckdb.connect()
+        try:
+            con.execute(f"ATTACH {quote_literal(str(tmp_path))} AS publish")
+            con.execute(f"ATTACH {quote_literal(str(db_path))} AS {catalog} (READ_ONLY)")
+            relations = list_relations(con, catalog)
+            missing = [name for name in REQUIRED_TABLES if name not in relations]
+            if missing:
+                raise RuntimeError(f"{', '.join(missing)} がありません。先に dbt run を実行してください")
+
+            copied = [(name, copy_relation(con, catalog, name)) for name in relations]
+            macros = copy_macros(con, catalog)
+            con.execute("""
+                CREATE TABLE publish.main.publish_info AS
+                SELECT
+                    now()::TIMESTAMP AS published_at,
+                    ? AS source_path,
+                    (SELECT MAX(snapshot_date) FROM publish.main.bronze_snapshots) AS latest_snapshot_date,
+                    ? AS table_count,
+                    ? AS macro_count
+            """, [str(db_path), len(copied), len(macros)])
+            con.execute(f"DETACH {catalog}")
+            con.execute("CHECKPOINT publish")
+            con.execute("USE memory")
+            con.execute("DETACH publish")
+        finally:
+            con.close()
+
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        # 公開ファイルは読み取り専用にする
+        tmp_path.chmod(0o444)
+        os.replace(tmp_path, publish_path)
+        dir_fd = os.open(publish_path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        tmp_wal.unlink(missing_ok=True)
+        raise
+    return copied
+
+
+def resolve(path: str) -> Path:
+    """相対パスはプロジェクトルートからのパスにする"""
+    path = Path(path).expanduser()
+    return path if path.is_absolute() else Path(__file__).parent.parent / path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='gold/platinumを読み取り専用のDuckDBファイルとして公開')
+    parser.add_argument('--db', default=OUTPUT_DB, help='DuckDBファイルのパス')
+    parser.add_argument('--output', default=PUBLISH_DB, help=f'公開するDuckDBファイルのパス（省略時は {PUBLISH_DB}）')
+    args = parser.parse_args()
+
+    db_path = resolve(args.db)
+    publish_path = resolve(args.output)
+    if not db_path.exists():
+        print(f"エラー: ファイルが見つかりません: {db_path}")
+        sys.exit(1)
+    if publish_path.resolve() == db_path.resolve():
+        print("エラー: --output にウェアハウスと同じファイルは指定できません")
+        sys.exit(1)
+
+    print(f"DBファイル: {db_path}")
+    print(f"公開先: {publish_path}")
+    started = time.perf_counter()
+    try:
+        copied = publish(db_path, publish_path)
+    except (duckdb.Error, RuntimeError, OSError) as e:
+        print(f"エラー: {e}")
+        sys.exit(1)
+
+    for name, rows in copied:
+        print(f"  {name}: {rows} rows")
+    print(f"Published {len(copied)} tables at {datetime.now():%Y-%m-%d %H:%M:%S} "
+          f"in {time.perf_counter() - started:.1f}s ({publish_path.stat().st_size / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+replay_query.py
+任意の期間（年・月・週）のReplayを問い合わせる
+
+dim_period からライブラリの期間を挟むスナップショット日を引き、
+dbt run の on-run-end で作成した replay_* マクロを呼ぶ。
+"""
+
+import sys
+import argparse
+import duckdb
+from pathlib import Path
+from datetime import date
+
+from ingest import DEFAULT_LIBRARY_ID, LIBRARY_HELP, check_library_id
+
+PERIOD_TYPES = ["year", "month", "week"]
+
+REPORTS = {
+    "summary": "replay_summary",
+    "songs": "replay_top_songs",
+    "artists": "replay_top_artists",
+    "albums": "replay_top_albums",
+}
+
+
+def find_period(con: duckdb.DuckDBPyConnection, library_id: str, period_type: str,
+                period_date: date | None) -> tuple | None:
+    """ライブラリの期間の行（period_start, period_end, start_snapshot_date, end_snapshot_date）を取得
+
+    period_date を省略するとライブラリの最新スナップショットを含む期間を返す。
+    """
+    if period_date is None:
+        return con.execute("""
+            SELECT period_start, period_end, start_snapshot_date, end_snapshot_date
+            FROM dim_period
+            WHERE library_id = ?
+                AND period_type = ?
+                AND end_snapshot_date IS NOT NULL
+            ORDER BY end_snapshot_date DESC, period_start DESC
+            LIMIT 1
+        """, [library_id, period_type]).fetchone()
+    return con.execute("""
+        SELECT period_start, period_end, start_snapshot_date, end_snapshot_date
+        FROM dim_period
+        WHERE library_id = ?
+            AND period_type = ?
+            AND period_start = CAST(date_trunc(?, CAST(? AS DATE)) AS DATE)
+    """, [library_id, period_type, period_type, period_date]).fetchone()
+
+
+def query_report(con: duckdb.DuckDBPyConnection, report: str, library_id: str,
+                 start_snapshot_date: date | None, end_snapshot_date: date,
+                 limit: int) -> duckdb.DuckDBPyRelation:
+    """ライブラリの期間のレポートを取得
+
+    ライブラリIDとスナップショット日を定数で埋め込み、fact_play_count_snapshot の
+    ゾーンマップで他のライブラリと期間外の行グループを読み飛ばせるようにする。
+    """
+    start = f"DATE '{start_snapshot_date}'" if start_snapshot_date else "NULL"
+    sql = (f"SELECT * FROM {REPORTS[report]}('{check_library_id(library_id)}', {start}, "
+           f"DATE '{end_snapshot_date}')")
+    if report != "summary":
+        sql += f" LIMIT {int(limit)}"
+    return con.sql(sql)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='任意の期間のReplayを表示')
+    parser.add_argument('report', choices=list(REPORTS), help='表示するレポート')
+    parser.add_argument('--library', type=check_library_id, default=DEFAULT_LIBRARY_ID, help=LIBRARY_HELP)
+    parser.add_argument('--period', choices=PERIOD_TYPES, default='year', help='期間の単位')
+    parser.add_argument('--date', type=date.fromisoformat,
+                        help='期間内の任意の日付（YYYY-MM-DD、省略時は最新スナップショットを含む期間）')
+    parser.add_argument('--limit', type=int, default=20, help='ランキングの表示件数')
+    parser.add_argument('--db', default='music_replay.duckdb', help='DuckDBファイルのパス')
+    args = parser.parse_args()
+
+    # DBファイルのパスを解決
+    db_path = Path(args.db)
+    if not db_path.is_absolute():
+        db_path = Path(__file__).parent.parent / args.db
+    if not db_path.exists():
+        print(f"エラー: ファイルが見つかりません: {db_path}")
+        sys.exit(1)
+
+    con = duckdb.connect(str(db_path), read_only=True)
+    try:
+        period = find_period(con, args.library, args.period, args.date)
+    except duckdb.CatalogException:
+        print("エラー: dim_period がありません。先に dbt run を実行してください")
+        sys.exit(1)
+    if period is None or period[3] is None:
+        print("エラー: 指定した期間のスナップショットがありません")
+        sys.exit(1)
+
+    period_start, period_end, start_snapshot_date, end_snapshot_date = period
+    print(f"ライブラリ: {args.library}")
+    print(f"期間: {period_start} - {period_end}（{args.period}）")
+    print(f"スナップショット: {start_snapshot_date or '最初'} → {end_snapshot_date}")
+    query_report(con, args.report, args.library, start_snapshot_date, end_snapshot_date, args.limit).show()
+    con.close()
+
+
+if __name__ == "__main__":
+    main()
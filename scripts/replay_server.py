@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+replay_server.py
+Replayの結果を返すローカルHTTPサービス（結果はメモリにキャッシュ）
+
+エンドポイント（GET、?format=json|arrow、ランキングは ?limit=N、ライブラリは ?library=ID）:
+    /summary /songs /artists /albums         全期間（platinum_* ビュー、?library を省略したら全ライブラリ）
+    /period/{summary|songs|artists|albums}    期間別（?period=year|month|week&date=YYYY-MM-DD、
+                                              ?library を省略したら default）
+    /version                                  現在のウェアハウスのバージョン
+
+結果はウェアハウスのバージョン（bronze_snapshots のライブラリごとの最新スナップショット日・
+スナップショット数・トラック数 + load_audit の最新の実行ID + dbtの最後の実行の invocation_id）を
+キーにキャッシュする。dbt run で作り直した結果も、既存の日付の再ロードや別のライブラリの追加も、
+いずれかが変わるのでキャッシュが捨てられる。
+リクエストごとにDBファイル・WALファイル・target/run_results.json のstatだけを確認し、
+変化がなければDuckDBを開かずにメモリから返す。変化していればバージョンを読み直し、
+変わっていればキャッシュを捨てる。キャッシュは最近使った順に --cache-size 件まで残す。
+
+読み取り専用の接続は1つだけを使い回し、--idle 秒使われなければ閉じる
+（ローダーや dbt run が書き込みロックを取れるようにするため）。
+書き込み中でDBを開けないときは、キャッシュがあれば古い結果を返す。
+"""
+
+import argparse
+import io
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import duckdb
+import pyarrow as pa
+
+from ingest import DEFAULT_LIBRARY_ID, check_library_id
+from replay_query import PERIOD_TYPES, REPORTS, find_period, query_report
+
+
+# 全期間のレポート（/summary など）のビュー
+PLATINUM_VIEWS = {
+    "summary": "platinum_summary",
+    "songs": "platinum_top_songs",
+    "artists": "platinum_top_artists",
+    "albums": "platinum_top_albums",
+}
+
+FORMATS = {
+    "json": "application/json; charset=utf-8",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 1000
+
+
+class ReplayError(Exception):
+    """リクエストに対するエラー（HTTPステータス付き）"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def json_default(value):
+    """JSONに変換できない値（日付・SUMの結果のDECIMALなど）"""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return str(value)
+
+
+def encode(table: pa.Table, fmt: str) -> bytes:
+    """Arrowテーブルをレスポンスの本文にする"""
+    if fmt == "arrow":
+        sink = io.BytesIO()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue()
+    return json.dumps(table.to_pylist(), ensure_ascii=False, default=json_default).encode()
+
+
+class ReplayService:
+    """バージョン付きキャッシュと、使い回す読み取り専用接続"""
+
+    def __init__(self, db_path: Path, idle_seconds: float, cache_size: int, run_results_path: Path):
+        self.db_path = db_path
+        self.wal_path = db_path.with_name(db_path.name + ".wal")
+        self.run_results_path = run_results_path
+        self.idle_seconds = idle_seconds
+        self.cache_size = cache_size
+        self.cache: OrderedDict[tuple, tuple[bytes, str]] = OrderedDict()
+        self.version: tuple | None = None
+        self.file_state: tuple | None = None
+        self.con: duckdb.DuckDBPyConnection | None = None
+        self.last_used = 0.0
+        self.lock = threading.RLock()
+
+    def _stat_files(self) -> tuple:
+        """DBファイル・WALファイル・run_results.json の（サイズ, mtime）"""
+        state = []
+        for path in (self.db_path, self.wal_path, self.run_results_path):
+            try:
+                st = path.stat()
+                state.append((st.st_size, st.st_mtime_ns))
+            except FileNotFoundError:
+                state.append(None)
+        return tuple(state)
+
+    def _connect(self) -> duckdb.DuckDBPyConnection:
+        """読み取り専用の接続（なければ開く）。lock を取ってから呼ぶ"""
+        if self.con is None:
+            try:
+                self.con = duckdb.connect(str(self.db_path), read_only=True)
+            except duckdb.IOException as e:
+                raise ReplayError(503, f"ウェアハウスを開けません（書き込み中の可能性があります）: {e}")
+        self.last_used = time.monotonic()
+        return self.con
+
+    def close_if_idle(self):
+        """--idle 秒使われていない接続を閉じる"""
+        with self.lock:
+            if self.con is not None and time.monotonic() - self.last_used >= self.idle_seconds:
+                self.con.close()
+                self.con = None
+
+    def _read_dbt_invocation(self) -> str | None:
+        """dbtの最後の実行の invocation_id（run_results.json がなければNone）"""
+        try:
+            return json.loads(self.run_results_path.read_text())["metadata"]["invocation_id"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def _read_version(self, con: duckdb.DuckDBPyConnection) -> tuple:
+        """（最新スナップショット日, 最後のロードの実行ID, ライブラリごとの状態, dbtの invocation_id）"""
+        # dbt run で作り直されるbronze_snapshotsのライブラリごとの集計（ライブラリの追加・再ロードで変わる）
+        libraries = tuple(con.execute("""
+            SELECT library_id, MAX(snapshot_date), COUNT(*), SUM(track_count)
+            FROM bronze_snapshots
+            GROUP BY library_id
+            ORDER BY library_id
+        """).fetchall())
+        latest = max((row[1] for row in libraries), default=None)
+        try:
+            last_load = con.execute("""
+                SELECT run_id FROM load_audit ORDER BY finished_at DESC NULLS LAST LIMIT 1
+            """).fetchone()
+        except duckdb.CatalogException:
+            # lake形式の load_audit はレイク側にある
+            last_load = None
+        return latest, last_load[0] if last_load else None, libraries, self._read_dbt_invocation()
+
+    def current_version(self) -> tuple | None:
+        """ファイルが変わっていればバージョンを読み直し、変わっていればキャッシュを捨てる"""
+        file_state = self._stat_files()
+        if file_state == self.file_state:
+            return self.version
+        with self.lock:
+            if file_state == self.file_state:
+                return self.version
+            # 開き直さないと他のプロセスの書き込みが見えない
+            if self.con is not None:
+                self.con.close()
+                self.con = None
+            try:
+                version = self._read_version(self._connect())
+            except ReplayError:
+                if self.version is None:
+                    raise
+                # 書き込み中は前のバージョンのまま返す（file_stateは更新しない）
+                return self.version
+            except duckdb.CatalogException:
+                raise ReplayError(503, "bronze_snapshots がありません。先に dbt run を実行してください")
+            if version != self.version:
+                self.cache.clear()
+                self.version = version
+            self.file_state = file_state
+            return self.version
+
+    def get(self, route: str, params: dict[str, str]) -> tuple[bytes, str, bool]:
+        """（本文, Content-Type, キャッシュから返したか）"""
+        fmt = params.get("format", "json")
+        if fmt not in FORMATS:
+            raise ReplayError(400, f"format は {', '.join(FORMATS)} のいずれかです")
+        version = self.current_version()
+        if route == "version":
+            body = {
+                "latest_snapshot_date": version[0],
+                "last_load_run_id": version[1],
+                "libraries": [
+                    {"library_id": library_id, "latest_snapshot_date": latest, "snapshots": snapshots,
+                     "tracks": tracks}
+                    for library_id, latest, snapshots, tracks in version[2]
+                ],
+                "dbt_invocation_id": version[3],
+            }
+            return json.dumps(body, default=json_default).encode(), FORMATS["json"], False
+
+        key = (route, tuple(sorted(params.items())))
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached is not None:
+                # 最近使った結果を後ろに回す（あふれたら先頭＝最も長く使われていない結果から捨てる）
+                self.cache.move_to_end(key)
+                return cached[0], cached[1], True
+
+        with self.lock:
+            table = self._query(self._connect(), route, params)
+            body = encode(table, fmt)
+            self.cache[key] = (body, FORMATS[fmt])
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return body, FORMATS[fmt], False
+
+    def _query(self, con: duckdb.DuckDBPyConnection, route: str, params: dict[str, str]) -> pa.Table:
+        """ルートに対応するレポートを実行する"""
+        try:
+            limit = int(params.get("limit", DEFAULT_LIMIT))
+        except ValueError:
+            raise ReplayError(400, "limit は整数で指定してください")
+        limit = max(1, min(limit, MAX_LIMIT))
+        library_id = params.get("library")
+        if library_id is not None:
+            try:
+                check_library_id(library_id)
+            except ValueError as e:
+                raise ReplayError(400, str(e))
+
+        if route in PLATINUM_VIEWS:
+            sql = f"SELECT * FROM {PLATINUM_VIEWS[route]}"
+            if library_id is not None:
+                sql += f" WHERE library_id = '{library_id}'"
+            if route == "summary":
+                sql += " ORDER BY library_id"
+            else:
+                # ランキングの件数はライブラリごと
+                sql += (f" QUALIFY ROW_NUMBER() OVER (PARTITION BY library_id ORDER BY rank) <= {limit}"
+                        " ORDER BY library_id, rank")
+            return con.sql(sql).arrow().read_all()
+
+        report = route.removeprefix("period/")
+        if route.startswith("period/") and report in REPORTS:
+            period_type = params.get("period", "year")
+            if period_type not in PERIOD_TYPES:
+                raise ReplayError(400, f"period は {', '.join(PERIOD_TYPES)} のいずれかです")
+            try:
+                period_date = date.fromisoformat(params["date"]) if "date" in params else None
+            except ValueError:
+                raise ReplayError(400, "date は YYYY-MM-DD で指定してください")
+            library_id = library_id or DEFAULT_LIBRARY_ID
+            period = find_period(con, library_id, period_type, period_date)
+            if period is None or period[3] is None:
+                raise ReplayError(404, "指定した期間のスナップショットがありません")
+            period_start, period_end, start_snapshot_date, end_snapshot_date = period
+            table = query_report(con, report, library_id, start_snapshot_date, end_snapshot_date,
+                                 limit).arrow().read_all()
+            # どの期間の結果かわかるよう、library_id の後ろに期間の列を付ける
+            for i, (name, value) in enumerate([("period_type", period_type),
+                                               ("period_start", period_start),
+                                               ("period_end", period_end)], start=1):
+                table = table.add_column(i, name, pa.array([value] * table.num_rows))
+            return table
+
+        raise ReplayError(404, f"不明なパスです: /{route}")
+
+
+class ReplayRequestHandler(BaseHTTPRequestHandler):
+    """GETリクエストを ReplayService に渡す"""
+
+    service: ReplayService
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            body, content_type, hit = self.service.get(url.path.strip("/"), params)
+            status = 200
+        except ReplayError as e:
+            body = json.dumps({"error": str(e)}, ensure_ascii=False).encode()
+            content_type, hit, status = FORMATS["json"], False, e.status
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Cache", "hit" if hit else "miss")
+        if status == 503:
+            self.send_header("Retry-After", "5")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replayの結果を返すローカルHTTPサービス')
+    parser.add_argument('--db', default='music_replay.duckdb', help='DuckDBファイルのパス')
+    parser.add_argument('--host', default='127.0.0.1', help='待ち受けるアドレス')
+    parser.add_argument('--port', type=int, default=8765, help='待ち受けるポート')
+    parser.add_argument('--idle', type=float, default=2.0,
+                        help='この秒数使われなければDuckDBの接続を閉じる')
+    parser.add_argument('--cache-size', type=int, default=256, help='キャッシュする結果の数')
+    parser.add_argument('--target', default='target',
+                        help='dbtの target ディレクトリ（run_results.json でdbtの実行を検知する）')
+    parser.add_argument('--quiet', action='store_true', help='アクセスログを出さない')
+    args = parser.parse_args()
+
+    # DBファイルのパスを解決
+    db_path = Path(args.db)
+    if not db_path.is_absolute():
+        db_path = Path(__file__).parent.parent / args.db
+    if not db_path.exists():
+        print(f"エラー: ファイルが見つかりません: {db_path}")
+        sys.exit(1)
+
+    target_dir = Path(args.target)
+    if not target_dir.is_absolute():
+        target_dir = Path(__file__).parent.parent / args.target
+
+    service = ReplayService(db_path, args.idle, args.cache_size, target_dir / "run_results.json")
+    ReplayRequestHandler.service = service
+    server = ThreadingHTTPServer((args.host, args.port), ReplayRequestHandler)
+    server.quiet = args.quiet
+
+    def close_idle_connection():
+        while True:
+            time.sleep(1)
+            service.close_if_idle()
+
+    threading.Thread(target=close_idle_connection, daemon=True).start()
+    print(f"Serving {db_path} on http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
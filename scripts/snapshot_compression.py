@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+snapshot_compression.py
+圧縮されたスナップショット（.gz / .zst）の読み込み
+
+music-library.xml.gz のようなファイルを、展開済みのコピーを作らずに
+ストリームのままパーサーに渡す。.zst は zstandard パッケージがあるときだけ使える。
+"""
+
+import gzip
+import io
+from pathlib import Path
+from typing import BinaryIO
+
+from load_audit import LoadAudit, open_source
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+GZIP_SUFFIX = ".gz"
+ZSTD_SUFFIX = ".zst"
+COMPRESSED_SUFFIXES = (GZIP_SUFFIX, ZSTD_SUFFIX)
+
+# 展開したストリームを読むときのバッファサイズ
+READ_BUFFER_SIZE = 1 << 20
+
+
+def compression_of(path: str | Path) -> str | None:
+    """圧縮形式の拡張子（.gz / .zst）。圧縮されていなければNone"""
+    suffix = Path(path).suffix.lower()
+    return suffix if suffix in COMPRESSED_SUFFIXES else None
+
+
+def snapshot_format(path: str | Path) -> str:
+    """圧縮の拡張子を除いた形式（.xml / .csv）"""
+    path = Path(path)
+    if compression_of(path):
+        path = path.with_suffix("")
+    return path.suffix.lower()
+
+
+def require_zstandard():
+    """.zst を扱うのに zstandard が必要"""
+    if zstandard is None:
+        raise RuntimeError(".zst のファイルを扱うには zstandard が必要です（pip install zstandard）")
+
+
+class _DecompressedReader(io.RawIOBase):
+    """展開ストリームと元のファイルをまとめて閉じる"""
+
+    def __init__(self, stream: BinaryIO, source: BinaryIO):
+        self.stream = stream
+        self.source = source
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        return self.stream.readinto(buffer)
+
+    def close(self):
+        if not self.closed:
+            self.stream.close()
+            self.source.close()
+        super().close()
+
+
+def open_snapshot(path: str | Path, audit: LoadAudit | None = None) -> BinaryIO:
+    """スナップショットをバイナリで開く（圧縮されていればストリームで展開する）
+
+    auditがあれば、圧縮されたままのファイルを読む時間を read ステージとして計測する
+    （展開の時間は呼び出し側の parse ステージに入る）。
+    """
+    codec = compression_of(path)
+    if codec == ZSTD_SUFFIX:
+        require_zstandard()
+    source = open_source(audit, str(path))
+    if codec is None:
+        return source
+    try:
+        if codec == GZIP_SUFFIX:
+            stream = gzip.GzipFile(fileobj=source, mode="rb")
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(source, closefd=False)
+    except BaseException:
+        source.close()
+        raise
+    return io.BufferedReader(_DecompressedReader(stream, source), READ_BUFFER_SIZE)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+snapshot_lake.py
+スナップショットをHiveパーティションのParquetレイクに書き出す
+
+レイクの構成:
+    {lake_dir}/raw_itunes_library/library_id={ライブラリID}/snapshot_date=YYYY-MM-DD/data.parquet
+
+ライブラリ・スナップショットごとに1ファイル。同じディレクトリに一時ファイルを書いてから
+os.replace で置き換えるため、読み手が書きかけのファイルを見ることはない。
+DuckDBファイルのロックを取らないので、ロード中も dbt run や分析を実行できる。
+"""
+
+import os
+from datetime import date, datetime
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ingest import DEFAULT_LIBRARY_ID, RAW_TABLE, TRACK_SCHEMA
+from load_audit import LoadAudit, audit_stage
+
+
+LAKE_DIR = "data/lake"
+LAKE_FILE_NAME = "data.parquet"
+
+# レイクでは library_id と snapshot_date はパーティション（ディレクトリ名）で持つ
+LAKE_SCHEMA = pa.schema([("snapshot_path", pa.string())] + list(TRACK_SCHEMA))
+
+# 同じレイクのロード済みスナップショットのマニフェストとロード記録（レイクのルートに置く）
+LAKE_MANIFEST_DB = "snapshot_manifest.duckdb"
+
+
+def manifest_path(lake_dir: str) -> Path:
+    """レイクのマニフェストDB（load_audit もここに記録する）"""
+    return Path(lake_dir) / LAKE_MANIFEST_DB
+
+
+def partition_path(lake_dir: str, snapshot_date: date, library_id: str = DEFAULT_LIBRARY_ID) -> Path:
+    """ライブラリ・スナップショット日のParquetファイルのパス"""
+    return (Path(lake_dir) / RAW_TABLE / f"library_id={library_id}"
+            / f"snapshot_date={snapshot_date.isoformat()}" / LAKE_FILE_NAME)
+
+
+def migrate_legacy_partitions(lake_dir: str):
+    """library_id のパーティションがなかった頃の snapshot_date=*/ を library_id=default/ の下に移す"""
+    root = Path(lake_dir) / RAW_TABLE
+    legacy = sorted(root.glob("snapshot_date=*")) if root.exists() else []
+    if not legacy:
+        return
+    target = root / f"library_id={DEFAULT_LIBRARY_ID}"
+    target.mkdir(exist_ok=True)
+    for path in legacy:
+        os.replace(path, target / path.name)
+
+
+def write_snapshot(lake_dir: str, snapshot_date: datetime,
+                   snapshot_path: str, table: pa.Table, audit: LoadAudit | None = None,
+                   library_id: str = DEFAULT_LIBRARY_ID) -> int:
+    """1ライブラリの1スナップショット分のParquetファイルを書き出し、既存のファイルと置き換える
+
+    他のライブラリのパーティションには触れない。
+    """
+    migrate_legacy_partitions(lake_dir)
+    path = partition_path(lake_dir, snapshot_date.date(), library_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    paths = pa.array([snapshot_path] * table.num_rows, type=pa.string())
+    table = table.add_column(0, LAKE_SCHEMA.field("snapshot_path"), paths)
+
+    # 読み手の glob（*.parquet）に掛からない名前で書いてから置き換える
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with audit_stage(audit, "insert"):
+            pq.write_table(table, tmp_path, compression="zstd")
+        with audit_stage(audit, "commit"):
+            os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return table.num_rows
+
+
+def copy_snapshot(lake_dir: str, snapshot_date: datetime,
+                  snapshot_path: str, source_date: date, audit: LoadAudit | None = None,
+                  library_id: str = DEFAULT_LIBRARY_ID) -> int:
+    """内容が同一のスナップショットを同じライブラリの既存のParquetファイルからコピーする（パースしない）"""
+    migrate_legacy_partitions(lake_dir)
+    source = partition_path(lake_dir, source_date, library_id)
+    if not source.exists():
+        return 0
+    with audit_stage(audit, "read"):
+        table = pq.read_table(source, schema=LAKE_SCHEMA).drop_columns(["snapshot_path"])
+    return write_snapshot(lake_dir, snapshot_date, snapshot_path, table, audit, library_id)
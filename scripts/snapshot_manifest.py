@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+snapshot_manifest.py
+ロード済みスナップショットのマニフェスト
+
+ソースパスごとにサイズ・mtime・inode・内容ハッシュを記録し、
+再実行時に変更のないファイルや同一内容のファイルを再パースしないようにする。
+ライブラリファイルが無かったバックアップもバックアップのパスで記録し、
+次回以降は探索自体を省略する。
+prune_snapshots.py で間引いたスナップショットは pruned として残し、ロードし直さない
+（同一内容のコピー元にも使わない）。
+記録はライブラリ（library_id）ごとに分かれ、同一内容のコピー元も同じライブラリから探す。
+archive_snapshots.py で圧縮したファイルは、圧縮後のパスとstatに記録を書き換える（内容ハッシュは同じ）。
+"""
+
+import hashlib
+import os
+from datetime import date, datetime
+
+import duckdb
+
+from ingest import DEFAULT_LIBRARY_ID, create_library_table
+from snapshot_compression import open_snapshot
+
+
+MANIFEST_TABLE = "snapshot_manifest"
+
+STATUS_LOADED = "loaded"
+STATUS_MISSING = "missing"
+STATUS_PRUNED = "pruned"
+# ロード済みとして扱う（再パースしない）状態
+DONE_STATUSES = (STATUS_LOADED, STATUS_PRUNED)
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def create_manifest_if_not_exists(con: duckdb.DuckDBPyConnection):
+    """マニフェストテーブルを作成"""
+    create_library_table(con, MANIFEST_TABLE, f"""
+        CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+            library_id VARCHAR NOT NULL,
+            source_path VARCHAR NOT NULL,
+            status VARCHAR NOT NULL,
+            backup_date TIMESTAMP,
+            snapshot_date DATE,
+            file_size BIGINT,
+            mtime_ns BIGINT,
+            inode BIGINT,
+            content_hash VARCHAR,
+            track_count INTEGER,
+            recorded_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (library_id, source_path)
+        )
+    """)
+
+
+def mark_pruned(con: duckdb.DuckDBPyConnection, snapshots: list[tuple[str, date]]):
+    """間引いた（library_id, snapshot_date）のロード済みの記録を pruned にする"""
+    create_manifest_if_not_exists(con)
+    con.executemany(f"""
+        UPDATE {MANIFEST_TABLE}
+        SET status = ?
+        WHERE library_id = ? AND snapshot_date = ? AND status = ?
+    """, [(STATUS_PRUNED, library_id, snapshot_date, STATUS_LOADED) for library_id, snapshot_date in snapshots])
+
+
+def rename_source(con: duckdb.DuckDBPyConnection, old_path: str, new_path: str, st: os.stat_result) -> int:
+    """ファイルの置き換え（圧縮など）に合わせて記録のパスとstatを書き換え、書き換えた件数を返す"""
+    create_manifest_if_not_exists(con)
+    return con.execute(f"""
+        UPDATE {MANIFEST_TABLE}
+        SET source_path = ?, file_size = ?, mtime_ns = ?, inode = ?
+        WHERE source_path = ?
+    """, [new_path, st.st_size, st.st_mtime_ns, st.st_ino, old_path]).fetchone()[0]
+
+
+def hash_file(path: str) -> str:
+    """ファイル内容のSHA-256（圧縮ファイルは展開した内容のハッシュ）"""
+    digest = hashlib.sha256()
+    with open_snapshot(path) as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SnapshotManifest:
+    """1ライブラリ分のマニフェストをメモリに読み込み、スキップ判定と記録を行う"""
+
+    def __init__(self, con: duckdb.DuckDBPyConnection, library_id: str = DEFAULT_LIBRARY_ID):
+        self.con = con
+        self.library_id = library_id
+        create_manifest_if_not_exists(con)
+        rows = con.execute(f"""
+            SELECT source_path, status, snapshot_date, file_size, mtime_ns, inode, content_hash
+            FROM {MANIFEST_TABLE}
+            WHERE library_id = ?
+            ORDER BY recorded_at
+        """, [library_id]).fetchall()
+        self.entries = {row[0]: row[1:] for row in rows}
+        # ハードリンク（同じinode・サイズ・mtime）はハッシュを再計算しない
+        self.hash_by_stat = {
+            (inode, size, mtime): content_hash
+            for status, _, size, mtime, inode, content_hash in self.entries.values()
+            if content_hash is not None
+        }
+        self.snapshot_by_hash: dict[str, date] = {}
+        for status, snapshot_date, _, _, _, content_hash in self.entries.values():
+            if status == STATUS_LOADED:
+                self._remember(content_hash, snapshot_date)
+
+    def is_missing(self, backup_path: str) -> bool:
+        """以前の実行でライブラリファイルが見つからなかったバックアップか"""
+        entry = self.entries.get(backup_path)
+        return entry is not None and entry[0] == STATUS_MISSING
+
+    def is_unchanged(self, library_path: str, st: os.stat_result, snapshot_date: date) -> bool:
+        """同じ内容のまま既にロード済みのファイルか（statのみで判定）"""
+        entry = self.entries.get(library_path)
+        if entry is None or entry[0] not in DONE_STATUSES:
+            return False
+        _, loaded_date, size, mtime, inode, _ = entry
+        return (loaded_date, size, mtime, inode) == (snapshot_date, st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def is_loaded(self, library_path: str, st: os.stat_result) -> bool:
+        """このファイルを今の内容でロード済みか（statが変わっていれば内容ハッシュで判定）"""
+        entry = self.entries.get(library_path)
+        if entry is None or entry[0] not in DONE_STATUSES:
+            return False
+        _, _, size, mtime, inode, loaded_hash = entry
+        if (size, mtime, inode) == (st.st_size, st.st_mtime_ns, st.st_ino):
+            return True
+        return self.content_hash(library_path, st) == loaded_hash
+
+    def content_hash(self, library_path: str, st: os.stat_result) -> str:
+        """内容ハッシュ。既知のinodeならファイルを読まずに返す"""
+        key = (st.st_ino, st.st_size, st.st_mtime_ns)
+        if key not in self.hash_by_stat:
+            self.hash_by_stat[key] = hash_file(library_path)
+        return self.hash_by_stat[key]
+
+    def loaded_snapshot_for(self, content_hash: str) -> date | None:
+        """同じ内容をロード済みのスナップショット日付"""
+        return self.snapshot_by_hash.get(content_hash)
+
+    def record_loaded(self, library_path: str, backup_date: datetime,
+                      st: os.stat_result, content_hash: str, track_count: int):
+        """ロードしたファイルを記録"""
+        self._upsert(library_path, STATUS_LOADED, backup_date, backup_date.date(),
+                     st.st_size, st.st_mtime_ns, st.st_ino, content_hash, track_count)
+        self._remember(content_hash, backup_date.date())
+
+    def record_same_content(self, source_path: str, st: os.stat_result, content_hash: str,
+                            backup_date: datetime | None = None) -> bool:
+        """ロード済みと同じ内容の別のファイルを、ロード済みの記録と同じ日付で記録する（同じ内容が無ければ False）"""
+        snapshot_date = self.loaded_snapshot_for(content_hash)
+        if snapshot_date is None:
+            return False
+        loaded_backup_date, track_count = self.con.execute(f"""
+            SELECT backup_date, track_count
+            FROM {MANIFEST_TABLE}
+            WHERE library_id = ? AND content_hash = ? AND snapshot_date = ? AND status = ?
+            ORDER BY recorded_at DESC
+            LIMIT 1
+        """, [self.library_id, content_hash, snapshot_date, STATUS_LOADED]).fetchone()
+        self._upsert(source_path, STATUS_LOADED, backup_date or loaded_backup_date, snapshot_date,
+                     st.st_size, st.st_mtime_ns, st.st_ino, content_hash, track_count)
+        return True
+
+    def record_missing(self, backup_path: str, backup_date: datetime):
+        """ライブラリファイルが無かったバックアップを記録"""
+        self._upsert(backup_path, STATUS_MISSING, backup_date, None,
+                     None, None, None, None, None)
+
+    def _remember(self, content_hash: str, snapshot_date: date):
+        # 同じ日付に後から別内容がロードされたら、古いハッシュの対応は無効
+        for known_hash, known_date in list(self.snapshot_by_hash.items()):
+            if known_date == snapshot_date:
+                del self.snapshot_by_hash[known_hash]
+        self.snapshot_by_hash[content_hash] = snapshot_date
+
+    def _upsert(self, source_path, status, backup_date, snapshot_date,
+                file_size, mtime_ns, inode, content_hash, track_count):
+        self.con.execute(f"""
+            INSERT OR REPLACE INTO {MANIFEST_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, now()::TIMESTAMP)
+        """, [self.library_id, source_path, status, backup_date, snapshot_date,
+              file_size, mtime_ns, inode, content_hash, track_count])
+        self.entries[source_path] = (status, snapshot_date, file_size, mtime_ns, inode, content_hash)
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+watch_snapshots.py
+スナップショットを監視して自動でロードし、影響のあるdbtモデルだけを再実行する
+
+data/snapshots/ 以下の *.xml / *.csv（.gz / .zst に圧縮したものを含む）と、--library で指定したライブラリファイル
+（Music.appが書き出す Music Library.xml など）をポーリングで監視する。
+--snapshots / --library は ID=PATH の形でライブラリIDを指定でき、メンバーごとのファイルを
+1つのwatchでそれぞれのライブラリにロードする（IDを省略したら default）。
+
+- ファイルの変化が --debounce 秒止まるまで待ってから処理する（書き込み途中を読まない）
+- その間に変化したファイルはまとめて1サイクルで処理し、dbt run は1回だけ実行する
+- dbt は bronze_itunes_library+ と bronze_snapshots+ だけを選択し、incrementalモデルは
+  ロードしたライブラリだけを処理する（dbt var の library_ids）
+- ロード済みかどうかはマニフェスト（snapshot_manifest）で判定し、内容が同じなら読み直さない
+  （archive_snapshots.py で圧縮したなど、パスが変わってもロード済みの内容ならそのまま記録する）
+- dbtで処理済みの最新日より古いスナップショットをロードしたときは --full-refresh で実行する
+- --publish を付けると、dbt run が成功するたびに gold/platinum を読み取り専用のファイルとして公開する
+  （publish_warehouse.py）
+
+DuckDBファイルはサイクルごとに開いて閉じるので、待機中は dbt や分析クエリを自由に実行できる。
+起動時に既にあるファイルはロード済みとみなす（--scan でマニフェストにないものをロードする）。
+"""
+
+import argparse
+import os
+import shlex
+import subprocess
+import sys
+import time
+from datetime import date, datetime
+from pathlib import Path
+
+import duckdb
+
+from ingest import (
+    DEFAULT_LIBRARY_ID, LIBRARY_ID_PATTERN, STORAGE_FULL, STORAGE_HELP, STORAGE_LAKE, STORAGES,
+)
+from load_audit import STATUS_FAILED, STATUS_LOADED, LoadAudit, new_run_id
+import load_csv_snapshot
+import load_xml_snapshot
+from publish_warehouse import PUBLISH_DB, publish
+import snapshot_lake
+from snapshot_compression import snapshot_format
+from snapshot_manifest import SnapshotManifest
+
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+SNAPSHOTS_DIR = "data/snapshots"
+OUTPUT_DB = "music_replay.duckdb"
+
+# 新しいスナップショットの影響を受けるモデル
+DEFAULT_SELECT = "bronze_itunes_library+ bronze_snapshots+"
+
+# dbt が失敗したときに再実行するまでの待ち時間（秒）
+DBT_RETRY_SECONDS = 60
+
+# 拡張子ごとの（パース関数, DuckDBへのロード関数, レイクへのロード関数）
+LOADERS = {
+    ".xml": (load_xml_snapshot.parse_music_library,
+             load_xml_snapshot.load_to_duckdb, load_xml_snapshot.load_to_lake),
+    ".csv": (load_csv_snapshot.parse_csv_library,
+             load_csv_snapshot.load_to_duckdb, load_csv_snapshot.load_to_lake),
+}
+
+
+def latest_built_snapshots(db_path: Path) -> dict[str, date]:
+    """bronze_itunes_library に取り込み済みの、ライブラリごとの最新のスナップショット日"""
+    if not db_path.exists():
+        return {}
+    con = duckdb.connect(str(db_path))
+    try:
+        return dict(con.execute("""
+            SELECT library_id, MAX(snapshot_date) FROM bronze_itunes_library GROUP BY library_id
+        """).fetchall())
+    except duckdb.CatalogException:
+        return {}
+    finally:
+        con.close()
+
+
+def parse_source(value: str) -> tuple[str, str]:
+    """--snapshots / --library の値 [ID=]PATH を（ライブラリID, パス）にする"""
+    library_id, sep, path = value.partition("=")
+    if sep and LIBRARY_ID_PATTERN.fullmatch(library_id):
+        return library_id, path
+    return DEFAULT_LIBRARY_ID, value
+
+
+def log(message: str):
+    """時刻付きで出力"""
+    print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] {message}", flush=True)
+
+
+def file_signature(path: Path) -> tuple[int, int, int] | None:
+    """変化の検出に使う（サイズ, mtime, inode）。ファイルがなければNone"""
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+class SnapshotWatcher:
+    """ポーリングでファイルの変化を追い、落ち着いたファイルをまとめて処理する"""
+
+    def __init__(self, args):
+        self.args = args
+        self.snapshot_dirs = [(library_id, resolve(path)) for library_id, path in args.snapshots]
+        self.libraries = {resolve(path): library_id for library_id, path in args.library}
+        # 監視しているファイル → ライブラリID
+        self.library_of: dict[Path, str] = dict(self.libraries)
+        self.db_path = resolve(args.db)
+        self.publish_path = resolve(args.publish) if args.publish else None
+        self.lake_dir = resolve(args.lake)
+        self.use_lake = args.storage == STORAGE_LAKE
+        self.run_id = new_run_id()
+        # 前回のポーリングで見えたシグネチャと、その変化を最後に観測した時刻
+        self.observed: dict[Path, tuple] = {}
+        self.changed_at: dict[Path, float] = {}
+        # 処理済み（ロード済み・スキップ済み）のシグネチャ
+        self.handled: dict[Path, tuple] = {}
+        self.needs_build = False
+        self.full_refresh = False
+        self.built_libraries: set[str] = set()
+        self.build_after = 0.0
+
+    def scan(self) -> dict[Path, tuple]:
+        """監視対象のファイルと現在のシグネチャ"""
+        files = {}
+        for library_id, snapshots_dir in self.snapshot_dirs:
+            if not snapshots_dir.exists():
+                continue
+            for path in snapshots_dir.rglob("*"):
+                if snapshot_format(path) in LOADERS and not path.name.startswith("."):
+                    files[path] = file_signature(path)
+                    self.library_of.setdefault(path, library_id)
+        for path in self.libraries:
+            files[path] = file_signature(path)
+        return {path: sig for path, sig in files.items() if sig is not None}
+
+    def start(self):
+        """起動時のファイルを記録する（--scan でなければロード済みとみなす）"""
+        files = self.scan()
+        self.observed = dict(files)
+        if not self.args.scan:
+            self.handled = dict(files)
+        dirs = ", ".join(f"{path} ({library_id})" for library_id, path in self.snapshot_dirs)
+        log(f"Watching {dirs} and {len(self.libraries)} library file(s), "
+            f"{len(files)} file(s) present")
+
+    def poll(self, now: float) -> list[Path]:
+        """変化を記録し、全体が --debounce 秒落ち着いていれば未処理のファイルを返す"""
+        files = self.scan()
+        for path, sig in files.items():
+            if self.observed.get(path) != sig:
+                self.changed_at[path] = now
+        self.observed = files
+
+        pending = [path for path, sig in files.items() if self.handled.get(path) != sig]
+        if not pending:
+            return []
+        last_change = max(self.changed_at.get(path, 0.0) for path in pending)
+        if now - last_change < self.args.debounce:
+            return []
+        # スナップショットは日付のディレクトリ順、ライブラリファイルは最後に処理する
+        return sorted(pending, key=lambda path: (path in self.libraries, str(path)))
+
+    def process(self, paths: list[Path]):
+        """落ち着いたファイルをロードし、1つでもロードできればdbtを実行する"""
+        built_until = latest_built_snapshots(self.db_path)
+        manifest_db = snapshot_lake.manifest_path(self.lake_dir) if self.use_lake else self.db_path
+        manifest_db.parent.mkdir(parents=True, exist_ok=True)
+        con = duckdb.connect(str(manifest_db))
+        try:
+            manifests = {}
+            for path in paths:
+                sig = self.observed[path]
+                st = path.stat()
+                library_id = self.library_of[path]
+                if library_id not in manifests:
+                    manifests[library_id] = SnapshotManifest(con, library_id)
+                manifest = manifests[library_id]
+                try:
+                    content_hash = None if manifest.is_loaded(str(path), st) else manifest.content_hash(str(path), st)
+                except Exception:
+                    # 展開できないファイルはロードで失敗として記録する
+                    content_hash = ""
+                if content_hash is None:
+                    log(f"Unchanged: {path}")
+                elif content_hash and manifest.record_same_content(str(path), st, content_hash):
+                    # 圧縮・コピーしたファイルなど、内容がロード済みのものは読み直さない
+                    log(f"Already loaded (same content): {path}")
+                elif snapshot_date := self.load(path, st, manifest):
+                    self.needs_build = True
+                    self.built_libraries.add(library_id)
+                    # incrementalモデルはライブラリの最新日より古い日付を取り込まないため作り直す
+                    latest = built_until.get(library_id)
+                    if latest is not None and snapshot_date.date() < latest:
+                        self.full_refresh = True
+                self.handled[path] = sig
+        finally:
+            con.close()
+
+    def load(self, path: Path, st: os.stat_result, manifest: SnapshotManifest) -> datetime | None:
+        """1ファイルをロードしてマニフェストに記録する（ロードしたスナップショット日時を返す）"""
+        parse, load_to_duckdb, load_to_lake = LOADERS[snapshot_format(path)]
+        loader = snapshot_format(path).lstrip(".")
+        audit = LoadAudit(self.run_id, loader, self.args.storage, str(path), manifest.library_id)
+        audit.file_size = st.st_size
+        log(f"Loading {path} ({manifest.library_id})")
+
+        snapshot_date = None
+        try:
+            # 壊れたファイルでも監視を止めず、失敗として記録して処理済みにする
+            snapshot_date, tracks = parse(str(path), audit)
+            if snapshot_date and tracks:
+                if self.use_lake:
+                    load_to_lake(str(self.lake_dir), snapshot_date, str(path), tracks, audit,
+                                 manifest.library_id)
+                else:
+                    load_to_duckdb(str(self.db_path), snapshot_date, str(path), tracks,
+                                   self.args.storage, audit, manifest.library_id)
+        except Exception as e:
+            audit.error = str(e)
+        if audit.status != STATUS_LOADED:
+            log(f"Failed to load {path}: {audit.error or 'no tracks'}")
+            audit.finish(STATUS_FAILED, snapshot_date=snapshot_date, error=audit.error)
+            audit.record(manifest.con)
+            return None
+
+        manifest.record_loaded(str(path), snapshot_date, st,
+                               manifest.content_hash(str(path), st), audit.rows_loaded)
+        return snapshot_date
+
+    def build(self, now: float):
+        """影響のあるdbtモデルだけを実行する（失敗したら少し待って再実行）"""
+        if not self.needs_build or now < self.build_after:
+            return
+        library_ids = ", ".join(f"'{library_id}'" for library_id in sorted(self.built_libraries))
+        dbt_vars = f"raw_storage: {self.args.storage}, library_ids: [{library_ids}]"
+        if self.use_lake:
+            dbt_vars += f", raw_lake_path: '{self.lake_dir}'"
+        command = shlex.split(self.args.dbt) + [
+            "run", "--profiles-dir", ".", "--select", *self.args.select.split(), "--vars", f"{{{dbt_vars}}}",
+        ]
+        if self.full_refresh:
+            command.append("--full-refresh")
+        log(f"Running: {shlex.join(command)}")
+        started = time.perf_counter()
+        result = subprocess.run(command, cwd=PROJECT_DIR)
+        if result.returncode == 0:
+            log(f"dbt finished in {time.perf_counter() - started:.1f}s")
+            self.needs_build = False
+            self.full_refresh = False
+            self.built_libraries.clear()
+            if self.publish_path is not None:
+                self.publish()
+        else:
+            log(f"dbt failed (exit {result.returncode}); retrying in {DBT_RETRY_SECONDS}s")
+            self.build_after = time.monotonic() + DBT_RETRY_SECONDS
+
+    def publish(self):
+        """dbt run の結果を公開する（失敗しても前に公開したファイルはそのまま残る）"""
+        started = time.perf_counter()
+        try:
+            copied = publish(self.db_path, self.publish_path)
+        except (duckdb.Error, RuntimeError, OSError) as e:
+            log(f"Publish failed: {e}")
+            return
+        log(f"Published {len(copied)} tables to {self.publish_path} in {time.perf_counter() - started:.1f}s")
+
+    def run_once(self):
+        """1サイクル分の処理"""
+        ready = self.poll(time.monotonic())
+        if ready:
+            self.process(ready)
+        self.build(time.monotonic())
+
+
+def resolve(path: str) -> Path:
+    """相対パスはプロジェクトルートからのパスにする"""
+    path = Path(path).expanduser()
+    return path if path.is_absolute() else PROJECT_DIR / path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='スナップショットを監視して自動でロード・dbt runする')
+    parser.add_argument('--snapshots', type=parse_source, action='append', default=[], metavar='[ID=]DIR',
+                        help=f'監視するスナップショットのディレクトリ（複数指定可、省略時は {SNAPSHOTS_DIR}）')
+    parser.add_argument('--library', type=parse_source, action='append', default=[], metavar='[ID=]PATH',
+                        help='監視するライブラリファイル（例: "alice=~/Music/Music/Music Library.xml"、複数指定可）')
+    parser.add_argument('--db', default=OUTPUT_DB, help='DuckDBファイルのパス')
+    parser.add_argument('--storage', choices=STORAGES, default=STORAGE_FULL, help=STORAGE_HELP)
+    parser.add_argument('--lake', default=snapshot_lake.LAKE_DIR,
+                        help='--storage lake のときのParquetレイクのディレクトリ')
+    parser.add_argument('--interval', type=float, default=5.0, help='ポーリング間隔（秒）')
+    parser.add_argument('--debounce', type=float, default=10.0,
+                        help='最後の変化からこの秒数だけ落ち着いてから処理する')
+    parser.add_argument('--select', default=DEFAULT_SELECT, help='dbt run で選択するモデル')
+    parser.add_argument('--dbt', default='dbt', help='dbtコマンド')
+    parser.add_argument('--publish', nargs='?', const=PUBLISH_DB, metavar='PATH',
+                        help=f'dbt run の成功後にgold/platinumを公開する（省略時は {PUBLISH_DB}）')
+    parser.add_argument('--scan', action='store_true',
+                        help='起動時に既にあるファイルのうち、マニフェストにないものもロードする')
+    parser.add_argument('--once', action='store_true',
+                        help='待たずに1回だけ処理して終了する（--scan と組み合わせてcronから使う）')
+    args = parser.parse_args()
+    if not args.snapshots:
+        args.snapshots = [parse_source(SNAPSHOTS_DIR)]
+
+    watcher = SnapshotWatcher(args)
+    watcher.start()
+    if args.once:
+        args.debounce = 0
+        watcher.run_once()
+        sys.exit(1 if watcher.needs_build else 0)
+
+    try:
+        while True:
+            watcher.run_once()
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        log("Stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+-- fact_daily_track_plays の配分を確認する
+--   - スナップショット区間ごとの日別再生数の合計が play_count_delta と一致する
+--   - 日付が区間（前回スナップショットの翌日〜今回のスナップショット日）の中にある
+-- 問題のある行が返ればテスト失敗
+
+WITH
+deltas AS (
+    SELECT
+        library_id,
+        track_key,
+        snapshot_date,
+        prev_snapshot_date,
+        play_count_delta
+    FROM {{ ref('fact_play_count_snapshot') }}
+    WHERE play_count_delta > 0
+),
+
+daily AS (
+    SELECT
+        library_id,
+        track_key,
+        snapshot_date,
+        SUM(play_count) AS play_count,
+        MIN(play_date) AS first_play_date,
+        MAX(play_date) AS last_play_date
+    FROM {{ ref('fact_daily_track_plays') }}
+    GROUP BY
+        library_id,
+        track_key,
+        snapshot_date
+),
+
+mismatched AS (
+    SELECT
+        COALESCE(d.library_id, s.library_id) AS library_id,
+        COALESCE(d.track_key, s.track_key) AS track_key,
+        COALESCE(d.snapshot_date, s.snapshot_date) AS snapshot_date,
+        d.play_count_delta,
+        s.play_count AS daily_play_count,
+        s.first_play_date,
+        s.last_play_date
+    FROM deltas AS d
+    FULL OUTER JOIN daily AS s
+        ON d.library_id = s.library_id
+        AND d.track_key = s.track_key
+        AND d.snapshot_date = s.snapshot_date
+    WHERE d.play_count_delta IS DISTINCT FROM s.play_count
+        OR s.first_play_date <= d.prev_snapshot_date
+        OR s.last_play_date > d.snapshot_date
+)
+
+SELECT * FROM mismatched
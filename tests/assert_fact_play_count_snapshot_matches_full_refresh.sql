@@ -0,0 +1,60 @@
+-- incrementalで積み上げた fact_play_count_snapshot が
+-- silver_tracks 全履歴からのフルリフレッシュ結果と完全に一致することを確認する
+-- 差分のある行が返ればテスト失敗
+
+WITH
+full_refresh AS (
+    SELECT
+        library_id,
+        track_key,
+        track_persistent_id,
+        snapshot_date,
+        play_count,
+        skip_count,
+        last_played_at_utc,
+        duration_min,
+        play_count - LAG(play_count) OVER w AS play_count_delta,
+        skip_count - LAG(skip_count) OVER w AS skip_count_delta,
+        COALESCE(prev_snapshot_date, LAG(snapshot_date) OVER w) AS prev_snapshot_date
+    FROM {{ ref('silver_tracks') }}
+    WINDOW w AS (
+        PARTITION BY library_id, track_key
+        ORDER BY snapshot_date
+    )
+),
+
+incremental AS (
+    SELECT
+        library_id,
+        track_key,
+        track_persistent_id,
+        snapshot_date,
+        play_count,
+        skip_count,
+        last_played_at_utc,
+        duration_min,
+        play_count_delta,
+        skip_count_delta,
+        prev_snapshot_date
+    FROM {{ ref('fact_play_count_snapshot') }}
+),
+
+missing_from_incremental AS (
+    SELECT 'missing_from_incremental' AS diff, * FROM (
+        SELECT * FROM full_refresh
+        EXCEPT ALL
+        SELECT * FROM incremental
+    )
+),
+
+unexpected_in_incremental AS (
+    SELECT 'unexpected_in_incremental' AS diff, * FROM (
+        SELECT * FROM incremental
+        EXCEPT ALL
+        SELECT * FROM full_refresh
+    )
+)
+
+SELECT * FROM missing_from_incremental
+UNION ALL
+SELECT * FROM unexpected_in_incremental
@@ -0,0 +1,55 @@
+-- サロゲートキーの整合性を確認する
+--   - キーマップでキーと（ライブラリ, 値）が1対1に対応している
+--   - 値のある silver_tracks の行には必ずキーが付いている
+-- 問題のある行が返ればテスト失敗
+
+WITH
+key_maps AS (
+    SELECT 'track' AS key_type, track_key AS key, library_id, track_persistent_id AS value
+    FROM {{ ref('silver_track_keys') }}
+    UNION ALL
+    SELECT 'artist', artist_key, library_id, artist_name
+    FROM {{ ref('silver_artist_keys') }}
+    UNION ALL
+    SELECT 'album', album_key, library_id, album_name || chr(31) || COALESCE(album_artist_name, '')
+    FROM {{ ref('silver_album_keys') }}
+    UNION ALL
+    SELECT 'genre', genre_key, library_id, genre
+    FROM {{ ref('silver_genre_keys') }}
+),
+
+duplicated_keys AS (
+    SELECT key_type, CAST(key AS VARCHAR) AS detail
+    FROM key_maps
+    GROUP BY key_type, key
+    HAVING COUNT(*) > 1
+),
+
+duplicated_values AS (
+    SELECT key_type, library_id || ': ' || value AS detail
+    FROM key_maps
+    GROUP BY key_type, library_id, value
+    HAVING COUNT(*) > 1
+),
+
+missing_keys AS (
+    SELECT
+        CASE
+            WHEN track_key IS NULL THEN 'track'
+            WHEN artist_key IS NULL AND artist_name IS NOT NULL THEN 'artist'
+            WHEN album_key IS NULL AND album_name IS NOT NULL THEN 'album'
+            ELSE 'genre'
+        END AS key_type,
+        library_id || ': ' || track_persistent_id AS detail
+    FROM {{ ref('silver_tracks') }}
+    WHERE track_key IS NULL
+        OR (artist_key IS NULL AND artist_name IS NOT NULL)
+        OR (album_key IS NULL AND album_name IS NOT NULL)
+        OR (genre_key IS NULL AND genre IS NOT NULL)
+)
+
+SELECT 'duplicated key' AS problem, * FROM duplicated_keys
+UNION ALL
+SELECT 'duplicated value', * FROM duplicated_values
+UNION ALL
+SELECT 'missing key', * FROM missing_keys